@@ -0,0 +1,279 @@
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Literal
+
+from app.models import Todo
+from app.storages.base import AsyncTodoStorage
+
+EventType = Literal["create", "update", "delete"]
+
+
+@dataclass(slots=True, frozen=True)
+class TodoEvent:
+    seq: int
+    type: EventType
+    todo_id: int
+    # the todo after the change, None for deletions
+    todo: Todo | None = None
+
+
+# users nobody follows have no log; their events are only numbered, with a
+# counter shared by every user_id modulo this, so that a later log carries on
+# above any number they were given
+IDLE_COUNTERS = 4096
+
+
+class _UserLog:
+    def __init__(self, history: int, start: int):
+        self.seq = start
+        # every event of the user numbered above `start` is in `events`
+        self.start = start
+        self.events: deque[TodoEvent] = deque(maxlen=history)
+        self.subscriptions: set["Subscription"] = set()
+
+
+class ChangeFeed:
+    """Numbered stream of every user's todo changes.
+
+    Each user's events are numbered in increasing order. While someone follows
+    a user, their latest `history` events are kept, so a client that
+    reconnects can resume after the last sequence number it saw instead of
+    downloading the whole list again; the log is dropped with its last
+    subscription, and a client resuming later reloads its list.
+    Publishing is thread-safe; subscriptions are awaited on an event loop.
+    """
+
+    def __init__(self, history: int = 256):
+        self.history = history
+        self._lock = threading.Lock()
+        self._users: dict[int, _UserLog] = {}
+        self._idle_seqs = [0] * IDLE_COUNTERS
+
+    def publish(
+        self, user_id: int, type: EventType, todo_id: int, todo: Todo | None = None
+    ) -> TodoEvent:
+        with self._lock:
+            log = self._users.get(user_id)
+            if log is None:
+                slot = user_id % IDLE_COUNTERS
+                self._idle_seqs[slot] += 1
+                return TodoEvent(self._idle_seqs[slot], type, todo_id, todo)
+            log.seq += 1
+            event = TodoEvent(log.seq, type, todo_id, todo)
+            if len(log.events) == log.events.maxlen:
+                log.start = log.events[0].seq
+            log.events.append(event)
+            subscriptions = list(log.subscriptions)
+        for subscription in subscriptions:
+            subscription._notify()
+        return event
+
+    def latest_seq(self, user_id: int) -> int:
+        with self._lock:
+            return self._latest(user_id)
+
+    def _latest(self, user_id: int) -> int:
+        log = self._users.get(user_id)
+        if log is None:
+            return self._idle_seqs[user_id % IDLE_COUNTERS]
+        return log.seq
+
+    def events_since(self, user_id: int, seq: int) -> list[TodoEvent] | None:
+        """Events numbered after `seq`, or None if some of them are gone.
+
+        None also covers a `seq` this feed never issued, e.g. one from before
+        a restart; the client then has to reload its list.
+        """
+        with self._lock:
+            latest = self._latest(user_id)
+            if seq > latest or seq < 0:
+                return None
+            if seq == latest:
+                return []
+            log = self._users.get(user_id)
+            if log is None or seq < log.start:
+                return None
+            return [event for event in log.events if event.seq > seq]
+
+    def subscribe(self, user_id: int, since: int) -> "Subscription":
+        subscription = Subscription(self, user_id, since)
+        with self._lock:
+            log = self._users.get(user_id)
+            if log is None:
+                log = self._users[user_id] = _UserLog(
+                    self.history, self._latest(user_id)
+                )
+            log.subscriptions.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: "Subscription") -> None:
+        user_id = subscription.user_id
+        with self._lock:
+            log = self._users.get(user_id)
+            if log is None:
+                return
+            log.subscriptions.discard(subscription)
+            if not log.subscriptions:
+                del self._users[user_id]
+                slot = user_id % IDLE_COUNTERS
+                self._idle_seqs[slot] = max(self._idle_seqs[slot], log.seq)
+
+
+class Subscription:
+    """A client following one user's events from the running event loop."""
+
+    def __init__(self, feed: ChangeFeed, user_id: int, since: int):
+        self.feed = feed
+        self.user_id = user_id
+        self.seq = since
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def _notify(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # the loop is already closed; nobody is waiting any more
+            pass
+
+    async def next(self, timeout: float) -> list[TodoEvent] | None:
+        """Wait up to `timeout` seconds for events after the last one returned.
+
+        Returns an empty list on timeout and None when the client has to
+        reload its list because events were missed.
+        """
+        self._wakeup.clear()
+        events = self.feed.events_since(self.user_id, self.seq)
+        if events == []:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                return []
+            events = self.feed.events_since(self.user_id, self.seq)
+        if events is None:
+            # carry on from here once the client has reloaded
+            self.seq = self.feed.latest_seq(self.user_id)
+        elif events:
+            self.seq = events[-1].seq
+        return events
+
+    def close(self) -> None:
+        self.feed._unsubscribe(self)
+
+
+class PolledFeed:
+    """Follows users' changes by polling the storage.
+
+    A ChangeFeed only sees the changes made through its own process, so when
+    several processes serve one storage the streams are fed from the storage's
+    per-user versions instead, which count every change. Sequence numbers are
+    then versions, and new todos arrive as updates, because the storage does
+    not tell the two apart.
+
+    However many streams follow a user, one task polls the user's version
+    every `interval` seconds; a stream only reads the changes themselves once
+    the version has moved past its own.
+    """
+
+    def __init__(self, storage: AsyncTodoStorage, interval: float):
+        self.storage = storage
+        self.interval = interval
+        self._pollers: dict[int, _VersionPoller] = {}
+
+    def subscribe(self, user_id: int, since: int) -> "PolledSubscription":
+        poller = self._pollers.get(user_id)
+        if poller is None:
+            poller = self._pollers[user_id] = _VersionPoller(self, user_id)
+        subscription = PolledSubscription(self, poller, since)
+        poller.subscriptions.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: "PolledSubscription") -> None:
+        poller = subscription.poller
+        poller.subscriptions.discard(subscription)
+        if not poller.subscriptions and self._pollers.get(poller.user_id) is poller:
+            del self._pollers[poller.user_id]
+            poller.stop()
+
+
+class _VersionPoller:
+    """The task polling one user's version for the streams following them."""
+
+    def __init__(self, feed: PolledFeed, user_id: int):
+        self.feed = feed
+        self.user_id = user_id
+        self.version: int | None = None
+        self.subscriptions: set["PolledSubscription"] = set()
+        self._error: Exception | None = None
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                version = await self.feed.storage.get_version(self.user_id)
+            except Exception as e:
+                # the streams fail with the error, as if they had polled
+                self._error = e
+                self._changed.set()
+                return
+            if version != self.version:
+                self.version = version
+                # wake the waiting streams; later waits start afresh
+                self._changed.set()
+                self._changed = asyncio.Event()
+            await asyncio.sleep(self.feed.interval)
+
+    async def wait_past(self, seq: int, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the version to differ from `seq`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.version is None or self.version == seq:
+            if self._error is not None:
+                raise self._error
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except TimeoutError:
+                return False
+        return True
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+class PolledSubscription:
+    """A client following one user's changes through a PolledFeed."""
+
+    def __init__(self, feed: PolledFeed, poller: _VersionPoller, since: int):
+        self.feed = feed
+        self.poller = poller
+        self.user_id = poller.user_id
+        self.seq = since
+
+    async def next(self, timeout: float) -> list[TodoEvent] | None:
+        """Like `Subscription.next`, for the changes the poller notices."""
+        if not await self.poller.wait_past(self.seq, timeout):
+            return []
+        storage = self.feed.storage
+        changes = await storage.get_changes(self.user_id, self.seq)
+        if changes is None:
+            self.seq = await storage.get_version(self.user_id)
+            return None
+        if changes.version == self.seq:
+            return []
+        self.seq = changes.version
+        return [
+            TodoEvent(changes.version, "update", todo.id, todo)
+            for todo in changes.todos
+        ] + [
+            TodoEvent(changes.version, "delete", todo_id)
+            for todo_id in changes.deleted_ids
+        ]
+
+    def close(self) -> None:
+        self.feed._unsubscribe(self)
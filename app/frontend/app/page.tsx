@@ -5,7 +5,7 @@ import { TodoItem } from '@/components/TodoItem'
 import { Button } from "@/components/ui/button"
 import { Card } from "@/components/ui/card"
 import { LogOut } from 'lucide-react'
-import { useCallback, useEffect, useState } from 'react'
+import { useCallback, useEffect, useRef, useState } from 'react'
 
 interface Todo {
   id: number;
@@ -14,18 +14,38 @@ interface Todo {
   is_done: boolean;
 }
 
+interface TodoEvent {
+  seq: number;
+  type: 'create' | 'update' | 'delete';
+  id: number;
+  todo: Todo | null;
+}
+
+const PAGE_SIZE = 100;
+// wait before reconnecting to the change feed after it dropped
+const FEED_RETRY_MS = 2000;
+
 export default function App() {
   const [todos, setTodos] = useState<Todo[]>([])
   const [token, setToken] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
   const [newTodoId, setNewTodoId] = useState<number | null>(null)
+  const [nextAfterId, setNextAfterId] = useState<string | null>(null)
+  // the change feed is followed from the sequence number of the first page
+  const [feedStart, setFeedStart] = useState<number | null>(null)
+  const lastSeq = useRef(0)
   const apiUrl = process.env.NODE_ENV === 'production' 
     ? '' 
     : 'http://localhost:8000';
 
-  const fetchTodos = useCallback(async (authToken: string) => {
+  const fetchTodos = useCallback(async (authToken: string, afterId: string | null = null) => {
     try {
-      const response = await fetch(`${apiUrl}/todos`, {
+      // newest first, one page at a time
+      const params = new URLSearchParams({ order: 'desc', limit: String(PAGE_SIZE) });
+      if (afterId) {
+        params.set('after_id', afterId);
+      }
+      const response = await fetch(`${apiUrl}/todos?${params}`, {
         method: 'GET',
         headers: {
           'Authorization': `Bearer ${authToken}`
@@ -36,13 +56,82 @@ export default function App() {
         throw new Error('Failed to fetch todos');
       }
 
-      const data = await response.json();
-      setTodos(data.reverse());
+      const data: Todo[] = await response.json();
+      setTodos(previous => afterId ? [...previous, ...data] : data);
+      setNextAfterId(response.headers.get('X-Next-After-Id'));
+      if (!afterId) {
+        const seq = Number(response.headers.get('X-Change-Seq') ?? 0);
+        lastSeq.current = seq;
+        setFeedStart(seq);
+      }
     } catch (error) {
       alert(`Error fetching todos: ${(error as Error).message}`);
     }
   }, [apiUrl]);
 
+  const applyEvent = useCallback((event: TodoEvent) => {
+    setTodos(previous => {
+      if (event.type === 'delete') {
+        return previous.filter(todo => todo.id !== event.id);
+      }
+      const changed = event.todo as Todo;
+      if (previous.some(todo => todo.id === event.id)) {
+        return previous.map(todo => todo.id === event.id ? changed : todo);
+      }
+      // updates of todos on pages that are not loaded are ignored
+      return event.type === 'create' ? [changed, ...previous] : previous;
+    });
+  }, []);
+
+  const followChanges = useCallback(async (authToken: string, signal: AbortSignal) => {
+    while (!signal.aborted) {
+      try {
+        const response = await fetch(`${apiUrl}/todos/events?since=${lastSeq.current}`, {
+          headers: {
+            'Authorization': `Bearer ${authToken}`
+          },
+          signal,
+        });
+        if (!response.ok || !response.body) {
+          throw new Error('Failed to follow todo changes');
+        }
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          let end;
+          while ((end = buffer.indexOf('\n\n')) >= 0) {
+            const lines = buffer.slice(0, end).split('\n');
+            buffer = buffer.slice(end + 2);
+            const type = lines.find(line => line.startsWith('event: '))?.slice(7);
+            const data = lines.find(line => line.startsWith('data: '))?.slice(6);
+            if (!type || !data) continue; // keep-alive
+            const event = JSON.parse(data);
+            lastSeq.current = event.seq;
+            if (type === 'reset') {
+              // changes were missed: reload instead of applying deltas
+              fetchTodos(authToken);
+            } else {
+              applyEvent(event);
+            }
+          }
+        }
+      } catch {
+        if (signal.aborted) return;
+      }
+      await new Promise(resolve => setTimeout(resolve, FEED_RETRY_MS));
+    }
+  }, [apiUrl, applyEvent, fetchTodos]);
+
+  useEffect(() => {
+    if (!token || feedStart === null) return;
+    const controller = new AbortController();
+    followChanges(token, controller.signal);
+    return () => controller.abort();
+  }, [token, feedStart, followChanges]);
+
   useEffect(() => {
     const storedToken = localStorage.getItem('authToken');
     setToken(storedToken);
@@ -90,6 +179,8 @@ export default function App() {
     localStorage.removeItem('authToken');
     setToken(null);
     setTodos([])
+    setNextAfterId(null)
+    setFeedStart(null)
   }
 
   const addTodo = async () => {
@@ -263,6 +354,15 @@ export default function App() {
             />
           ))}
         </ul>
+        {nextAfterId && token && (
+          <Button
+            variant="outline"
+            onClick={() => fetchTodos(token, nextAfterId)}
+            className="mt-4 w-full"
+          >
+            Load more
+          </Button>
+        )}
       </Card>
     </div>
   )
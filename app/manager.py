@@ -1,17 +1,121 @@
+import asyncio
 import datetime
+import threading
+import time
+from dataclasses import replace
+from itertools import batched
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
 
 from jose import jwt
 from passlib.context import CryptContext
 
+from app.cache import LRUCache
+from app.events import ChangeFeed, EventType
+from app.metrics import stage
 from app.models import Todo, User
-from app.storages.base import NewTodo, NewUser, TodoStorage, UserStorage
+from app.password_executor import PasswordHashingExecutor
+from app.storages.async_adapter import (
+    AsyncTodoStorageAdapter,
+    AsyncUserStorageAdapter,
+)
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    AsyncTodoStorage,
+    AsyncUserStorage,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoDeletion,
+    TodoOperation,
+    TodoStorage,
+    UserStorage,
+)
 
 
-class UserManager:
-    def __init__(self, storage: UserStorage, secret_key: str):
-        self.storage = storage
+class BaseUserManager:
+    """Token and password handling shared by the sync and async managers."""
+
+    def __init__(
+        self,
+        secret_key: str,
+        token_cache_size: int = 1024,
+        token_cache_ttl: float = 60.0,
+    ):
         self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         self.secret_key = secret_key
+        # verified token -> user; an entry lives until the token's own expiry
+        # or `token_cache_ttl` seconds, whichever comes first
+        self.token_cache: LRUCache[str, User] = LRUCache(token_cache_size)
+        self.token_cache_ttl = token_cache_ttl
+        # user id -> count of updates and deletions, so that a lookup racing
+        # with one of them does not cache the user it replaced
+        self._token_generations: dict[int, int] = {}
+        self._token_lock = threading.Lock()
+
+    def create_access_token(
+        self, user_id: int, expires_delta: datetime.timedelta = None
+    ) -> str:
+        to_encode = {"user_id": user_id}
+        if not expires_delta:
+            expires_delta = datetime.timedelta(minutes=15)
+        expire = datetime.datetime.now(datetime.UTC) + expires_delta
+        to_encode.update({"exp": expire})
+        encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm="HS256")
+        return encoded_jwt
+
+    def verify_access_token(self, token: str) -> bool:
+        return self._decode_access_token(token)["user_id"]
+
+    def _decode_access_token(self, token: str) -> dict:
+        try:
+            with stage("jwt_decode"):
+                payload = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+            if payload.get("user_id") is None:
+                raise ValueError("Invalid token data")
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token expired")
+        except jwt.JWTError:
+            raise ValueError("Invalid token, could not decode")
+
+    def _forget_tokens(self, user_id: int) -> None:
+        with self._token_lock:
+            self._token_generations[user_id] = self._token_generation(user_id) + 1
+            self.token_cache.remove_if(lambda token, user: user.id == user_id)
+
+    def _token_generation(self, user_id: int) -> int:
+        return self._token_generations.get(user_id, 0)
+
+    def _cache_token(
+        self, token: str, payload: dict, user: User, generation: int
+    ) -> None:
+        """Cache the user of a token, read at `generation` of theirs."""
+        expires_at = time.time() + self.token_cache_ttl
+        if payload.get("exp") is not None:
+            expires_at = min(expires_at, payload["exp"])
+        with self._token_lock:
+            if self._token_generation(user.id) == generation:
+                self.token_cache.set(token, user, expires_at=expires_at)
+
+    def hash_password(self, password: str) -> str:
+        with stage("bcrypt_hash"):
+            return self.pwd_context.hash(password)
+
+    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        with stage("bcrypt_verify"):
+            return self.pwd_context.verify(plain_password, hashed_password)
+
+
+class UserManager(BaseUserManager):
+    def __init__(
+        self,
+        storage: UserStorage,
+        secret_key: str,
+        token_cache_size: int = 1024,
+        token_cache_ttl: float = 60.0,
+    ):
+        super().__init__(secret_key, token_cache_size, token_cache_ttl)
+        self.storage = storage
 
     def create_user(self, username: str, email: str, password: str) -> User:
         if self.storage.get_user_by_username(username):
@@ -34,44 +138,23 @@ class UserManager:
             raise ValueError("Invalid password")
         return user
 
-    def create_access_token(
-        self, user_id: int, expires_delta: datetime.timedelta = None
-    ) -> str:
-        to_encode = {"user_id": user_id}
-        if not expires_delta:
-            expires_delta = datetime.timedelta(minutes=15)
-        expire = datetime.datetime.now(datetime.UTC) + expires_delta
-        to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm="HS256")
-        return encoded_jwt
-
     def get_user_by_token(self, token: str) -> User:
-        user_id = self.verify_access_token(token)
-        return self.storage.get_user_by_id(user_id)
-
-    def verify_access_token(self, token: str) -> bool:
-        try:
-            payload = jwt.decode(token, self.secret_key, algorithms=["HS256"])
-            user_id: int | None = payload.get("user_id")
-            if user_id is None:
-                raise ValueError("Invalid token data")
-            return user_id
-        except jwt.ExpiredSignatureError:
-            raise ValueError("Token expired")
-        except jwt.JWTError:
-            raise ValueError("Invalid token, could not decode")
+        user = self.token_cache.get(token)
+        if user is not None:
+            return user
+        payload = self._decode_access_token(token)
+        generation = self._token_generation(payload["user_id"])
+        user = self.storage.get_user_by_id(payload["user_id"])
+        if user is not None:
+            self._cache_token(token, payload, user, generation)
+        return user
 
     def get_user_by_id(self, user_id: int) -> User:
         return self.storage.get_user_by_id(user_id)
 
-    def hash_password(self, password: str) -> str:
-        return self.pwd_context.hash(password)
-
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return self.pwd_context.verify(plain_password, hashed_password)
-
     def delete_user(self, user_id: int) -> None:
         self.storage.delete_user(user_id)
+        self._forget_tokens(user_id)
 
     def update_user(
         self,
@@ -83,19 +166,53 @@ class UserManager:
         user = self.get_user_by_id(user_id)
         if user:
             if username:
-                user.username = username
+                user = replace(user, username=username)
             if email:
-                user.email = email
+                user = replace(user, email=email)
             if password:
-                user.hashed_password = self.hash_password(password)
+                user = replace(user, hashed_password=self.hash_password(password))
             self.storage.update_user(user)
+            self._forget_tokens(user_id)
             return user
         else:
             raise ValueError("User not found")
 
 
-class TaskManager:
-    def __init__(self, storage: TodoStorage):
+class BaseTaskManager:
+    """Publishes every change made through a task manager to `feed`."""
+
+    def __init__(self, feed: ChangeFeed | None = None):
+        self.feed = feed
+
+    def _publish(
+        self, user_id: int, type: EventType, todo_id: int, todo: Todo | None = None
+    ) -> None:
+        if self.feed is not None:
+            self.feed.publish(user_id, type, todo_id, todo)
+
+    @staticmethod
+    def _import_error(error: ValueError, count: int) -> ValueError:
+        # the batches before the failing one stay imported
+        return ValueError(f"{error} ({count} todos were imported before it)")
+
+    def _publish_batch(
+        self,
+        user_id: int,
+        operations: list[TodoOperation],
+        results: list[Todo | None],
+    ) -> None:
+        for operation, todo in zip(operations, results):
+            if isinstance(operation, NewTodo):
+                self._publish(user_id, "create", todo.id, todo)
+            elif isinstance(operation, TodoDeletion):
+                self._publish(user_id, "delete", operation.todo_id)
+            else:
+                self._publish(user_id, "update", todo.id, todo)
+
+
+class TaskManager(BaseTaskManager):
+    def __init__(self, storage: TodoStorage, feed: ChangeFeed | None = None):
+        super().__init__(feed)
         self.storage = storage
 
     def create_task(
@@ -105,11 +222,28 @@ class TaskManager:
             user_id=user_id, title=title, description=description, is_done=is_done
         )
         todo = self.storage.add(new_todo)
+        self._publish(user_id, "create", todo.id, todo)
         return todo
 
     def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
         return self.storage.get_tasks_by_user_id(user_id)
 
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        return self.storage.get_tasks_page(
+            user_id,
+            after_id=after_id,
+            limit=limit,
+            is_done=is_done,
+            descending=descending,
+        )
+
     def get_task_by_id(self, user_id: int, task_id: int) -> Todo:
         task = self.storage.get_task_by_id(task_id)
         if task is None:
@@ -119,32 +253,324 @@ class TaskManager:
         return task
 
     def set_task_status(self, user_id: int, task_id: int, is_done: bool) -> Todo:
-        task = self.storage.get_task_by_id(task_id)
-        if task is None:
+        return self.update_task(user_id, task_id, is_done=is_done)
+
+    def delete_task(self, user_id: int, task_id: int) -> None:
+        if not self.storage.delete_for_user(user_id, task_id):
             raise ValueError("Task not found")
-        if task.user_id != user_id:
+        self._publish(user_id, "delete", task_id)
+
+    def update_task(
+        self,
+        user_id: int,
+        task_id: int,
+        title: str = None,
+        description: str = None,
+        is_done: bool = None,
+    ) -> Todo:
+        task = self.storage.update_for_user(
+            user_id, task_id, title=title, description=description, is_done=is_done
+        )
+        if task is None:
             raise ValueError("Task not found")
-        return self.storage.update_status(task_id, is_done)
+        if title is not None or description is not None or is_done is not None:
+            # an update of no fields changes nothing subscribers could see
+            self._publish(user_id, "update", task.id, task)
+        return task
 
-    def delete_task(self, user_id: int, task_id: int) -> None:
-        task = self.storage.get_task_by_id(task_id)
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        results = self.storage.apply_batch(user_id, operations)
+        self._publish_batch(user_id, operations, results)
+        return results
+
+    def delete_tasks(self, user_id: int, task_ids: Iterable[int]) -> int:
+        """Delete the todos in one batch and return how many.
+
+        Raises ValueError, deleting none of them, if one is not the user's.
+        """
+        deletions = [TodoDeletion(task_id) for task_id in dict.fromkeys(task_ids)]
+        if deletions:
+            self.apply_batch(user_id, deletions)
+        return len(deletions)
+
+    def purge_completed(self, user_id: int) -> int:
+        """Delete the user's done todos, `TRANSFER_CHUNK` per batch, and return
+        how many."""
+        count = 0
+        after_id = None
+        while done := self.storage.get_tasks_page(
+            user_id, after_id=after_id, limit=TRANSFER_CHUNK, is_done=True
+        ):
+            try:
+                count += self.delete_tasks(user_id, (task.id for task in done))
+            except ValueError:
+                # one of them was deleted meanwhile; read the chunk again
+                continue
+            after_id = done[-1].id
+        return count
+
+    def get_version(self, user_id: int) -> int:
+        return self.storage.get_version(user_id)
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return self.storage.get_changes(user_id, since)
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        return self.storage.search(user_id, query, limit)
+
+    def export_tasks(self, user_id: int) -> Iterator[Todo]:
+        return self.storage.export_todos(user_id)
+
+    def import_tasks(self, user_id: int, todos: Iterable[NewTodo]) -> int:
+        """Create the todos in batches of `TRANSFER_CHUNK` and return how many."""
+        count = 0
+        try:
+            for chunk in batched(todos, TRANSFER_CHUNK):
+                self.apply_batch(user_id, list(chunk))
+                count += len(chunk)
+        except ValueError as e:
+            raise self._import_error(e, count)
+        return count
+
+
+class AsyncUserManager(BaseUserManager):
+    """UserManager for the async web stack.
+
+    Storage calls are awaited and bcrypt work runs on `password_executor`
+    (or a worker thread when none is given), so no call blocks the loop.
+    """
+
+    def __init__(
+        self,
+        storage: AsyncUserStorage,
+        secret_key: str,
+        password_executor: PasswordHashingExecutor | None = None,
+        token_cache_size: int = 1024,
+        token_cache_ttl: float = 60.0,
+    ):
+        super().__init__(secret_key, token_cache_size, token_cache_ttl)
+        self.storage = storage
+        self.password_executor = password_executor
+
+    @classmethod
+    def from_sync(
+        cls,
+        manager: UserManager,
+        password_executor: PasswordHashingExecutor | None = None,
+    ) -> "AsyncUserManager":
+        """Serve a UserManager's storage from worker threads.
+
+        The token cache is shared, so tokens verified by either manager are
+        reused and invalidations reach both.
+        """
+        async_manager = cls(
+            AsyncUserStorageAdapter(manager.storage),
+            manager.secret_key,
+            password_executor=password_executor,
+            token_cache_ttl=manager.token_cache_ttl,
+        )
+        async_manager.token_cache = manager.token_cache
+        return async_manager
+
+    async def _run_password_task(self, func, *args):
+        if self.password_executor is None:
+            return await asyncio.to_thread(func, *args)
+        return await self.password_executor.run(func, *args)
+
+    async def create_user(self, username: str, email: str, password: str) -> User:
+        if await self.storage.get_user_by_username(username):
+            raise ValueError("User already exists")
+        hashed_password = await self._run_password_task(self.hash_password, password)
+        new_user = NewUser(
+            username=username, email=email, hashed_password=hashed_password
+        )
+        return await self.storage.add_user(new_user)
+
+    async def login(self, username: str, password: str) -> str:
+        user = await self.authenticate_user(username, password)
+        return self.create_access_token(user.id)
+
+    async def authenticate_user(self, username: str, password: str) -> User:
+        user = await self.storage.get_user_by_username(username)
+        if not user:
+            raise ValueError("User not found")
+        if not await self._run_password_task(
+            self.verify_password, password, user.hashed_password
+        ):
+            raise ValueError("Invalid password")
+        return user
+
+    async def get_user_by_token(self, token: str) -> User:
+        user = self.token_cache.get(token)
+        if user is not None:
+            return user
+        payload = self._decode_access_token(token)
+        generation = self._token_generation(payload["user_id"])
+        user = await self.storage.get_user_by_id(payload["user_id"])
+        if user is not None:
+            self._cache_token(token, payload, user, generation)
+        return user
+
+    async def get_user_by_id(self, user_id: int) -> User:
+        return await self.storage.get_user_by_id(user_id)
+
+    async def delete_user(self, user_id: int) -> None:
+        await self.storage.delete_user(user_id)
+        self._forget_tokens(user_id)
+
+    async def update_user(
+        self,
+        user_id: int,
+        username: str = None,
+        email: str = None,
+        password: str = None,
+    ) -> User:
+        user = await self.get_user_by_id(user_id)
+        if user:
+            if username:
+                user = replace(user, username=username)
+            if email:
+                user = replace(user, email=email)
+            if password:
+                hashed_password = await self._run_password_task(
+                    self.hash_password, password
+                )
+                user = replace(user, hashed_password=hashed_password)
+            await self.storage.update_user(user)
+            self._forget_tokens(user_id)
+            return user
+        else:
+            raise ValueError("User not found")
+
+
+class AsyncTaskManager(BaseTaskManager):
+    def __init__(self, storage: AsyncTodoStorage, feed: ChangeFeed | None = None):
+        super().__init__(feed)
+        self.storage = storage
+
+    @classmethod
+    def from_sync(cls, manager: TaskManager) -> "AsyncTaskManager":
+        """Serve a TaskManager's storage from worker threads."""
+        return cls(AsyncTodoStorageAdapter(manager.storage), feed=manager.feed)
+
+    async def create_task(
+        self, user_id: int, title: str, description: str, is_done: bool = False
+    ) -> Todo:
+        new_todo = NewTodo(
+            user_id=user_id, title=title, description=description, is_done=is_done
+        )
+        todo = await self.storage.add(new_todo)
+        self._publish(user_id, "create", todo.id, todo)
+        return todo
+
+    async def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        return await self.storage.get_tasks_by_user_id(user_id)
+
+    async def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        return await self.storage.get_tasks_page(
+            user_id,
+            after_id=after_id,
+            limit=limit,
+            is_done=is_done,
+            descending=descending,
+        )
+
+    async def get_task_by_id(self, user_id: int, task_id: int) -> Todo:
+        task = await self.storage.get_task_by_id(task_id)
         if task is None:
             raise ValueError("Task not found")
         if task.user_id != user_id:
             raise ValueError("Task not found")
-        self.storage.delete(task_id)
+        return task
 
-    def update_task(
-        self, user_id: int, task_id: int, title: str = None, description: str = None
+    async def set_task_status(self, user_id: int, task_id: int, is_done: bool) -> Todo:
+        return await self.update_task(user_id, task_id, is_done=is_done)
+
+    async def delete_task(self, user_id: int, task_id: int) -> None:
+        if not await self.storage.delete_for_user(user_id, task_id):
+            raise ValueError("Task not found")
+        self._publish(user_id, "delete", task_id)
+
+    async def update_task(
+        self,
+        user_id: int,
+        task_id: int,
+        title: str = None,
+        description: str = None,
+        is_done: bool = None,
     ) -> Todo:
-        task = self.storage.get_task_by_id(task_id)
+        task = await self.storage.update_for_user(
+            user_id, task_id, title=title, description=description, is_done=is_done
+        )
         if task is None:
             raise ValueError("Task not found")
-        if task.user_id != user_id:
-            raise ValueError("Task not found")
-        if title is not None:
-            task.title = title
-        if description is not None:
-            task.description = description
-        self.storage.update(task)
+        if title is not None or description is not None or is_done is not None:
+            self._publish(user_id, "update", task.id, task)
         return task
+
+    async def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        results = await self.storage.apply_batch(user_id, operations)
+        self._publish_batch(user_id, operations, results)
+        return results
+
+    async def delete_tasks(self, user_id: int, task_ids: Iterable[int]) -> int:
+        deletions = [TodoDeletion(task_id) for task_id in dict.fromkeys(task_ids)]
+        if deletions:
+            await self.apply_batch(user_id, deletions)
+        return len(deletions)
+
+    async def purge_completed(self, user_id: int) -> int:
+        count = 0
+        after_id = None
+        while done := await self.storage.get_tasks_page(
+            user_id, after_id=after_id, limit=TRANSFER_CHUNK, is_done=True
+        ):
+            try:
+                count += await self.delete_tasks(user_id, (task.id for task in done))
+            except ValueError:
+                continue
+            after_id = done[-1].id
+        return count
+
+    async def get_version(self, user_id: int) -> int:
+        return await self.storage.get_version(user_id)
+
+    async def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return await self.storage.get_changes(user_id, since)
+
+    async def search(
+        self, user_id: int, query: str, limit: int | None = None
+    ) -> list[Todo]:
+        return await self.storage.search(user_id, query, limit)
+
+    def export_tasks(self, user_id: int) -> AsyncIterator[Todo]:
+        return self.storage.export_todos(user_id)
+
+    async def import_tasks(self, user_id: int, todos: AsyncIterable[NewTodo]) -> int:
+        """Create the todos in batches of `TRANSFER_CHUNK` and return how many."""
+        count = 0
+        chunk: list[TodoOperation] = []
+        try:
+            async for todo in todos:
+                chunk.append(todo)
+                if len(chunk) == TRANSFER_CHUNK:
+                    await self.apply_batch(user_id, chunk)
+                    count += len(chunk)
+                    chunk = []
+            if chunk:
+                await self.apply_batch(user_id, chunk)
+                count += len(chunk)
+        except ValueError as e:
+            raise self._import_error(e, count)
+        return count
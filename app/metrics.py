@@ -0,0 +1,256 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """A Prometheus histogram family, one series per combination of labels."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> (per-bucket counts, the last one for +Inf, sum)
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = (
+                    [0] * (len(self.buckets) + 1),
+                    [0.0],
+                )
+            series[0][position] += 1
+            series[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in sorted(self._series.items())
+            ]
+        for label_values, counts, total in series:
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labels, label_values)
+            )
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {total}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._histograms: list[Histogram] = []
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...]) -> Histogram:
+        histogram = Histogram(name, help, labels)
+        self._histograms.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = [line for h in self._histograms for line in h.render()]
+        return "\n".join(lines) + "\n"
+
+
+# One registry per process; with several workers, each one reports its own.
+REGISTRY = Registry()
+HTTP_REQUESTS = REGISTRY.histogram(
+    "todo_http_request_duration_seconds",
+    "Time until the response headers were sent, per route.",
+    ("method", "route", "status"),
+)
+MANAGER_CALLS = REGISTRY.histogram(
+    "todo_manager_call_duration_seconds",
+    "Duration of manager calls made by the web UI.",
+    ("manager", "method"),
+)
+STORAGE_CALLS = REGISTRY.histogram(
+    "todo_storage_call_duration_seconds",
+    "Duration of storage calls, including any hop to a worker thread.",
+    ("storage", "method"),
+)
+STAGES = REGISTRY.histogram(
+    "todo_stage_duration_seconds",
+    "Duration of the hot-path stages inside managers and storages.",
+    ("stage",),
+)
+
+# (stage, seconds) of everything timed on behalf of the current request
+_request_stages: ContextVar[list[tuple[str, float]] | None] = ContextVar(
+    "request_stages", default=None
+)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGES.observe(seconds, name)
+    record_stage(name, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a hot-path stage such as a JWT decode or a bcrypt hash."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_stages() -> Iterator[list[tuple[str, float]]]:
+    """Collect the stages timed until the block ends, across awaits and the
+    worker threads that inherit the context."""
+    stages: list[tuple[str, float]] = []
+    token = _request_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _request_stages.reset(token)
+
+
+class Instrumented:
+    """Proxy that times every public method call of a manager or storage.
+
+    Each call is observed in `histogram` as (component, method) and recorded
+    as the request stage "<kind>.<method>". Everything else, attribute
+    assignment included, goes to the wrapped object.
+    """
+
+    def __init__(self, target, histogram: Histogram, kind: str, component: str):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_histogram", histogram)
+        object.__setattr__(self, "_kind", kind)
+        object.__setattr__(self, "_component", component)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._target, name)
+        if name.startswith("_") or not inspect.ismethod(attribute):
+            return attribute
+        wrapper = self._wrap(attribute, name)
+        # later lookups find the wrapper without going through __getattr__
+        object.__setattr__(self, name, wrapper)
+        return wrapper
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._target, name, value)
+
+    def _wrap(self, method, name: str):
+        histogram, component = self._histogram, self._component
+        stage_name = f"{self._kind}.{name}"
+
+        def observe(started: float) -> None:
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed, component, name)
+            record_stage(stage_name, elapsed)
+
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    observe(started)
+
+            return timed_async
+
+        if inspect.isasyncgenfunction(method):
+
+            @functools.wraps(method)
+            async def timed_iteration(*args, **kwargs):
+                # calling the method only creates the generator; the work is
+                # done while it is iterated
+                started = time.perf_counter()
+                try:
+                    async for item in method(*args, **kwargs):
+                        yield item
+                finally:
+                    observe(started)
+
+            return timed_iteration
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                observe(started)
+
+        return timed
+
+
+def instrument_storage(storage) -> Instrumented:
+    if isinstance(storage, Instrumented):
+        return storage
+    # name adapted storages after the storage doing the work
+    component = type(getattr(storage, "storage", storage)).__name__
+    return Instrumented(storage, STORAGE_CALLS, "storage", component)
+
+
+def instrument_manager(manager) -> Instrumented:
+    if isinstance(manager, Instrumented):
+        return manager
+    return Instrumented(manager, MANAGER_CALLS, "manager", type(manager).__name__)
+
+
+def server_timing(stages: list[tuple[str, float]], total: float) -> str:
+    """A Server-Timing header value summing the stages by name."""
+    totals: dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items()]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Todo:
     id: int
     user_id: int
@@ -10,7 +10,7 @@ class Todo:
     is_done: bool
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class User:
     id: int
     username: str
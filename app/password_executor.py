@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class PasswordExecutorBusy(RuntimeError):
+    pass
+
+
+class PasswordHashingExecutor:
+    """Runs bcrypt-bound calls on a dedicated thread pool.
+
+    bcrypt releases the GIL while hashing, so a small pool keeps password work
+    off the event loop without the pickling constraints of a process pool. At
+    most `max_workers` calls run at once; once `max_queue` calls are waiting
+    for a worker, new ones are rejected instead of piling up.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int | None = 64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hashing"
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.peak_queued = 0
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self.max_queue is not None and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise PasswordExecutorBusy("Too many pending password operations")
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        def call() -> T:
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        loop = asyncio.get_running_loop()
+        # unlike asyncio.to_thread, run_in_executor does not carry the context
+        # over, which the request's stage timers live in
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, context.run, call)
+
+    def stats(self) -> dict[str, int | None]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "peak_queued": self.peak_queued,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,122 @@
+import itertools
+import linecache
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# frames of threads that are waiting for work rather than doing any
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+# a worker blocked on a C queue, e.g. in concurrent.futures or aiosqlite
+_BLOCKING_GET = re.compile(r"\.get\((block=True)?\)$")
+# requests that are never profiled: scrapes are not worth a file each, and an
+# event stream stays open, collecting every other request's samples meanwhile
+UNPROFILED_PATHS = ("/metrics", "/todos/events")
+
+
+def _is_idle(frame) -> bool:
+    filename = frame.f_code.co_filename
+    if filename.endswith(_IDLE_FILES):
+        return True
+    line = linecache.getline(filename, frame.f_lineno).strip()
+    return _BLOCKING_GET.search(line) is not None
+
+
+class SamplingProfiler:
+    """Samples every thread's stack while requests are in flight.
+
+    A background thread wakes up every `interval` seconds and adds the
+    current stack of each busy thread (the event loop and the worker threads
+    storage calls run on) to the profile of every request in progress. When
+    a request finishes its samples are written to `output_dir` as collapsed
+    stacks, one "frame;frame;frame count" line per distinct stack, which
+    flamegraph.pl and speedscope read. Concurrent requests share their
+    samples, so profiles are sharpest with one request at a time.
+
+    One request in `every` is profiled, leaving out the `UNPROFILED_PATHS`.
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.002, every: int = 1):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.every = every
+        self._requests = itertools.count()
+        os.makedirs(output_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active: set["RequestProfile"] = set()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def wants(self, path: str) -> bool:
+        """Whether to profile a request for `path`."""
+        if any(
+            path == skipped or path.startswith(skipped + "/")
+            for skipped in UNPROFILED_PATHS
+        ):
+            return False
+        return next(self._requests) % self.every == 0
+
+    def start(self, label: str) -> "RequestProfile":
+        profile = RequestProfile(self, label)
+        with self._lock:
+            self._active.add(profile)
+            self._wakeup.notify()
+        return profile
+
+    def _finish(self, profile: "RequestProfile") -> str:
+        with self._lock:
+            self._active.discard(profile)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", profile.label).strip("_")
+        path = os.path.join(
+            self.output_dir, f"{time.time_ns()}-{os.getpid()}-{name}.folded"
+        )
+        with open(path, "w") as file:
+            for stack, count in profile.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return path
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wakeup.wait()
+            stacks = [
+                self._collapse(frame)
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id and not _is_idle(frame)
+            ]
+            with self._lock:
+                # a finished profile has left the set and stays unchanged
+                # while it is written out
+                for profile in self._active:
+                    profile.samples.update(stacks)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{frame.f_lineno})"
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+class RequestProfile:
+    def __init__(self, profiler: SamplingProfiler, label: str):
+        self.profiler = profiler
+        self.label = label
+        self.samples: Counter[str] = Counter()
+
+    def finish(self) -> str:
+        """Write the profile out and return the path of the file."""
+        return self.profiler._finish(self)
@@ -1,3 +1,4 @@
 from .file_storage import get_file_storage
 from .in_memory import get_in_memory_storage
+from .sharded_sqlite_storage import get_sharded_sqlite_storage
 from .sqlite_storage import get_sqlite_storage
@@ -0,0 +1,166 @@
+import asyncio
+from itertools import islice
+from typing import AsyncIterator, Callable, TypeVar
+
+from app.models import Todo, User
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    AsyncTodoStorage,
+    AsyncUserStorage,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoOperation,
+    TodoStorage,
+    UserStorage,
+)
+
+T = TypeVar("T")
+
+
+class _SyncAdapter:
+    """Calls into a synchronous storage from coroutines.
+
+    Storages that do blocking I/O run on a worker thread; purely in-memory
+    ones (`offload=False`) are cheap enough to call on the event loop.
+    """
+
+    def __init__(self, offload: bool):
+        self.offload = offload
+
+    async def _call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        if self.offload:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+
+class AsyncUserStorageAdapter(_SyncAdapter, AsyncUserStorage):
+    def __init__(self, storage: UserStorage, offload: bool = True):
+        super().__init__(offload)
+        self.storage = storage
+
+    async def add_user(self, new_user: NewUser) -> User:
+        return await self._call(self.storage.add_user, new_user)
+
+    async def delete_user(self, user_id: int) -> None:
+        return await self._call(self.storage.delete_user, user_id)
+
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        return await self._call(self.storage.get_user_by_id, user_id)
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        return await self._call(self.storage.get_user_by_username, username)
+
+    async def get_user_by_email(self, email: str) -> User | None:
+        return await self._call(self.storage.get_user_by_email, email)
+
+    async def get_all_users(self) -> list[User]:
+        return await self._call(self.storage.get_all_users)
+
+    async def update_user(self, user: User) -> User | None:
+        return await self._call(self.storage.update_user, user)
+
+    async def flush(self) -> None:
+        return await self._call(self.storage.flush)
+
+    async def close(self) -> None:
+        return await self._call(self.storage.close)
+
+
+class AsyncTodoStorageAdapter(_SyncAdapter, AsyncTodoStorage):
+    def __init__(self, storage: TodoStorage, offload: bool = True):
+        super().__init__(offload)
+        self.storage = storage
+
+    async def add(self, new_todo: NewTodo) -> Todo:
+        return await self._call(self.storage.add, new_todo)
+
+    async def delete(self, todo_id: int) -> None:
+        return await self._call(self.storage.delete, todo_id)
+
+    async def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        return await self._call(self.storage.get_tasks_by_user_id, user_id)
+
+    async def get_task_by_id(self, todo_id: int) -> Todo | None:
+        return await self._call(self.storage.get_task_by_id, todo_id)
+
+    async def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        return await self._call(
+            self.storage.get_tasks_page,
+            user_id,
+            after_id=after_id,
+            limit=limit,
+            is_done=is_done,
+            descending=descending,
+        )
+
+    async def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        return await self._call(self.storage.update_status, todo_id, is_done)
+
+    async def update(self, todo: Todo) -> Todo | None:
+        return await self._call(self.storage.update, todo)
+
+    async def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        return await self._call(
+            self.storage.update_for_user,
+            user_id,
+            todo_id,
+            title=title,
+            description=description,
+            is_done=is_done,
+        )
+
+    async def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        return await self._call(self.storage.delete_for_user, user_id, todo_id)
+
+    async def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        return await self._call(self.storage.apply_batch, user_id, operations)
+
+    async def get_version(self, user_id: int) -> int:
+        return await self._call(self.storage.get_version, user_id)
+
+    async def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return await self._call(self.storage.get_changes, user_id, since)
+
+    async def search(
+        self, user_id: int, query: str, limit: int | None = None
+    ) -> list[Todo]:
+        return await self._call(self.storage.search, user_id, query, limit)
+
+    async def export_todos(self, user_id: int | None = None) -> AsyncIterator[Todo]:
+        todos = self.storage.export_todos(user_id)
+        # a chunk per call, as the storage reads them
+        while chunk := await self._call(lambda: list(islice(todos, TRANSFER_CHUNK))):
+            for todo in chunk:
+                yield todo
+
+    async def flush(self) -> None:
+        return await self._call(self.storage.flush)
+
+    async def close(self) -> None:
+        return await self._call(self.storage.close)
+
+
+def to_async_storage(
+    user_storage: UserStorage, todo_storage: TodoStorage, offload: bool = True
+) -> tuple[AsyncUserStorageAdapter, AsyncTodoStorageAdapter]:
+    return (
+        AsyncUserStorageAdapter(user_storage, offload=offload),
+        AsyncTodoStorageAdapter(todo_storage, offload=offload),
+    )
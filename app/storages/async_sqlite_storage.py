@@ -0,0 +1,449 @@
+from typing import AsyncIterator
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.models import Todo, User
+from app.storages.base import (
+    AsyncTodoStorage,
+    AsyncUserStorage,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoDeletion,
+    TodoOperation,
+    TodoToggle,
+    TodoUpdate,
+)
+from app.storages.sqlite_storage import (
+    DELETE_OWNED_TODO,
+    SEARCH_QUERY,
+    SQLiteEngineProfile,
+    TodoModel,
+    UserModel,
+    bump_version,
+    create_sqlite_engine,
+    delete_owned_params,
+    deleted_since_query,
+    export_todos_query,
+    install_pragmas,
+    prepare_schema,
+    record_deletions,
+    search_params,
+    time_queries,
+    version_query,
+)
+from app.storages.versions import can_answer
+
+USER_COLUMNS = (
+    UserModel.id,
+    UserModel.username,
+    UserModel.email,
+    UserModel.hashed_password,
+    UserModel.disabled,
+)
+TODO_COLUMNS = (
+    TodoModel.id,
+    TodoModel.user_id,
+    TodoModel.title,
+    TodoModel.description,
+    TodoModel.is_done,
+)
+
+
+def _to_user(row) -> User:
+    return User(
+        id=row.id,
+        username=row.username,
+        email=row.email,
+        hashed_password=row.hashed_password,
+        disabled=row.disabled,
+    )
+
+
+def _to_todo(row) -> Todo:
+    return Todo(
+        id=row.id,
+        user_id=row.user_id,
+        title=row.title,
+        description=row.description,
+        is_done=row.is_done,
+    )
+
+
+class AsyncSQLiteUserStorage(AsyncUserStorage):
+    def __init__(self, session_local: async_sessionmaker):
+        self.SessionLocal = session_local
+
+    async def close(self) -> None:
+        # both storages share the engine and disposing it twice is harmless
+        await self.SessionLocal.kw["bind"].dispose()
+
+    async def _first_user(self, *criteria) -> User | None:
+        async with self.SessionLocal() as session:
+            result = await session.execute(select(*USER_COLUMNS).where(*criteria))
+            row = result.first()
+        return _to_user(row) if row else None
+
+    async def add_user(self, new_user: NewUser) -> User:
+        async with self.SessionLocal.begin() as session:
+            result = await session.execute(
+                insert(UserModel)
+                .values(
+                    username=new_user.username,
+                    email=new_user.email,
+                    hashed_password=new_user.hashed_password,
+                    disabled=False,
+                )
+                .returning(*USER_COLUMNS)
+            )
+            return _to_user(result.one())
+
+    async def delete_user(self, user_id: int) -> None:
+        async with self.SessionLocal.begin() as session:
+            await session.execute(delete(UserModel).where(UserModel.id == user_id))
+
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        return await self._first_user(UserModel.id == user_id)
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        return await self._first_user(UserModel.username == username)
+
+    async def get_user_by_email(self, email: str) -> User | None:
+        return await self._first_user(UserModel.email == email)
+
+    async def get_all_users(self) -> list[User]:
+        async with self.SessionLocal() as session:
+            result = await session.execute(select(*USER_COLUMNS))
+            return [_to_user(row) for row in result]
+
+    async def update_user(self, user: User) -> User | None:
+        async with self.SessionLocal.begin() as session:
+            result = await session.execute(
+                update(UserModel)
+                .where(UserModel.id == user.id)
+                .values(
+                    username=user.username,
+                    email=user.email,
+                    hashed_password=user.hashed_password,
+                    disabled=user.disabled,
+                )
+            )
+        return user if result.rowcount else None
+
+
+class AsyncSQLiteTodoStorage(AsyncTodoStorage):
+    def __init__(self, session_local: async_sessionmaker):
+        self.SessionLocal = session_local
+
+    async def close(self) -> None:
+        await self.SessionLocal.kw["bind"].dispose()
+
+    async def add(self, new_todo: NewTodo) -> Todo:
+        async with self.SessionLocal.begin() as session:
+            version = await session.scalar(bump_version(new_todo.user_id))
+            result = await session.execute(
+                insert(TodoModel)
+                .values(
+                    user_id=new_todo.user_id,
+                    title=new_todo.title,
+                    description=new_todo.description,
+                    is_done=new_todo.is_done,
+                    version=version,
+                )
+                .returning(*TODO_COLUMNS)
+            )
+            return _to_todo(result.one())
+
+    @staticmethod
+    async def _delete_owned(session, user_id: int, todo_id: int) -> bool:
+        version = await session.scalar(bump_version(user_id))
+        result = await session.execute(
+            delete(TodoModel).where(
+                TodoModel.id == todo_id, TodoModel.user_id == user_id
+            )
+        )
+        if not result.rowcount:
+            # nothing changed, so neither does the version
+            await session.rollback()
+            return False
+        for statement, params in record_deletions(user_id, [todo_id], version):
+            await session.execute(statement, params)
+        await session.commit()
+        return True
+
+    async def delete(self, todo_id: int) -> None:
+        async with self.SessionLocal() as session:
+            user_id = await session.scalar(
+                select(TodoModel.user_id).where(TodoModel.id == todo_id)
+            )
+            if user_id is not None:
+                await self._delete_owned(session, user_id, todo_id)
+
+    async def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        return await self.get_tasks_page(user_id)
+
+    async def get_task_by_id(self, todo_id: int) -> Todo | None:
+        async with self.SessionLocal() as session:
+            result = await session.execute(
+                select(*TODO_COLUMNS).where(TodoModel.id == todo_id)
+            )
+            row = result.first()
+        return _to_todo(row) if row else None
+
+    async def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        query = select(*TODO_COLUMNS).where(TodoModel.user_id == user_id)
+        if is_done is not None:
+            query = query.where(TodoModel.is_done == is_done)
+        if descending:
+            if after_id is not None:
+                query = query.where(TodoModel.id < after_id)
+            query = query.order_by(TodoModel.id.desc())
+        else:
+            if after_id is not None:
+                query = query.where(TodoModel.id > after_id)
+            query = query.order_by(TodoModel.id)
+        async with self.SessionLocal() as session:
+            result = await session.execute(query.limit(limit))
+            return [_to_todo(row) for row in result]
+
+    async def _update_by_id(self, todo_id: int, values: dict):
+        async with self.SessionLocal() as session:
+            user_id = await session.scalar(
+                select(TodoModel.user_id).where(TodoModel.id == todo_id)
+            )
+            if user_id is None:
+                return None
+            version = await session.scalar(bump_version(user_id))
+            result = await session.execute(
+                update(TodoModel)
+                .where(TodoModel.id == todo_id, TodoModel.user_id == user_id)
+                .values({**values, "version": version})
+                .returning(*TODO_COLUMNS)
+            )
+            row = result.first()
+            if row is None:
+                await session.rollback()
+            else:
+                await session.commit()
+        return row
+
+    async def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        row = await self._update_by_id(todo_id, {"is_done": is_done})
+        return _to_todo(row) if row else None
+
+    async def update(self, todo: Todo) -> Todo | None:
+        row = await self._update_by_id(
+            todo.id,
+            {
+                "title": todo.title,
+                "description": todo.description,
+                "is_done": todo.is_done,
+            },
+        )
+        return todo if row else None
+
+    async def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        values = {
+            name: value
+            for name, value in (
+                ("title", title),
+                ("description", description),
+                ("is_done", is_done),
+            )
+            if value is not None
+        }
+        owned = (TodoModel.id == todo_id) & (TodoModel.user_id == user_id)
+        async with self.SessionLocal() as session:
+            if values:
+                values["version"] = await session.scalar(bump_version(user_id))
+                statement = (
+                    update(TodoModel)
+                    .where(owned)
+                    .values(values)
+                    .returning(*TODO_COLUMNS)
+                )
+            else:
+                statement = select(*TODO_COLUMNS).where(owned)
+            row = (await session.execute(statement)).first()
+            if row is None:
+                await session.rollback()
+            else:
+                await session.commit()
+        return _to_todo(row) if row else None
+
+    async def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        async with self.SessionLocal() as session:
+            return await self._delete_owned(session, user_id, todo_id)
+
+    async def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        if not operations:
+            return []
+        results = []
+        # deleted together once every operation has been checked
+        deleted: dict[int, None] = {}
+        # leaving the block with an exception rolls the whole batch back
+        async with self.SessionLocal.begin() as session:
+            version = await session.scalar(bump_version(user_id))
+            for operation in operations:
+                if isinstance(operation, NewTodo):
+                    if operation.user_id != user_id:
+                        raise ValueError("Task not found")
+                    statement = (
+                        insert(TodoModel)
+                        .values(
+                            user_id=operation.user_id,
+                            title=operation.title,
+                            description=operation.description,
+                            is_done=operation.is_done,
+                            version=version,
+                        )
+                        .returning(*TODO_COLUMNS)
+                    )
+                elif operation.todo_id in deleted:
+                    raise ValueError("Task not found")
+                elif isinstance(operation, TodoDeletion):
+                    deleted[operation.todo_id] = None
+                    results.append(None)
+                    continue
+                else:
+                    owned = (TodoModel.id == operation.todo_id) & (
+                        TodoModel.user_id == user_id
+                    )
+                    if isinstance(operation, TodoToggle):
+                        values = {"is_done": ~TodoModel.is_done}
+                    elif isinstance(operation, TodoUpdate):
+                        values = {
+                            name: value
+                            for name, value in (
+                                ("title", operation.title),
+                                ("description", operation.description),
+                                ("is_done", operation.is_done),
+                            )
+                            if value is not None
+                        }
+                    if values:
+                        statement = (
+                            update(TodoModel)
+                            .where(owned)
+                            .values({**values, "version": version})
+                            .returning(*TODO_COLUMNS)
+                        )
+                    else:
+                        statement = select(*TODO_COLUMNS).where(owned)
+                row = (await session.execute(statement)).first()
+                if row is None:
+                    raise ValueError("Task not found")
+                results.append(_to_todo(row))
+            if deleted:
+                result = await session.execute(
+                    DELETE_OWNED_TODO, delete_owned_params(user_id, list(deleted))
+                )
+                if result.rowcount != len(deleted):
+                    raise ValueError("Task not found")
+                for statement, params in record_deletions(
+                    user_id, list(deleted), version
+                ):
+                    await session.execute(statement, params)
+        return results
+
+    async def search(
+        self, user_id: int, query: str, limit: int | None = None
+    ) -> list[Todo]:
+        params = search_params(user_id, query, limit)
+        if params is None:
+            return []
+        async with self.SessionLocal() as session:
+            result = await session.execute(SEARCH_QUERY, params)
+            return [_to_todo(row) for row in result]
+
+    async def get_version(self, user_id: int) -> int:
+        async with self.SessionLocal() as session:
+            return await session.scalar(version_query(user_id)) or 0
+
+    async def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        async with self.SessionLocal() as session:
+            version = await session.scalar(version_query(user_id)) or 0
+            if not can_answer(version, since):
+                return None
+            if since == version:
+                return TodoChanges(version=version, todos=[], deleted_ids=[])
+            todos = await session.execute(
+                select(*TODO_COLUMNS)
+                .where(TodoModel.user_id == user_id, TodoModel.version > since)
+                .order_by(TodoModel.version)
+            )
+            deleted_ids = await session.scalars(deleted_since_query(user_id, since))
+            return TodoChanges(
+                version=version,
+                todos=[_to_todo(row) for row in todos],
+                deleted_ids=list(deleted_ids),
+            )
+
+    async def export_todos(self, user_id: int | None = None) -> AsyncIterator[Todo]:
+        after = None
+        while True:
+            async with self.SessionLocal() as session:
+                result = await session.execute(export_todos_query(user_id, after))
+                todos = [_to_todo(row) for row in result]
+            if not todos:
+                return
+            for todo in todos:
+                yield todo
+            after = (todos[-1].user_id, todos[-1].id)
+
+
+def create_async_sqlite_engine(
+    db_url: str, profile: SQLiteEngineProfile | None = None
+) -> AsyncEngine:
+    """Create an aiosqlite engine with the same pragmas as the sync engine."""
+    profile = profile or SQLiteEngineProfile()
+    engine = create_async_engine(
+        db_url,
+        connect_args={"timeout": profile.busy_timeout_ms / 1000},
+        # aiosqlite defaults to NullPool, which reconnects on every session
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=profile.pool_size,
+        max_overflow=profile.max_overflow,
+        pool_timeout=profile.pool_timeout,
+    )
+    install_pragmas(engine.sync_engine, profile)
+    time_queries(engine.sync_engine)
+    return engine
+
+
+def get_async_sqlite_storage(
+    db_url: str = "sqlite+aiosqlite:///app.db",
+    profile: SQLiteEngineProfile | None = None,
+) -> tuple[AsyncSQLiteUserStorage, AsyncSQLiteTodoStorage]:
+    url = make_url(db_url)
+    if url.database in (None, "", ":memory:"):
+        raise ValueError("The async sqlite storage needs a database file")
+    # create and migrate the schema up front with a short-lived sync engine
+    sync_engine = create_sqlite_engine(
+        url.set(drivername="sqlite").render_as_string(hide_password=False), profile
+    )
+    prepare_schema(sync_engine)
+    sync_engine.dispose()
+
+    engine = create_async_sqlite_engine(db_url, profile)
+    SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+    return AsyncSQLiteUserStorage(SessionLocal), AsyncSQLiteTodoStorage(SessionLocal)
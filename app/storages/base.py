@@ -1,7 +1,11 @@
 from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator
 
 from app.models import Todo, User
 
+# rows an export reads, and an import writes in one transaction, at a time
+TRANSFER_CHUNK = 1000
+
 
 @dataclass
 class NewUser:
@@ -18,6 +22,36 @@ class NewTodo:
     is_done: bool = False
 
 
+@dataclass
+class TodoUpdate:
+    todo_id: int
+    title: str | None = None
+    description: str | None = None
+    is_done: bool | None = None
+
+
+@dataclass
+class TodoToggle:
+    todo_id: int
+
+
+@dataclass
+class TodoDeletion:
+    todo_id: int
+
+
+TodoOperation = NewTodo | TodoUpdate | TodoToggle | TodoDeletion
+
+
+@dataclass
+class TodoChanges:
+    """A user's todos changed or deleted after some version, oldest first."""
+
+    version: int
+    todos: list[Todo]
+    deleted_ids: list[int]
+
+
 class UserStorage:
     def add_user(self, new_user: NewUser) -> User:
         raise NotImplementedError
@@ -40,6 +74,25 @@ class UserStorage:
     def update_user(self, user: User) -> User | None:
         raise NotImplementedError
 
+    def export_users(self) -> Iterator[User]:
+        """Yield every user in id order."""
+        raise NotImplementedError
+
+    def import_users(self, users: Iterable[User]) -> int:
+        """Add users as they are, ids included, and return how many.
+
+        `users` is consumed as it is written, `TRANSFER_CHUNK` per transaction
+        where the backend has them. Raises ValueError if an id, username or
+        email is already taken.
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Persist writes the storage has buffered; a no-op by default."""
+
+    def close(self) -> None:
+        """Release files and connections held by the storage; a no-op by default."""
+
 
 class TodoStorage:
     def add(self, new_todo: NewTodo) -> Todo:
@@ -54,8 +107,196 @@ class TodoStorage:
     def get_task_by_id(self, todo_id: int) -> Todo | None:
         raise NotImplementedError
 
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        """Return up to `limit` of a user's todos that follow `after_id`.
+
+        Todos are ordered by id, newest first when `descending` is set, and
+        only those whose status matches `is_done` are returned when it is given.
+        """
+        raise NotImplementedError
+
     def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
         raise NotImplementedError
 
     def update(self, todo: Todo) -> Todo | None:
         raise NotImplementedError
+
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        """Update the given fields of a todo if `user_id` owns it.
+
+        Returns the updated todo, or None when no such todo is owned by the user.
+        With no fields given, the todo is returned as it is, without a write.
+        """
+        raise NotImplementedError
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        """Delete a todo if `user_id` owns it and report whether one was deleted."""
+        raise NotImplementedError
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        """Apply all operations atomically on behalf of `user_id`.
+
+        Returns the resulting todo of each operation (None for deletions).
+        Raises ValueError, leaving the storage untouched, if an operation
+        refers to a todo the user does not own.
+        """
+        raise NotImplementedError
+
+    def get_version(self, user_id: int) -> int:
+        """Return the user's version, which every change to their todos bumps."""
+        raise NotImplementedError
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        """Return what changed after version `since` of the user's todos.
+
+        Returns None when `since` is too old to answer (or was never issued),
+        in which case the client has to reload the whole list.
+        """
+        raise NotImplementedError
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        """Return the user's todos matching every word of `query` as a prefix.
+
+        Todos are ranked by relevance, with title matches weighing more than
+        description matches.
+        """
+        raise NotImplementedError
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        """Yield a user's todos, or everyone's grouped by user, in id order.
+
+        Todos are read `TRANSFER_CHUNK` at a time, so memory stays bounded
+        however many there are. Changes made meanwhile may or may not show up.
+        """
+        raise NotImplementedError
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        """Add todos as they are, ids included, and return how many.
+
+        Todos are written `TRANSFER_CHUNK` per transaction. Raises ValueError
+        if an id is already taken; the chunks before it stay imported.
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Persist writes the storage has buffered; a no-op by default."""
+
+    def close(self) -> None:
+        """Release files and connections held by the storage; a no-op by default."""
+
+
+class AsyncUserStorage:
+    """Awaitable counterpart of UserStorage for the async web stack."""
+
+    async def add_user(self, new_user: NewUser) -> User:
+        raise NotImplementedError
+
+    async def delete_user(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        raise NotImplementedError
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        raise NotImplementedError
+
+    async def get_user_by_email(self, email: str) -> User | None:
+        raise NotImplementedError
+
+    async def get_all_users(self) -> list[User]:
+        raise NotImplementedError
+
+    async def update_user(self, user: User) -> User | None:
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        """Persist writes the storage has buffered; a no-op by default."""
+
+    async def close(self) -> None:
+        """Release connections held by the storage; a no-op by default."""
+
+
+class AsyncTodoStorage:
+    """Awaitable counterpart of TodoStorage for the async web stack."""
+
+    async def add(self, new_todo: NewTodo) -> Todo:
+        raise NotImplementedError
+
+    async def delete(self, todo_id: int) -> None:
+        raise NotImplementedError
+
+    async def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        raise NotImplementedError
+
+    async def get_task_by_id(self, todo_id: int) -> Todo | None:
+        raise NotImplementedError
+
+    async def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        raise NotImplementedError
+
+    async def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        raise NotImplementedError
+
+    async def update(self, todo: Todo) -> Todo | None:
+        raise NotImplementedError
+
+    async def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        raise NotImplementedError
+
+    async def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        raise NotImplementedError
+
+    async def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        raise NotImplementedError
+
+    async def get_version(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    async def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        raise NotImplementedError
+
+    async def search(
+        self, user_id: int, query: str, limit: int | None = None
+    ) -> list[Todo]:
+        raise NotImplementedError
+
+    def export_todos(self, user_id: int | None = None) -> AsyncIterator[Todo]:
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        """Persist writes the storage has buffered; a no-op by default."""
+
+    async def close(self) -> None:
+        """Release connections held by the storage; a no-op by default."""
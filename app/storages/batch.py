@@ -0,0 +1,78 @@
+from dataclasses import replace
+from typing import Callable
+
+from app.models import Todo
+from app.storages.base import (
+    NewTodo,
+    TodoDeletion,
+    TodoOperation,
+    TodoToggle,
+    TodoUpdate,
+)
+
+
+class StagedBatch:
+    """Resolves a batch against a storage without modifying it.
+
+    `lookup` returns the stored todo with the given id or None. Once every
+    operation has been resolved, `changes` maps each touched id to its final
+    todo (None when deleted) and `next_id` is the first id left unallocated.
+    """
+
+    def __init__(
+        self, user_id: int, next_id: int, lookup: Callable[[int], Todo | None]
+    ):
+        self.user_id = user_id
+        self.next_id = next_id
+        self.lookup = lookup
+        self.changes: dict[int, Todo | None] = {}
+
+    def _current(self, todo_id: int) -> Todo:
+        if todo_id in self.changes:
+            todo = self.changes[todo_id]
+        else:
+            todo = self.lookup(todo_id)
+        if todo is None or todo.user_id != self.user_id:
+            raise ValueError("Task not found")
+        return todo
+
+    def resolve(self, operations: list[TodoOperation]) -> list[Todo | None]:
+        return [self._resolve(operation) for operation in operations]
+
+    def _resolve(self, operation: TodoOperation) -> Todo | None:
+        if isinstance(operation, NewTodo):
+            if operation.user_id != self.user_id:
+                raise ValueError("Task not found")
+            todo = Todo(
+                id=self.next_id,
+                user_id=operation.user_id,
+                title=operation.title,
+                description=operation.description,
+                is_done=operation.is_done,
+            )
+            self.next_id += 1
+        elif isinstance(operation, TodoUpdate):
+            todo = self._current(operation.todo_id)
+            todo = replace(
+                todo,
+                title=todo.title if operation.title is None else operation.title,
+                description=(
+                    todo.description
+                    if operation.description is None
+                    else operation.description
+                ),
+                is_done=todo.is_done
+                if operation.is_done is None
+                else operation.is_done,
+            )
+        elif isinstance(operation, TodoToggle):
+            todo = self._current(operation.todo_id)
+            todo = replace(todo, is_done=not todo.is_done)
+        elif isinstance(operation, TodoDeletion):
+            self._current(operation.todo_id)
+            self.changes[operation.todo_id] = None
+            return None
+        else:
+            raise TypeError(f"Unknown todo operation: {operation!r}")
+        self.changes[todo.id] = todo
+        return todo
@@ -0,0 +1,660 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Iterable, Iterator
+
+from app.cache import LRUCache
+from app.models import Todo, User
+from app.storages.base import (
+    AsyncTodoStorage,
+    AsyncUserStorage,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoOperation,
+    TodoStorage,
+    UserStorage,
+)
+
+_MISSING = object()
+# results kept per user, so that one client paging through arbitrary cursors
+# cannot push everyone else's lists out
+QUERIES_PER_USER = 32
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """Bounds of the caches in front of a storage.
+
+    Each of them keeps up to `maxsize` entries: todos and users by id, and
+    list query results, at most `QUERIES_PER_USER` of them per user.
+    """
+
+    maxsize: int = 10000
+
+    @classmethod
+    def parse(cls, spec: str) -> "CachePolicy":
+        """Parse a `--cache` value such as "lru:10000"."""
+        kind, _, size = spec.partition(":")
+        if kind != "lru":
+            raise ValueError(f"Unknown cache type: {kind}")
+        policy = cls(int(size)) if size else cls()
+        if policy.maxsize < 1:
+            raise ValueError("The cache size must be positive")
+        return policy
+
+
+class _Generations:
+    """Detects writes that race with a read-through fill.
+
+    A reader notes the generation of what it is about to load and stores the
+    result only if no write has bumped the generation meanwhile; otherwise it
+    could cache what the write just replaced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._values: dict[Hashable, int] = {}
+
+    def get(self, scope: Hashable) -> int:
+        return self._values.get(scope, 0)
+
+    def bump(self, scope: Hashable) -> None:
+        self._values[scope] = self._values.get(scope, 0) + 1
+
+
+class _UserResults:
+    """Results of the users' list queries, grouped by user.
+
+    Both the users and each user's results are kept in LRU order. A user
+    keeps up to `per_user` results, and once `maxsize` results are kept in
+    all, those of the least recent users are dropped.
+    """
+
+    def __init__(self, maxsize: int, per_user: int = QUERIES_PER_USER):
+        self.maxsize = maxsize
+        self.per_user = per_user
+        self.generations = _Generations()
+        self._users: OrderedDict[int, OrderedDict[Hashable, Any]] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, query: Hashable) -> Any:
+        with self.generations.lock:
+            results = self._users.get(user_id)
+            if results is not None and query in results:
+                self._users.move_to_end(user_id)
+                results.move_to_end(query)
+                self.hits += 1
+                return results[query]
+            self.misses += 1
+            return _MISSING
+
+    def set(self, user_id: int, query: Hashable, value: Any, generation: int) -> None:
+        with self.generations.lock:
+            if self.generations.get(user_id) != generation:
+                return
+            results = self._users.get(user_id)
+            if results is None:
+                results = self._users[user_id] = OrderedDict()
+            else:
+                self._users.move_to_end(user_id)
+            if query not in results:
+                self._size += 1
+            results[query] = value
+            results.move_to_end(query)
+            if len(results) > self.per_user:
+                results.popitem(last=False)
+                self._size -= 1
+            while self._size > self.maxsize:
+                _, evicted = self._users.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, user_id: int) -> None:
+        with self.generations.lock:
+            self.generations.bump(user_id)
+            results = self._users.pop(user_id, None)
+            if results is not None:
+                self._size -= len(results)
+
+    def __len__(self) -> int:
+        """The number of results kept."""
+        return self._size
+
+
+class _TodoCache:
+    """The caches of a cached todo storage, shared by its sync and async forms."""
+
+    def __init__(self, policy: CachePolicy):
+        self.todos: LRUCache[int, Todo] = LRUCache(policy.maxsize)
+        self.lists = _UserResults(policy.maxsize)
+        # bumped by every write, as a write may touch any todo
+        self._generations = _Generations()
+
+    def todo_generation(self) -> int:
+        return self._generations.get(None)
+
+    def fill_todo(self, todo: Todo | None, generation: int) -> None:
+        if todo is None:
+            return
+        with self._generations.lock:
+            if self._generations.get(None) == generation:
+                self.todos.set(todo.id, todo)
+
+    def invalidate(self, user_ids, todo_ids) -> None:
+        with self._generations.lock:
+            self._generations.bump(None)
+            for todo_id in todo_ids:
+                self.todos.pop(todo_id)
+        for user_id in user_ids:
+            self.lists.invalidate(user_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "todo_hits": self.todos.hits,
+            "todo_misses": self.todos.misses,
+            "todo_entries": len(self.todos),
+            "list_hits": self.lists.hits,
+            "list_misses": self.lists.misses,
+            "list_entries": len(self.lists),
+        }
+
+
+def _operation_ids(operations: list[TodoOperation]) -> list[int]:
+    return [
+        operation.todo_id
+        for operation in operations
+        if not isinstance(operation, NewTodo)
+    ]
+
+
+class CachedTodoStorage(TodoStorage):
+    """Read-through cache in front of any TodoStorage.
+
+    Todos are cached by id, and the results of each user's list queries (and
+    their version) per user, both in LRU order. Every mutation goes straight
+    to the wrapped storage and then drops what it may have changed: the
+    todos involved and the lists of their owners. Writes made by anything but
+    this wrapper are not seen, so it must not front a storage that other
+    processes share.
+    """
+
+    def __init__(self, storage: TodoStorage, policy: CachePolicy):
+        self.storage = storage
+        self.cache = _TodoCache(policy)
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+    def _list(self, user_id: int, query: Hashable, load: Callable[[], Any]) -> Any:
+        value = self.cache.lists.get(user_id, query)
+        if value is _MISSING:
+            generation = self.cache.lists.generations.get(user_id)
+            value = load()
+            self.cache.lists.set(user_id, query, value, generation)
+        return value
+
+    def _owner(self, todo_id: int) -> int | None:
+        todo = self.get_task_by_id(todo_id)
+        return todo.user_id if todo is not None else None
+
+    def add(self, new_todo: NewTodo) -> Todo:
+        try:
+            return self.storage.add(new_todo)
+        finally:
+            self.cache.invalidate([new_todo.user_id], [])
+
+    def delete(self, todo_id: int) -> None:
+        user_id = self._owner(todo_id)
+        try:
+            self.storage.delete(todo_id)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        todos = self._list(
+            user_id, "all", lambda: self.storage.get_tasks_by_user_id(user_id)
+        )
+        return list(todos)
+
+    def get_task_by_id(self, todo_id: int) -> Todo | None:
+        todo = self.cache.todos.get(todo_id)
+        if todo is None:
+            generation = self.cache.todo_generation()
+            todo = self.storage.get_task_by_id(todo_id)
+            self.cache.fill_todo(todo, generation)
+        return todo
+
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        todos = self._list(
+            user_id,
+            ("page", after_id, limit, is_done, descending),
+            lambda: self.storage.get_tasks_page(
+                user_id,
+                after_id=after_id,
+                limit=limit,
+                is_done=is_done,
+                descending=descending,
+            ),
+        )
+        return list(todos)
+
+    def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        user_id = self._owner(todo_id)
+        try:
+            return self.storage.update_status(todo_id, is_done)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    def update(self, todo: Todo) -> Todo | None:
+        previous_user_id = self._owner(todo.id)
+        try:
+            return self.storage.update(todo)
+        finally:
+            self.cache.invalidate([previous_user_id, todo.user_id], [todo.id])
+
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        try:
+            return self.storage.update_for_user(
+                user_id, todo_id, title=title, description=description, is_done=is_done
+            )
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        try:
+            return self.storage.delete_for_user(user_id, todo_id)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        try:
+            return self.storage.apply_batch(user_id, operations)
+        finally:
+            self.cache.invalidate([user_id], _operation_ids(operations))
+
+    def get_version(self, user_id: int) -> int:
+        return self._list(user_id, "version", lambda: self.storage.get_version(user_id))
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return self.storage.get_changes(user_id, since)
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        return self.storage.search(user_id, query, limit)
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        return self.storage.export_todos(user_id)
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        # the ids were free, so only the owners' lists can be out of date
+        user_ids: set[int] = set()
+
+        def remember_owners(todos: Iterable[Todo]) -> Iterator[Todo]:
+            for todo in todos:
+                user_ids.add(todo.user_id)
+                yield todo
+
+        try:
+            return self.storage.import_todos(remember_owners(todos))
+        finally:
+            self.cache.invalidate(user_ids, [])
+
+    def flush(self) -> None:
+        self.storage.flush()
+
+    def close(self) -> None:
+        self.storage.close()
+
+
+class AsyncCachedTodoStorage(AsyncTodoStorage):
+    """CachedTodoStorage for the async web stack; hits never leave the loop."""
+
+    def __init__(self, storage: AsyncTodoStorage, policy: CachePolicy):
+        self.storage = storage
+        self.cache = _TodoCache(policy)
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+    async def _list(
+        self, user_id: int, query: Hashable, load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = self.cache.lists.get(user_id, query)
+        if value is _MISSING:
+            generation = self.cache.lists.generations.get(user_id)
+            value = await load()
+            self.cache.lists.set(user_id, query, value, generation)
+        return value
+
+    async def _owner(self, todo_id: int) -> int | None:
+        todo = await self.get_task_by_id(todo_id)
+        return todo.user_id if todo is not None else None
+
+    async def add(self, new_todo: NewTodo) -> Todo:
+        try:
+            return await self.storage.add(new_todo)
+        finally:
+            self.cache.invalidate([new_todo.user_id], [])
+
+    async def delete(self, todo_id: int) -> None:
+        user_id = await self._owner(todo_id)
+        try:
+            await self.storage.delete(todo_id)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    async def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        todos = await self._list(
+            user_id, "all", lambda: self.storage.get_tasks_by_user_id(user_id)
+        )
+        return list(todos)
+
+    async def get_task_by_id(self, todo_id: int) -> Todo | None:
+        todo = self.cache.todos.get(todo_id)
+        if todo is None:
+            generation = self.cache.todo_generation()
+            todo = await self.storage.get_task_by_id(todo_id)
+            self.cache.fill_todo(todo, generation)
+        return todo
+
+    async def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        todos = await self._list(
+            user_id,
+            ("page", after_id, limit, is_done, descending),
+            lambda: self.storage.get_tasks_page(
+                user_id,
+                after_id=after_id,
+                limit=limit,
+                is_done=is_done,
+                descending=descending,
+            ),
+        )
+        return list(todos)
+
+    async def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        user_id = await self._owner(todo_id)
+        try:
+            return await self.storage.update_status(todo_id, is_done)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    async def update(self, todo: Todo) -> Todo | None:
+        previous_user_id = await self._owner(todo.id)
+        try:
+            return await self.storage.update(todo)
+        finally:
+            self.cache.invalidate([previous_user_id, todo.user_id], [todo.id])
+
+    async def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        try:
+            return await self.storage.update_for_user(
+                user_id, todo_id, title=title, description=description, is_done=is_done
+            )
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    async def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        try:
+            return await self.storage.delete_for_user(user_id, todo_id)
+        finally:
+            self.cache.invalidate([user_id], [todo_id])
+
+    async def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        try:
+            return await self.storage.apply_batch(user_id, operations)
+        finally:
+            self.cache.invalidate([user_id], _operation_ids(operations))
+
+    async def get_version(self, user_id: int) -> int:
+        return await self._list(
+            user_id, "version", lambda: self.storage.get_version(user_id)
+        )
+
+    async def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return await self.storage.get_changes(user_id, since)
+
+    async def search(
+        self, user_id: int, query: str, limit: int | None = None
+    ) -> list[Todo]:
+        return await self.storage.search(user_id, query, limit)
+
+    def export_todos(self, user_id: int | None = None) -> AsyncIterator[Todo]:
+        return self.storage.export_todos(user_id)
+
+    async def flush(self) -> None:
+        await self.storage.flush()
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+class _UserCache:
+    """The caches of a cached user storage, shared by its sync and async forms.
+
+    Usernames and emails map to ids; a user found through them is checked
+    against the key, so a mapping left behind by a rename is merely a miss.
+    """
+
+    def __init__(self, policy: CachePolicy):
+        self.users: LRUCache[int, User] = LRUCache(policy.maxsize)
+        self.ids_by_username: LRUCache[str, int] = LRUCache(policy.maxsize)
+        self.ids_by_email: LRUCache[str, int] = LRUCache(policy.maxsize)
+        self._generations = _Generations()
+
+    def generation(self) -> int:
+        return self._generations.get(None)
+
+    def find(self, key: str, value: str) -> User | None:
+        ids = self.ids_by_username if key == "username" else self.ids_by_email
+        user_id = ids.get(value)
+        if user_id is None:
+            return None
+        user = self.users.get(user_id)
+        if user is None or getattr(user, key) != value:
+            return None
+        return user
+
+    def fill(self, user: User | None, generation: int) -> None:
+        if user is None:
+            return
+        with self._generations.lock:
+            if self._generations.get(None) != generation:
+                return
+            self.users.set(user.id, user)
+            self.ids_by_username.set(user.username, user.id)
+            self.ids_by_email.set(user.email, user.id)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._generations.lock:
+            self._generations.bump(None)
+            self.users.pop(user_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "user_hits": self.users.hits,
+            "user_misses": self.users.misses,
+            "user_entries": len(self.users),
+        }
+
+
+class CachedUserStorage(UserStorage):
+    """Read-through cache of users by id, username and email.
+
+    Like CachedTodoStorage, it only sees the writes made through itself.
+    """
+
+    def __init__(self, storage: UserStorage, policy: CachePolicy):
+        self.storage = storage
+        self.cache = _UserCache(policy)
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+    def _find(self, key: str, value, load: Callable[[], User | None]) -> User | None:
+        user = self.cache.find(key, value)
+        if user is None:
+            generation = self.cache.generation()
+            user = load()
+            self.cache.fill(user, generation)
+        return user
+
+    def add_user(self, new_user: NewUser) -> User:
+        return self.storage.add_user(new_user)
+
+    def delete_user(self, user_id: int) -> None:
+        try:
+            self.storage.delete_user(user_id)
+        finally:
+            self.cache.invalidate(user_id)
+
+    def get_user_by_id(self, user_id: int) -> User | None:
+        user = self.cache.users.get(user_id)
+        if user is None:
+            generation = self.cache.generation()
+            user = self.storage.get_user_by_id(user_id)
+            self.cache.fill(user, generation)
+        return user
+
+    def get_user_by_username(self, username: str) -> User | None:
+        return self._find(
+            "username", username, lambda: self.storage.get_user_by_username(username)
+        )
+
+    def get_user_by_email(self, email: str) -> User | None:
+        return self._find("email", email, lambda: self.storage.get_user_by_email(email))
+
+    def get_all_users(self) -> list[User]:
+        return self.storage.get_all_users()
+
+    def export_users(self) -> Iterator[User]:
+        return self.storage.export_users()
+
+    def import_users(self, users: Iterable[User]) -> int:
+        # new ids, usernames and emails, none of which can be cached
+        return self.storage.import_users(users)
+
+    def update_user(self, user: User) -> User | None:
+        try:
+            return self.storage.update_user(user)
+        finally:
+            self.cache.invalidate(user.id)
+
+    def flush(self) -> None:
+        self.storage.flush()
+
+    def close(self) -> None:
+        self.storage.close()
+
+
+class AsyncCachedUserStorage(AsyncUserStorage):
+    """CachedUserStorage for the async web stack."""
+
+    def __init__(self, storage: AsyncUserStorage, policy: CachePolicy):
+        self.storage = storage
+        self.cache = _UserCache(policy)
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+    async def _find(
+        self, key: str, value, load: Callable[[], Awaitable[User | None]]
+    ) -> User | None:
+        user = self.cache.find(key, value)
+        if user is None:
+            generation = self.cache.generation()
+            user = await load()
+            self.cache.fill(user, generation)
+        return user
+
+    async def add_user(self, new_user: NewUser) -> User:
+        return await self.storage.add_user(new_user)
+
+    async def delete_user(self, user_id: int) -> None:
+        try:
+            await self.storage.delete_user(user_id)
+        finally:
+            self.cache.invalidate(user_id)
+
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        user = self.cache.users.get(user_id)
+        if user is None:
+            generation = self.cache.generation()
+            user = await self.storage.get_user_by_id(user_id)
+            self.cache.fill(user, generation)
+        return user
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        return await self._find(
+            "username", username, lambda: self.storage.get_user_by_username(username)
+        )
+
+    async def get_user_by_email(self, email: str) -> User | None:
+        return await self._find(
+            "email", email, lambda: self.storage.get_user_by_email(email)
+        )
+
+    async def get_all_users(self) -> list[User]:
+        return await self.storage.get_all_users()
+
+    async def update_user(self, user: User) -> User | None:
+        try:
+            return await self.storage.update_user(user)
+        finally:
+            self.cache.invalidate(user.id)
+
+    async def flush(self) -> None:
+        await self.storage.flush()
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+def cache_storage(
+    user_storage: UserStorage, todo_storage: TodoStorage, policy: CachePolicy
+) -> tuple[CachedUserStorage, CachedTodoStorage]:
+    return (
+        CachedUserStorage(user_storage, policy),
+        CachedTodoStorage(todo_storage, policy),
+    )
+
+
+def cache_async_storage(
+    user_storage: AsyncUserStorage, todo_storage: AsyncTodoStorage, policy: CachePolicy
+) -> tuple[AsyncCachedUserStorage, AsyncCachedTodoStorage]:
+    return (
+        AsyncCachedUserStorage(user_storage, policy),
+        AsyncCachedTodoStorage(todo_storage, policy),
+    )
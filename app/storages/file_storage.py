@@ -1,152 +1,748 @@
 import json
 import os
 import pathlib
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, replace
+from itertools import batched, islice
+from typing import Iterable, Iterator, NamedTuple
 
+import orjson
+
+from app.metrics import stage
 from app.models import Todo, User
-from app.storages.base import NewTodo, NewUser, TodoStorage, UserStorage
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoOperation,
+    TodoStorage,
+    UserStorage,
+)
+from app.storages.batch import StagedBatch
+from app.storages.indexes import UserTaskIndex
+from app.storages.locking import FileLock
+from app.storages.search import SearchIndex
+from app.storages.versions import TodoVersions
+from app.storages.write_behind import FlushPolicy, WriteBehind, write_atomically
 
 
 class FileUserStorage(UserStorage):
-    def __init__(self, file_path: str):
-        self.file_path = file_path
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, "w") as file:
-                json.dump({"users": [], "next_id": 1}, file)
-
-    def _load_data(self):
-        with open(self.file_path, "r") as file:
+    """Users kept in a single JSON document.
+
+    By default every mutation rewrites the document. With a `flush_policy` the
+    document is read once and mutated in memory, and a write-behind flusher
+    rewrites it once per batch of mutations instead. Either way the document is
+    replaced atomically, so a crash leaves the previous version intact.
+
+    With `shared`, several processes may use the document at once: every call
+    holds a lock file, exclusively for mutations.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        flush_policy: FlushPolicy | None = None,
+        shared: bool = False,
+    ):
+        if shared and flush_policy is not None:
+            raise ValueError("Write-behind buffers cannot be shared by processes")
+        self.file_path = str(file_path)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self.file_path + ".lock") if shared else None
+        with self._locked(exclusive=True):
+            if not os.path.exists(self.file_path):
+                write_atomically(
+                    self.file_path, json.dumps({"users": [], "next_id": 1}).encode()
+                )
+        self._data: dict | None = None
+        self._write_behind: WriteBehind | None = None
+        if flush_policy is not None:
+            self._data = self._read_file()
+            self._write_behind = WriteBehind(self.flush, flush_policy)
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False) -> Iterator[None]:
+        with self._lock:
+            if self._file_lock is None:
+                yield
+            else:
+                with self._file_lock.hold(exclusive):
+                    yield
+
+    def _read_file(self) -> dict:
+        with stage("user_file_parse"), open(self.file_path, "r") as file:
             return json.load(file)
 
-    def _save_data(self, data):
-        with open(self.file_path, "w") as file:
-            json.dump(data, file)
+    def _load_data(self) -> dict:
+        if self._data is not None:
+            return self._data
+        return self._read_file()
+
+    def _save_data(self, data: dict) -> None:
+        if self._write_behind is None:
+            write_atomically(self.file_path, json.dumps(data).encode())
+        else:
+            self._data = data
+            self._write_behind.record()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._write_behind is None or not self._write_behind.pending:
+                return
+            write_atomically(self.file_path, json.dumps(self._data).encode())
+            self._write_behind.pending = 0
+
+    def close(self) -> None:
+        if self._write_behind is not None:
+            self._write_behind.stop()
+        self.flush()
+        if self._file_lock is not None:
+            self._file_lock.close()
 
     def add_user(self, new_user: NewUser) -> User:
-        data = self._load_data()
-        user = User(
-            id=data["next_id"],
-            username=new_user.username,
-            hashed_password=new_user.hashed_password,
-            email=new_user.email,
-            disabled=False,
-        )
-        data["users"].append(user.__dict__)
-        data["next_id"] += 1
-        self._save_data(data)
-        return user
+        with self._locked(exclusive=True):
+            data = self._load_data()
+            user = User(
+                id=data["next_id"],
+                username=new_user.username,
+                hashed_password=new_user.hashed_password,
+                email=new_user.email,
+                disabled=False,
+            )
+            data["users"].append(asdict(user))
+            data["next_id"] += 1
+            self._save_data(data)
+            return user
 
     def delete_user(self, user_id: int) -> None:
-        data = self._load_data()
-        data["users"] = [user for user in data["users"] if user["id"] != user_id]
-        self._save_data(data)
+        with self._locked(exclusive=True):
+            data = self._load_data()
+            data["users"] = [user for user in data["users"] if user["id"] != user_id]
+            self._save_data(data)
+
+    def _find_user(self, key: str, value) -> User | None:
+        with self._locked():
+            data = self._load_data()
+            for user in data["users"]:
+                if user[key] == value:
+                    return User(**user)
+            return None
 
     def get_user_by_id(self, user_id: int) -> User | None:
-        data = self._load_data()
-        for user in data["users"]:
-            if user["id"] == user_id:
-                return User(**user)
-        return None
+        return self._find_user("id", user_id)
 
     def get_user_by_username(self, username: str) -> User | None:
-        data = self._load_data()
-        for user in data["users"]:
-            if user["username"] == username:
-                return User(**user)
-        return None
+        return self._find_user("username", username)
 
     def get_user_by_email(self, email: str) -> User | None:
-        data = self._load_data()
-        for user in data["users"]:
-            if user["email"] == email:
-                return User(**user)
-        return None
+        return self._find_user("email", email)
 
     def get_all_users(self) -> list[User]:
-        data = self._load_data()
-        return [User(**user) for user in data["users"]]
+        with self._locked():
+            data = self._load_data()
+            return [User(**user) for user in data["users"]]
 
     def update_user(self, user: User) -> User | None:
-        data = self._load_data()
-        for i, u in enumerate(data["users"]):
-            if u["id"] == user.id:
-                data["users"][i] = user.__dict__
+        with self._locked(exclusive=True):
+            data = self._load_data()
+            for i, u in enumerate(data["users"]):
+                if u["id"] == user.id:
+                    data["users"][i] = asdict(user)
+                    self._save_data(data)
+                    return user
+            return None
+
+    def export_users(self) -> Iterator[User]:
+        yield from sorted(self.get_all_users(), key=lambda user: user.id)
+
+    def import_users(self, users: Iterable[User]) -> int:
+        with self._locked(exclusive=True):
+            data = self._load_data()
+            taken = {
+                key: {user[key] for user in data["users"]}
+                for key in ("id", "username", "email")
+            }
+            added = []
+            for user in users:
+                record = asdict(user)
+                for key, values in taken.items():
+                    if record[key] in values:
+                        raise ValueError(
+                            f"User {user.id} conflicts with an existing user"
+                        )
+                    values.add(record[key])
+                added.append(record)
+            if added:
+                data["users"].extend(added)
+                data["next_id"] = max(
+                    data["next_id"], max(user["id"] for user in added) + 1
+                )
                 self._save_data(data)
-                return user
-        return None
+            return len(added)
+
+
+class _Entry(NamedTuple):
+    offset: int
+    length: int
+    user_id: int
+    is_done: bool
+    # the owner's version when the todo last changed
+    version: int
 
 
 class FileTodoStorage(TodoStorage):
-    def __init__(self, file_path: str):
-        self.file_path = file_path
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, "w") as file:
-                json.dump({"todos": [], "next_id": 1}, file)
-
-    def _load_data(self):
-        with open(self.file_path, "r") as file:
-            return json.load(file)
+    """Todo storage backed by an append-only log of JSON lines.
 
-    def _save_data(self, data):
-        with open(self.file_path, "w") as file:
-            json.dump(data, file)
+    Each mutation appends a single record. The latest record of every live todo
+    is located through an in-memory index (id -> offset), and a per-user index
+    keeps the ids of each user's todos in ascending order, so lookups read one
+    record instead of parsing the whole file. Superseded records are dropped by
+    a compaction that runs in a background thread once they outweigh the live
+    ones.
 
-    def add(self, new_todo: NewTodo) -> Todo:
-        data = self._load_data()
-        todo = Todo(
-            id=data["next_id"],
-            user_id=new_todo.user_id,
-            title=new_todo.title,
-            description=new_todo.description,
-            is_done=new_todo.is_done,
+    A search index over the titles and descriptions is built while the log
+    is read and kept up to date by every record applied since.
+
+    Records carry the version of the change (see TodoVersions). Deletion
+    records name the owner, and compaction keeps those that are recent enough
+    for `get_changes`, while the meta record keeps every user's version.
+
+    With a `flush_policy`, appended records are buffered in memory (and served
+    from there) and written out with a single write and fsync per batch.
+
+    With `shared`, several processes may use the log at once. Every call holds
+    a lock file (exclusively for mutations) and first applies the records other
+    processes appended, so ids are allocated from the latest `next_id`; after a
+    compaction by another process the log is reloaded.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        legacy_file_path: str | None = None,
+        compact_min_bytes: int = 1024 * 1024,
+        flush_policy: FlushPolicy | None = None,
+        shared: bool = False,
+    ):
+        if shared and flush_policy is not None:
+            raise ValueError("Write-behind buffers cannot be shared by processes")
+        self.file_path = str(file_path)
+        self.compact_min_bytes = compact_min_bytes
+        self._lock = threading.RLock()
+        # serializes compactions; writers only ever take `_lock`
+        self._compaction_lock = threading.Lock()
+        self._compaction_scheduled = False
+        # records appended after `_flushed_size`, not yet in the file
+        self._buffer = bytearray()
+        self._file_lock = FileLock(self.file_path + ".lock") if shared else None
+
+        with self._file_lock.hold() if shared else nullcontext():
+            if not os.path.exists(self.file_path):
+                if legacy_file_path is not None and os.path.exists(legacy_file_path):
+                    self._import_legacy(legacy_file_path)
+                else:
+                    open(self.file_path, "wb").close()
+            self._load()
+        self._write_behind: WriteBehind | None = None
+        if flush_policy is not None:
+            self._write_behind = WriteBehind(self.flush, flush_policy)
+
+    # -- log encoding ---------------------------------------------------------
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        # orjson serializes Todo dataclasses directly, without a dict copy
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+    def _meta_record(self) -> bytes:
+        return self._encode(
+            {
+                "op": "meta",
+                "next_id": self._next_id,
+                "versions": self._versions.versions(),
+            }
+        )
+
+    def _import_legacy(self, legacy_file_path: str) -> None:
+        """Convert a whole-file JSON store into a compacted log."""
+        with open(legacy_file_path, "r") as file:
+            data = json.load(file)
+        # a name of its own, so that concurrent imports do not share a file
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.file_path)),
+            prefix=os.path.basename(self.file_path) + ".",
+            suffix=".tmp",
         )
-        data["todos"].append(todo.__dict__)
-        data["next_id"] += 1
-        self._save_data(data)
-        return todo
+        with open(fd, "wb") as file:
+            file.write(self._encode({"op": "meta", "next_id": data["next_id"]}))
+            for todo in data["todos"]:
+                file.write(self._encode({"op": "put", "todo": todo}))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.file_path)
+
+    def _load(self) -> None:
+        with stage("todo_log_load"):
+            self._load_log()
+
+    def _load_log(self) -> None:
+        self._index: dict[int, _Entry] = {}
+        self._user_index = UserTaskIndex()
+        self._versions = TodoVersions()
+        self._search_index = SearchIndex()
+        self._next_id = 1
+        self._dead_bytes = 0
+        offset = 0
+        with open(self.file_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    # torn write from a crash: drop the incomplete record
+                    break
+                try:
+                    record = orjson.loads(line)
+                except ValueError:
+                    break
+                self._apply(record, offset, len(line))
+                offset += len(line)
+        if offset != os.path.getsize(self.file_path):
+            os.truncate(self.file_path, offset)
+        self._size = offset
+        self._flushed_size = offset
+        self._writer = open(self.file_path, "ab", buffering=0)
+        self._reader_fd = os.open(self.file_path, os.O_RDONLY)
+
+    def _catch_up(self, exclusive: bool) -> None:
+        """Apply the records other processes wrote since the last call."""
+        stat = os.stat(self.file_path)
+        if stat.st_ino != os.fstat(self._reader_fd).st_ino:
+            # another process compacted the log into a new file
+            self._writer.close()
+            os.close(self._reader_fd)
+            self._load()
+            return
+        if stat.st_size == self._size:
+            return
+        tail = os.pread(self._reader_fd, stat.st_size - self._size, self._size)
+        for line in tail.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                # a writer died mid-record; drop it before appending after it
+                if exclusive:
+                    os.truncate(self.file_path, self._size)
+                break
+            self._apply(orjson.loads(line), self._size, len(line))
+            self._size += len(line)
+        self._flushed_size = self._size
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False) -> Iterator[None]:
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            with self._file_lock.hold(exclusive):
+                self._catch_up(exclusive)
+                yield
+
+    def _apply(self, record: dict, offset: int, length: int) -> None:
+        """Update the in-memory indexes for a record stored at `offset`."""
+        op = record["op"]
+        if op == "put":
+            todo = record["todo"]
+            # logs written before versioning have none; they count as version 0
+            version = record.get("v", 0)
+            # records are Todo objects when appended and dicts when loaded
+            if isinstance(todo, Todo):
+                entry = _Entry(offset, length, todo.user_id, todo.is_done, version)
+                todo_id = todo.id
+                text = (todo.title, todo.description)
+            else:
+                entry = _Entry(
+                    offset, length, todo["user_id"], todo["is_done"], version
+                )
+                todo_id = todo["id"]
+                text = (todo["title"], todo["description"])
+            previous = self._index.get(todo_id)
+            if previous is None:
+                self._user_index.add(entry.user_id, todo_id)
+            else:
+                if previous.user_id != entry.user_id:
+                    self._user_index.remove(previous.user_id, todo_id)
+                    self._user_index.add(entry.user_id, todo_id)
+                self._dead_bytes += previous.length
+            self._index[todo_id] = entry
+            self._search_index.put(todo_id, entry.user_id, *text)
+            self._versions.changed(entry.user_id, todo_id, version)
+            self._next_id = max(self._next_id, todo_id + 1)
+        elif op == "del":
+            previous = self._index.pop(record["id"], None)
+            if previous is not None:
+                self._user_index.remove(previous.user_id, record["id"])
+                self._search_index.remove(record["id"])
+                self._dead_bytes += previous.length
+            if "v" in record:
+                self._versions.deleted(record["user_id"], record["id"], record["v"])
+            self._dead_bytes += length
+        elif op == "meta":
+            self._next_id = max(self._next_id, record["next_id"])
+            for user_id, version in record.get("versions", ()):
+                self._versions.restore(user_id, version)
+            self._dead_bytes += length
+
+    def _append(self, *records: dict) -> None:
+        lines = [self._encode(record) for record in records]
+        if self._write_behind is None:
+            # a single write keeps a batch of records together in the log
+            self._writer.write(b"".join(lines))
+            self._flushed_size += sum(map(len, lines))
+        else:
+            self._buffer += b"".join(lines)
+        for record, line in zip(records, lines):
+            self._apply(record, self._size, len(line))
+            self._size += len(line)
+        if self._write_behind is not None:
+            self._write_behind.record(len(records))
+        self._maybe_compact()
+
+    def _next_version(self, user_id: int) -> int:
+        return self._versions.version(user_id) + 1
+
+    @staticmethod
+    def _put_record(todo: Todo, version: int) -> dict:
+        return {"op": "put", "v": version, "todo": todo}
+
+    @staticmethod
+    def _del_record(user_id: int, todo_id: int, version: int) -> dict:
+        return {"op": "del", "id": todo_id, "user_id": user_id, "v": version}
+
+    def _pread(self, length: int, offset: int) -> bytes:
+        if offset < self._flushed_size:
+            return os.pread(self._reader_fd, length, offset)
+        start = offset - self._flushed_size
+        return bytes(self._buffer[start : start + length])
+
+    def _read(self, todo_id: int) -> Todo | None:
+        entry = self._index.get(todo_id)
+        if entry is None:
+            return None
+        line = self._pread(entry.length, entry.offset)
+        return Todo(**orjson.loads(line)["todo"])
+
+    def _write_buffer(self) -> None:
+        if self._buffer:
+            self._writer.write(self._buffer)
+            self._flushed_size += len(self._buffer)
+            self._buffer.clear()
+
+    def flush(self) -> None:
+        """Write out buffered records and fsync the log."""
+        with self._lock:
+            self._write_buffer()
+            os.fsync(self._writer.fileno())
+            if self._write_behind is not None:
+                self._write_behind.pending = 0
+
+    # -- compaction -----------------------------------------------------------
+
+    def _maybe_compact(self) -> None:
+        if self._compaction_scheduled or self._dead_bytes < self.compact_min_bytes:
+            return
+        if self._dead_bytes < self._size - self._dead_bytes:
+            return
+        self._compaction_scheduled = True
+        threading.Thread(
+            target=self.compact, name="todo-log-compaction", daemon=True
+        ).start()
+
+    def compact(self) -> None:
+        """Rewrite the log so that it only holds the live records."""
+        with self._compaction_lock:
+            try:
+                self._compact()
+            finally:
+                self._compaction_scheduled = False
+
+    def _compact(self) -> None:
+        with self._locked():
+            self._write_buffer()
+            # in version order, so that reloading sees each user's changes
+            # in the order they were made
+            snapshot = sorted(self._index.items(), key=lambda item: item[1].version)
+            tombstones = b"".join(
+                self._encode(self._del_record(user_id, todo_id, version))
+                for version, user_id, todo_id in sorted(self._versions.tombstones())
+            )
+            snapshot_size = self._size
+            meta = self._meta_record() + tombstones
+            # a private descriptor stays valid if the log is reloaded meanwhile
+            reader_fd = os.dup(self._reader_fd)
+        try:
+            self._compact_from(reader_fd, snapshot, snapshot_size, meta)
+        finally:
+            os.close(reader_fd)
+
+    def _compact_from(
+        self,
+        reader_fd: int,
+        snapshot: list[tuple[int, _Entry]],
+        snapshot_size: int,
+        meta: bytes,
+    ) -> None:
+        # The log is append-only, so the snapshot offsets stay valid while
+        # writers keep appending; copy the live records without the lock.
+        tmp_path = f"{self.file_path}.compact.{os.getpid()}"
+        index: dict[int, _Entry] = {}
+        with open(tmp_path, "wb") as file:
+            file.write(meta)
+            position = len(meta)
+            for todo_id, entry in snapshot:
+                file.write(os.pread(reader_fd, entry.length, entry.offset))
+                index[todo_id] = entry._replace(offset=position)
+                position += entry.length
+            with self._locked(exclusive=True):
+                if os.fstat(self._reader_fd).st_ino != os.fstat(reader_fd).st_ino:
+                    # another process compacted the log first
+                    os.unlink(tmp_path)
+                    return
+                # replay whatever was appended while copying
+                self._write_buffer()
+                tail = os.pread(reader_fd, self._size - snapshot_size, snapshot_size)
+                for line in tail.splitlines(keepends=True):
+                    record = orjson.loads(line)
+                    if record["op"] == "put":
+                        todo = record["todo"]
+                        index[todo["id"]] = _Entry(
+                            position,
+                            len(line),
+                            todo["user_id"],
+                            todo["is_done"],
+                            record.get("v", 0),
+                        )
+                    elif record["op"] == "del":
+                        index.pop(record["id"], None)
+                    position += len(line)
+                file.write(tail)
+                file.flush()
+                os.fsync(file.fileno())
+                os.replace(tmp_path, self.file_path)
+                self._writer.close()
+                os.close(self._reader_fd)
+                self._writer = open(self.file_path, "ab", buffering=0)
+                self._reader_fd = os.open(self.file_path, os.O_RDONLY)
+                self._index = index
+                self._size = position
+                self._flushed_size = position
+                self._dead_bytes = 0
+
+    def close(self) -> None:
+        if self._write_behind is not None:
+            # stop the flusher first, it needs the lock to finish a flush
+            self._write_behind.stop()
+        with self._compaction_lock, self._lock:
+            self.flush()
+            self._writer.close()
+            os.close(self._reader_fd)
+            if self._file_lock is not None:
+                self._file_lock.close()
+
+    # -- TodoStorage ----------------------------------------------------------
+
+    def add(self, new_todo: NewTodo) -> Todo:
+        with self._locked(exclusive=True):
+            todo = Todo(
+                id=self._next_id,
+                user_id=new_todo.user_id,
+                title=new_todo.title,
+                description=new_todo.description,
+                is_done=new_todo.is_done,
+            )
+            self._append(self._put_record(todo, self._next_version(todo.user_id)))
+            return todo
 
     def delete(self, todo_id: int):
-        data = self._load_data()
-        data["todos"] = [todo for todo in data["todos"] if todo["id"] != todo_id]
-        self._save_data(data)
+        with self._locked(exclusive=True):
+            entry = self._index.get(todo_id)
+            if entry is not None:
+                version = self._next_version(entry.user_id)
+                self._append(self._del_record(entry.user_id, todo_id, version))
 
     def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
-        data = self._load_data()
-        return [Todo(**todo) for todo in data["todos"] if todo["user_id"] == user_id]
+        with self._locked():
+            return [self._read(todo_id) for todo_id in self._user_index.ids(user_id)]
 
     def get_task_by_id(self, todo_id: int) -> Todo | None:
-        data = self._load_data()
-        for todo in data["todos"]:
-            if todo["id"] == todo_id:
-                return Todo(**todo)
-        return None
+        with self._locked():
+            return self._read(todo_id)
+
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        with self._locked():
+            ids = self._user_index.iter_ids(user_id, after_id, descending)
+            if is_done is not None:
+                # the index knows each todo's status, so filtered-out todos
+                # are skipped without reading their records
+                ids = (i for i in ids if self._index[i].is_done == is_done)
+            return [self._read(todo_id) for todo_id in islice(ids, limit)]
 
     def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
-        data = self._load_data()
-        for todo in data["todos"]:
-            if todo["id"] == todo_id:
-                todo["is_done"] = is_done
-                self._save_data(data)
-                return Todo(**todo)
-        return None
+        with self._locked(exclusive=True):
+            todo = self._read(todo_id)
+            if todo is None:
+                return None
+            todo = replace(todo, is_done=is_done)
+            self._append(self._put_record(todo, self._next_version(todo.user_id)))
+            return todo
 
     def update(self, todo: Todo) -> Todo | None:
-        data = self._load_data()
-        for i, t in enumerate(data["todos"]):
-            if t["id"] == todo.id:
-                data["todos"][i] = todo.__dict__
-                self._save_data(data)
+        with self._locked(exclusive=True):
+            previous = self._index.get(todo.id)
+            if previous is None:
+                return None
+            records = [self._put_record(todo, self._next_version(todo.user_id))]
+            if previous.user_id != todo.user_id:
+                # the todo disappears from the previous owner's list
+                version = self._next_version(previous.user_id)
+                records.insert(0, self._del_record(previous.user_id, todo.id, version))
+            self._append(*records)
+            return todo
+
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        with self._locked(exclusive=True):
+            entry = self._index.get(todo_id)
+            if entry is None or entry.user_id != user_id:
+                return None
+            todo = self._read(todo_id)
+            if title is None and description is None and is_done is None:
                 return todo
-        return None
-        self._save_data(data)
+            todo = replace(
+                todo,
+                title=todo.title if title is None else title,
+                description=todo.description if description is None else description,
+                is_done=todo.is_done if is_done is None else is_done,
+            )
+            self._append(self._put_record(todo, self._next_version(user_id)))
+            return todo
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        with self._locked(exclusive=True):
+            entry = self._index.get(todo_id)
+            if entry is None or entry.user_id != user_id:
+                return False
+            version = self._next_version(user_id)
+            self._append(self._del_record(user_id, todo_id, version))
+            return True
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        with self._locked(exclusive=True):
+            batch = StagedBatch(user_id, self._next_id, self._read)
+            results = batch.resolve(operations)
+            version = self._next_version(user_id)
+            records = [
+                self._put_record(todo, version)
+                if todo is not None
+                else self._del_record(user_id, todo_id, version)
+                for todo_id, todo in batch.changes.items()
+                if todo is not None or todo_id in self._index
+            ]
+            if records:
+                self._append(*records)
+            return results
+
+    def get_version(self, user_id: int) -> int:
+        with self._locked():
+            return self._versions.version(user_id)
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        with self._locked():
+            changes = self._versions.changes_since(user_id, since)
+            if changes is None:
+                return None
+            changed_ids, deleted_ids = changes
+            return TodoChanges(
+                version=self._versions.version(user_id),
+                todos=[self._read(todo_id) for todo_id in changed_ids],
+                deleted_ids=deleted_ids,
+            )
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        with self._locked():
+            todo_ids = self._search_index.search(user_id, query, limit)
+            return [self._read(todo_id) for todo_id in todo_ids]
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        with self._locked():
+            user_ids = self._user_index.user_ids() if user_id is None else [user_id]
+        for owner_id in user_ids:
+            after_id = None
+            while True:
+                # the lock is only held while reading a chunk, never while
+                # the caller consumes it
+                with self._locked():
+                    ids = list(
+                        islice(
+                            self._user_index.iter_ids(owner_id, after_id),
+                            TRANSFER_CHUNK,
+                        )
+                    )
+                    todos = [self._read(todo_id) for todo_id in ids]
+                if not todos:
+                    break
+                yield from todos
+                after_id = ids[-1]
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        count = 0
+        for chunk in batched(todos, TRANSFER_CHUNK):
+            with self._locked(exclusive=True):
+                ids = [todo.id for todo in chunk]
+                if len(set(ids)) != len(ids) or any(i in self._index for i in ids):
+                    raise ValueError("Todo ids are already taken")
+                # one version per user and chunk, as for any other write
+                versions: dict[int, int] = {}
+                for todo in chunk:
+                    if todo.user_id not in versions:
+                        versions[todo.user_id] = self._next_version(todo.user_id)
+                # a single append, like any other batch of records
+                self._append(
+                    *(self._put_record(todo, versions[todo.user_id]) for todo in chunk)
+                )
+            count += len(chunk)
+        return count
 
 
-def get_file_storage(dir_path: str) -> tuple[FileUserStorage, FileTodoStorage]:
+def get_file_storage(
+    dir_path: str, flush_policy: FlushPolicy | None = None, shared: bool = False
+) -> tuple[FileUserStorage, FileTodoStorage]:
     path = pathlib.Path(dir_path)
     if not path.exists():
         path.mkdir(parents=True, exist_ok=True)
     user_file_path = path / "user_data.json"
-    todo_file_path = path / "todo_data.json"
+    todo_file_path = path / "todo_log.jsonl"
     return (
-        FileUserStorage(file_path=user_file_path),
-        FileTodoStorage(file_path=todo_file_path),
+        FileUserStorage(
+            file_path=user_file_path, flush_policy=flush_policy, shared=shared
+        ),
+        FileTodoStorage(
+            file_path=todo_file_path,
+            legacy_file_path=path / "todo_data.json",
+            flush_policy=flush_policy,
+            shared=shared,
+        ),
     )
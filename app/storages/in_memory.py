@@ -1,12 +1,40 @@
+from dataclasses import replace
+from itertools import batched, islice
+from typing import Iterable, Iterator
+
 from app.models import Todo, User
-from app.storages.base import NewTodo, NewUser, TodoStorage, UserStorage
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoOperation,
+    TodoStorage,
+    UserStorage,
+)
+from app.storages.batch import StagedBatch
+from app.storages.indexes import UserTaskIndex
+from app.storages.search import SearchIndex
+from app.storages.versions import TodoVersions
 
 
 class InMemoryUserStorage(UserStorage):
     def __init__(self):
-        self.users: list[User] = []
+        self.users: dict[int, User] = {}
+        self.users_by_username: dict[str, User] = {}
+        self.users_by_email: dict[str, User] = {}
         self.next_id: int = 1
 
+    def _index(self, user: User) -> None:
+        self.users[user.id] = user
+        self.users_by_username[user.username] = user
+        self.users_by_email[user.email] = user
+
+    def _unindex(self, user_id: int) -> None:
+        user = self.users.pop(user_id)
+        del self.users_by_username[user.username]
+        del self.users_by_email[user.email]
+
     def add_user(self, new_user: NewUser) -> User:
         user = User(
             id=self.next_id,
@@ -15,47 +43,63 @@ class InMemoryUserStorage(UserStorage):
             email=new_user.email,
             disabled=False,
         )
-        self.users.append(user)
+        self._index(user)
         self.next_id += 1
         return user
 
     def delete_user(self, user_id: int) -> None:
-        self.users = [user for user in self.users if user.id != user_id]
+        if user_id in self.users:
+            self._unindex(user_id)
 
     def get_user_by_id(self, user_id: int) -> User | None:
-        for user in self.users:
-            if user.id == user_id:
-                return user
-        return None
+        return self.users.get(user_id)
 
     def get_user_by_username(self, username: str) -> User | None:
-        for user in self.users:
-            if user.username == username:
-                return user
-        return None
+        return self.users_by_username.get(username)
 
     def get_user_by_email(self, email: str) -> User | None:
-        for user in self.users:
-            if user.email == email:
-                return user
-        return None
+        return self.users_by_email.get(email)
 
     def get_all_users(self) -> list[User]:
-        return self.users
+        return list(self.users.values())
 
     def update_user(self, user: User) -> User | None:
-        for i, u in enumerate(self.users):
-            if u.id == user.id:
-                self.users[i] = user
-                return user
-        return None
+        if user.id not in self.users:
+            return None
+        self._unindex(user.id)
+        self._index(user)
+        return user
+
+    def export_users(self) -> Iterator[User]:
+        # updates re-insert users, so the dict is not in id order
+        yield from sorted(self.users.values(), key=lambda user: user.id)
+
+    def import_users(self, users: Iterable[User]) -> int:
+        count = 0
+        for user in users:
+            if (
+                user.id in self.users
+                or user.username in self.users_by_username
+                or user.email in self.users_by_email
+            ):
+                raise ValueError(f"User {user.id} conflicts with an existing user")
+            self._index(user)
+            self.next_id = max(self.next_id, user.id + 1)
+            count += 1
+        return count
 
 
 class InMemoryTodoStorage(TodoStorage):
     def __init__(self):
-        self.todos: list[Todo] = []
+        self.todos: dict[int, Todo] = {}
+        self.user_index = UserTaskIndex()
+        self.versions = TodoVersions()
+        self.search_index = SearchIndex()
         self.next_id: int = 1
 
+    def _next_version(self, user_id: int) -> int:
+        return self.versions.version(user_id) + 1
+
     def add(self, new_todo: NewTodo) -> Todo:
         todo = Todo(
             id=self.next_id,
@@ -64,35 +108,177 @@ class InMemoryTodoStorage(TodoStorage):
             description=new_todo.description,
             is_done=new_todo.is_done,
         )
-        self.todos.append(todo)
+        self.todos[todo.id] = todo
+        self.search_index.put(todo.id, todo.user_id, todo.title, todo.description)
+        self.user_index.add(todo.user_id, todo.id)
+        self.versions.changed(todo.user_id, todo.id, self._next_version(todo.user_id))
         self.next_id += 1
         return todo
 
     def delete(self, todo_id: int) -> None:
-        self.todos = [todo for todo in self.todos if todo.id != todo_id]
+        todo = self.todos.get(todo_id)
+        if todo is not None:
+            self._remove(todo, self._next_version(todo.user_id))
+
+    def _remove(self, todo: Todo, version: int) -> None:
+        del self.todos[todo.id]
+        self.search_index.remove(todo.id)
+        self.user_index.remove(todo.user_id, todo.id)
+        self.versions.deleted(todo.user_id, todo.id, version)
 
     def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
-        return [todo for todo in self.todos if todo.user_id == user_id]
+        return [self.todos[todo_id] for todo_id in self.user_index.ids(user_id)]
 
     def get_task_by_id(self, todo_id: int) -> Todo | None:
-        for todo in self.todos:
-            if todo.id == todo_id:
-                return todo
-        return None
+        return self.todos.get(todo_id)
+
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        todos = (
+            self.todos[todo_id]
+            for todo_id in self.user_index.iter_ids(user_id, after_id, descending)
+        )
+        if is_done is not None:
+            todos = (todo for todo in todos if todo.is_done == is_done)
+        return list(islice(todos, limit))
 
     def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
-        for todo in self.todos:
-            if todo.id == todo_id:
-                todo.is_done = is_done
-                return todo
-        return None
+        todo = self.todos.get(todo_id)
+        if todo is not None:
+            todo = replace(todo, is_done=is_done)
+            self.todos[todo_id] = todo
+            self.versions.changed(
+                todo.user_id, todo_id, self._next_version(todo.user_id)
+            )
+        return todo
 
     def update(self, todo: Todo) -> Todo | None:
-        for i, t in enumerate(self.todos):
-            if t.id == todo.id:
-                self.todos[i] = todo
-                return todo
-        return None
+        previous = self.todos.get(todo.id)
+        if previous is None:
+            return None
+        if previous.user_id != todo.user_id:
+            self.user_index.remove(previous.user_id, todo.id)
+            self.user_index.add(todo.user_id, todo.id)
+            # the todo disappears from the previous owner's list
+            self.versions.deleted(
+                previous.user_id, todo.id, self._next_version(previous.user_id)
+            )
+        self.todos[todo.id] = todo
+        self.search_index.put(todo.id, todo.user_id, todo.title, todo.description)
+        self.versions.changed(todo.user_id, todo.id, self._next_version(todo.user_id))
+        return todo
+
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        todo = self.todos.get(todo_id)
+        if todo is None or todo.user_id != user_id:
+            return None
+        if title is None and description is None and is_done is None:
+            return todo
+        todo = replace(
+            todo,
+            title=todo.title if title is None else title,
+            description=todo.description if description is None else description,
+            is_done=todo.is_done if is_done is None else is_done,
+        )
+        self.todos[todo_id] = todo
+        self.search_index.put(todo_id, user_id, todo.title, todo.description)
+        self.versions.changed(user_id, todo_id, self._next_version(user_id))
+        return todo
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        todo = self.todos.get(todo_id)
+        if todo is None or todo.user_id != user_id:
+            return False
+        self._remove(todo, self._next_version(user_id))
+        return True
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        batch = StagedBatch(user_id, self.next_id, self.todos.get)
+        results = batch.resolve(operations)
+        version = self._next_version(user_id)
+        for todo_id, todo in batch.changes.items():
+            if todo is None:
+                if todo_id in self.todos:
+                    self._remove(self.todos[todo_id], version)
+                continue
+            if todo_id not in self.todos:
+                self.user_index.add(user_id, todo_id)
+            self.todos[todo_id] = todo
+            self.search_index.put(todo_id, user_id, todo.title, todo.description)
+            self.versions.changed(user_id, todo_id, version)
+        self.next_id = batch.next_id
+        return results
+
+    def get_version(self, user_id: int) -> int:
+        return self.versions.version(user_id)
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        changes = self.versions.changes_since(user_id, since)
+        if changes is None:
+            return None
+        changed_ids, deleted_ids = changes
+        return TodoChanges(
+            version=self.versions.version(user_id),
+            todos=[self.todos[todo_id] for todo_id in changed_ids],
+            deleted_ids=deleted_ids,
+        )
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        return [
+            self.todos[todo_id]
+            for todo_id in self.search_index.search(user_id, query, limit)
+        ]
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        user_ids = self.user_index.user_ids() if user_id is None else [user_id]
+        for owner_id in user_ids:
+            after_id = None
+            while True:
+                ids = list(
+                    islice(self.user_index.iter_ids(owner_id, after_id), TRANSFER_CHUNK)
+                )
+                if not ids:
+                    break
+                # read before yielding, as the todos may change meanwhile
+                todos = [self.todos[todo_id] for todo_id in ids]
+                yield from todos
+                after_id = ids[-1]
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        count = 0
+        for chunk in batched(todos, TRANSFER_CHUNK):
+            ids = [todo.id for todo in chunk]
+            if len(set(ids)) != len(ids) or any(i in self.todos for i in ids):
+                raise ValueError("Todo ids are already taken")
+            # one version per user and chunk, as for any other write
+            versions: dict[int, int] = {}
+            for todo in chunk:
+                if todo.user_id not in versions:
+                    versions[todo.user_id] = self._next_version(todo.user_id)
+                self.todos[todo.id] = todo
+                self.search_index.put(
+                    todo.id, todo.user_id, todo.title, todo.description
+                )
+                self.user_index.add(todo.user_id, todo.id)
+                self.versions.changed(todo.user_id, todo.id, versions[todo.user_id])
+            self.next_id = max(self.next_id, max(ids) + 1)
+            count += len(chunk)
+        return count
 
 
 def get_in_memory_storage() -> tuple[InMemoryUserStorage, InMemoryTodoStorage]:
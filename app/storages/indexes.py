@@ -0,0 +1,119 @@
+import bisect
+from typing import Iterator
+
+
+class SortedSet:
+    """Items kept in ascending order, with O(1) amortized removals.
+
+    Removing from the middle of a list shifts everything after it, which makes
+    clearing many items quadratic. Removed items are instead remembered as
+    tombstones and skipped, and the list is compacted once they make up half
+    of it, which costs as much as the removals it follows.
+    """
+
+    def __init__(self):
+        self._items: list = []
+        self._removed: set = set()
+
+    def __len__(self) -> int:
+        return len(self._items) - len(self._removed)
+
+    def __contains__(self, item) -> bool:
+        position = bisect.bisect_left(self._items, item)
+        return (
+            position < len(self._items)
+            and self._items[position] == item
+            and item not in self._removed
+        )
+
+    def add(self, item) -> None:
+        if item in self._removed:
+            # still in the list, at its place
+            self._removed.discard(item)
+        elif not self._items or self._items[-1] < item:
+            # ids are allocated monotonically, so this is the common case
+            self._items.append(item)
+        else:
+            bisect.insort(self._items, item)
+
+    def remove(self, item) -> None:
+        if item not in self:
+            return
+        self._removed.add(item)
+        if 2 * len(self._removed) > len(self._items):
+            self._items = [i for i in self._items if i not in self._removed]
+            self._removed.clear()
+
+    def to_list(self) -> list:
+        if not self._removed:
+            return list(self._items)
+        return [item for item in self._items if item not in self._removed]
+
+    def iter_from(
+        self, start=None, descending: bool = False, inclusive: bool = False
+    ) -> Iterator:
+        """Yield the items after `start` (or from it if `inclusive`), in the
+        given order, or all of them without `start`."""
+        items = self._items
+        if descending:
+            if start is None:
+                end = len(items)
+            elif inclusive:
+                end = bisect.bisect_right(items, start)
+            else:
+                end = bisect.bisect_left(items, start)
+            positions = range(end - 1, -1, -1)
+        else:
+            if start is None:
+                begin = 0
+            elif inclusive:
+                begin = bisect.bisect_left(items, start)
+            else:
+                begin = bisect.bisect_right(items, start)
+            positions = range(begin, len(items))
+        for position in positions:
+            if self._items is not items:
+                # compacted meanwhile; carry on after the last item yielded
+                yield from self.iter_from(start, descending, inclusive)
+                return
+            item = items[position]
+            if item not in self._removed:
+                start, inclusive = item, False
+                yield item
+
+
+class UserTaskIndex:
+    """Ids of each user's todos, kept in ascending order."""
+
+    def __init__(self):
+        self._ids: dict[int, SortedSet] = {}
+
+    def add(self, user_id: int, todo_id: int) -> None:
+        ids = self._ids.get(user_id)
+        if ids is None:
+            ids = self._ids[user_id] = SortedSet()
+        ids.add(todo_id)
+
+    def remove(self, user_id: int, todo_id: int) -> None:
+        ids = self._ids.get(user_id)
+        if ids is None:
+            return
+        ids.remove(todo_id)
+        if not ids:
+            del self._ids[user_id]
+
+    def user_ids(self) -> list[int]:
+        """Ids of the users that have todos, in ascending order."""
+        return sorted(self._ids)
+
+    def ids(self, user_id: int) -> list[int]:
+        ids = self._ids.get(user_id)
+        return [] if ids is None else ids.to_list()
+
+    def iter_ids(
+        self, user_id: int, after_id: int | None = None, descending: bool = False
+    ) -> Iterator[int]:
+        """Yield a user's ids that come after `after_id` in the given order."""
+        ids = self._ids.get(user_id)
+        if ids is not None:
+            yield from ids.iter_from(after_id, descending)
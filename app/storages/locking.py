@@ -0,0 +1,39 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+class FileLock:
+    """Advisory lock shared between processes, held on `path` with flock.
+
+    Holding it is reentrant, and a nested hold keeps the mode of the outermost
+    one. flock does not exclude threads of the same process from each other, so
+    callers serialize their own threads before taking it.
+    """
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("Locking files between processes needs fcntl")
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._depth = 0
+
+    @contextmanager
+    def hold(self, exclusive: bool = True) -> Iterator[None]:
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        os.close(self._fd)
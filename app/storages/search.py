@@ -0,0 +1,123 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import NamedTuple
+
+from app.storages.indexes import SortedSet
+
+# a match in the title counts this many times a match in the description
+TITLE_WEIGHT = 4.0
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Split text into lowercase words without diacritics.
+
+    This mirrors FTS5's `unicode61 remove_diacritics 2` tokenizer, so every
+    backend finds the same todos for a query.
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text)
+
+
+class _Document(NamedTuple):
+    user_id: int
+    terms: dict[str, float]
+
+
+class _UserIndex:
+    def __init__(self):
+        # sorted, so that the terms sharing a prefix are adjacent
+        self.vocabulary = SortedSet()
+        self.postings: dict[str, dict[int, float]] = {}
+        self.documents = 0
+
+
+class SearchIndex:
+    """Inverted index of todo titles and descriptions, one per user.
+
+    A query matches the todos that contain, for every word of the query, a
+    word starting with it. Matches are ranked by tf-idf, counting title
+    matches `TITLE_WEIGHT` times, and then newest first.
+    """
+
+    def __init__(self):
+        self._users: dict[int, _UserIndex] = {}
+        self._documents: dict[int, _Document] = {}
+
+    @staticmethod
+    def _terms(title: str | None, description: str | None) -> dict[str, float]:
+        terms: Counter[str] = Counter()
+        for word in tokenize(title):
+            terms[word] += TITLE_WEIGHT
+        for word in tokenize(description):
+            terms[word] += 1
+        return dict(terms)
+
+    def put(
+        self, todo_id: int, user_id: int, title: str | None, description: str | None
+    ) -> None:
+        terms = self._terms(title, description)
+        document = self._documents.get(todo_id)
+        if document == (user_id, terms):
+            # e.g. a status change, which leaves the text alone
+            return
+        if document is not None:
+            self.remove(todo_id)
+        self._documents[todo_id] = _Document(user_id, terms)
+        index = self._users.setdefault(user_id, _UserIndex())
+        index.documents += 1
+        for term, weight in terms.items():
+            postings = index.postings.get(term)
+            if postings is None:
+                postings = index.postings[term] = {}
+                index.vocabulary.add(term)
+            postings[todo_id] = weight
+
+    def remove(self, todo_id: int) -> None:
+        document = self._documents.pop(todo_id, None)
+        if document is None:
+            return
+        index = self._users[document.user_id]
+        index.documents -= 1
+        for term in document.terms:
+            postings = index.postings[term]
+            del postings[todo_id]
+            if not postings:
+                del index.postings[term]
+                index.vocabulary.remove(term)
+        if not index.documents:
+            del self._users[document.user_id]
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[int]:
+        """Ids of the user's todos matching `query`, best match first."""
+        index = self._users.get(user_id)
+        words = tokenize(query)
+        if index is None or not words:
+            return []
+        scores: dict[int, float] | None = None
+        for word in dict.fromkeys(words):
+            matches: dict[int, float] = {}
+            for term in index.vocabulary.iter_from(word, inclusive=True):
+                if not term.startswith(word):
+                    break
+                for todo_id, weight in index.postings[term].items():
+                    matches[todo_id] = max(matches.get(todo_id, 0.0), weight)
+            idf = math.log(1 + index.documents / (len(matches) or 1))
+            if scores is None:
+                scores = {todo_id: weight * idf for todo_id, weight in matches.items()}
+            else:
+                scores = {
+                    todo_id: score + matches[todo_id] * idf
+                    for todo_id, score in scores.items()
+                    if todo_id in matches
+                }
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda todo_id: (-scores[todo_id], -todo_id))
+        return ranked[:limit]
@@ -0,0 +1,396 @@
+import argparse
+import os
+from itertools import batched, groupby
+from typing import Iterable, Iterator
+
+from sqlalchemy import Column, Integer, bindparam, delete, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from app.models import Todo
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    TodoChanges,
+    TodoOperation,
+    TodoStorage,
+)
+from app.storages.sqlite_storage import (
+    Base,
+    SQLiteEngineProfile,
+    SQLiteTodoStorage,
+    SQLiteUserStorage,
+    TodoModel,
+    TodoTombstoneModel,
+    TodoVersionModel,
+    UserModel,
+    create_sqlite_engine,
+    prepare_schema,
+)
+
+# Users are hashed into this many buckets, the unit a rebalance moves; it
+# bounds the number of shards.
+BUCKETS = 256
+DEFAULT_SHARDS = 4
+DIRECTORY_FILE = "todos-directory.db"
+
+ShardBase = declarative_base()
+
+
+class BucketModel(ShardBase):
+    """Which shard holds a bucket, kept in the directory database."""
+
+    __tablename__ = "buckets"
+
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(Integer, nullable=False)
+
+
+class TodoSequenceModel(ShardBase):
+    """The last todo id sequence number of a bucket, kept in its shard."""
+
+    __tablename__ = "todo_sequences"
+
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    seq = Column(Integer, nullable=False)
+
+
+def bucket_of(user_id: int) -> int:
+    """The bucket of a user, which is also where the ids of their todos end."""
+    return user_id % BUCKETS
+
+
+def shard_path(data_dir: str, shard: int) -> str:
+    return os.path.join(data_dir, f"todos-shard-{shard}.db")
+
+
+# advances the sequence of the `bucket` parameter by `count` and returns the new
+# number; built once and run on the Core connection so it is compiled once
+ADVANCE_SEQ = (
+    sqlite_insert(TodoSequenceModel.__table__)
+    .values(bucket=bindparam("bucket"), seq=bindparam("count"))
+    .on_conflict_do_update(
+        index_elements=[TodoSequenceModel.bucket],
+        set_={"seq": TodoSequenceModel.seq + bindparam("count")},
+    )
+    .returning(TodoSequenceModel.seq)
+)
+
+
+class ShardTodoStorage(SQLiteTodoStorage):
+    """One shard, which numbers each bucket's todos with the bucket's sequence.
+
+    A todo id is `seq * BUCKETS + bucket`, so it is unique across shards and
+    names the bucket, and thereby the shard, that holds the todo.
+    """
+
+    def _allocate_ids(self, session, user_id: int, count: int) -> list[int]:
+        if not count:
+            return []
+        bucket = bucket_of(user_id)
+        last = (
+            session.connection()
+            .execute(ADVANCE_SEQ, {"bucket": bucket, "count": count})
+            .scalar_one()
+        )
+        return [seq * BUCKETS + bucket for seq in range(last - count + 1, last + 1)]
+
+
+class ShardedSQLiteTodoStorage(TodoStorage):
+    """Todos spread over several SQLite files (shards) by owner.
+
+    A user's todos, version and tombstones all live in the shard of their
+    bucket, so every call touches a single shard and each shard has a write
+    lock of its own. Ids are allocated per bucket (see ShardTodoStorage), so
+    `get_task_by_id` goes straight to the right shard.
+
+    Todos cannot move to a user of another bucket, and imported todos are
+    given new ids, as their old ones would not name their bucket.
+    """
+
+    def __init__(self, shards: list[ShardTodoStorage], bucket_shards: list[int]):
+        self.shards = shards
+        # bucket -> index of its shard in `shards`
+        self.bucket_shards = bucket_shards
+
+    def _for_user(self, user_id: int) -> ShardTodoStorage:
+        return self.shards[self.bucket_shards[bucket_of(user_id)]]
+
+    def _for_todo(self, todo_id: int) -> ShardTodoStorage:
+        return self.shards[self.bucket_shards[todo_id % BUCKETS]]
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def add(self, new_todo: NewTodo) -> Todo:
+        return self._for_user(new_todo.user_id).add(new_todo)
+
+    def delete(self, todo_id: int) -> None:
+        self._for_todo(todo_id).delete(todo_id)
+
+    def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
+        return self._for_user(user_id).get_tasks_by_user_id(user_id)
+
+    def get_task_by_id(self, todo_id: int) -> Todo | None:
+        return self._for_todo(todo_id).get_task_by_id(todo_id)
+
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        return self._for_user(user_id).get_tasks_page(
+            user_id,
+            after_id=after_id,
+            limit=limit,
+            is_done=is_done,
+            descending=descending,
+        )
+
+    def update_status(self, todo_id: int, is_done: bool) -> Todo | None:
+        return self._for_todo(todo_id).update_status(todo_id, is_done)
+
+    def update(self, todo: Todo) -> Todo | None:
+        if bucket_of(todo.user_id) != todo.id % BUCKETS:
+            raise ValueError("Todos cannot move to a user of another bucket")
+        return self._for_todo(todo.id).update(todo)
+
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        return self._for_user(user_id).update_for_user(
+            user_id, todo_id, title=title, description=description, is_done=is_done
+        )
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        return self._for_user(user_id).delete_for_user(user_id, todo_id)
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        return self._for_user(user_id).apply_batch(user_id, operations)
+
+    def get_version(self, user_id: int) -> int:
+        return self._for_user(user_id).get_version(user_id)
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        return self._for_user(user_id).get_changes(user_id, since)
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        return self._for_user(user_id).search(user_id, query, limit)
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        if user_id is not None:
+            yield from self._for_user(user_id).export_todos(user_id)
+            return
+        # grouped by user within each shard
+        for shard in self.shards:
+            yield from shard.export_todos()
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        count = 0
+        for chunk in batched(todos, TRANSFER_CHUNK):
+            ordered = sorted(chunk, key=lambda todo: todo.user_id)
+            for user_id, owned in groupby(ordered, key=lambda todo: todo.user_id):
+                self.apply_batch(
+                    user_id,
+                    [
+                        NewTodo(
+                            user_id=user_id,
+                            title=todo.title,
+                            description=todo.description,
+                            is_done=todo.is_done,
+                        )
+                        for todo in owned
+                    ],
+                )
+            count += len(chunk)
+        return count
+
+
+def _open_shard(data_dir: str, shard: int, profile: SQLiteEngineProfile | None):
+    engine = create_sqlite_engine(f"sqlite:///{shard_path(data_dir, shard)}", profile)
+    prepare_schema(engine)
+    ShardBase.metadata.create_all(engine, tables=[TodoSequenceModel.__table__])
+    return engine
+
+
+def _open_directory(
+    data_dir: str, profile: SQLiteEngineProfile | None
+) -> tuple[Engine, list[int] | None]:
+    engine = create_sqlite_engine(
+        f"sqlite:///{os.path.join(data_dir, DIRECTORY_FILE)}", profile
+    )
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection, tables=[UserModel.__table__])
+        ShardBase.metadata.create_all(connection, tables=[BucketModel.__table__])
+        rows = connection.execute(
+            select(BucketModel.shard).order_by(BucketModel.bucket)
+        ).all()
+    return engine, [shard for (shard,) in rows] or None
+
+
+def get_sharded_sqlite_storage(
+    data_dir: str = ".",
+    shards: int | None = None,
+    profile: SQLiteEngineProfile | None = None,
+) -> tuple[SQLiteUserStorage, ShardedSQLiteTodoStorage]:
+    """Open (or create with `shards` shards) the sharded storage in `data_dir`.
+
+    Users live in the directory database next to the bucket map; they are
+    few and rarely written compared to todos.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    directory, bucket_shards = _open_directory(data_dir, profile)
+    if bucket_shards is None:
+        count = shards or DEFAULT_SHARDS
+        if not 1 <= count <= BUCKETS:
+            raise ValueError(f"The number of shards must be between 1 and {BUCKETS}")
+        bucket_shards = [bucket % count for bucket in range(BUCKETS)]
+        with directory.begin() as connection:
+            connection.execute(
+                insert(BucketModel),
+                [
+                    {"bucket": bucket, "shard": shard}
+                    for bucket, shard in enumerate(bucket_shards)
+                ],
+            )
+    count = max(bucket_shards) + 1
+    if shards is not None and shards != count:
+        directory.dispose()
+        raise ValueError(f"The storage has {count} shards; rebalance it to change that")
+    todo_shards = [
+        ShardTodoStorage(
+            sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                bind=_open_shard(data_dir, shard, profile),
+            )
+        )
+        for shard in range(count)
+    ]
+    user_storage = SQLiteUserStorage(
+        sessionmaker(autocommit=False, autoflush=False, bind=directory)
+    )
+    return user_storage, ShardedSQLiteTodoStorage(todo_shards, bucket_shards)
+
+
+# -- rebalancing ---------------------------------------------------------------
+
+# the per-user tables a bucket's rows are moved between shards with
+_USER_TABLES = (
+    TodoModel.__table__,
+    TodoVersionModel.__table__,
+    TodoTombstoneModel.__table__,
+)
+
+
+def plan_rebalance(bucket_shards: list[int], shards: int) -> list[int]:
+    """A map of buckets to `shards` shards that are as even as possible,
+    keeping as many buckets where they are as that allows."""
+    capacity = [
+        BUCKETS // shards + (1 if shard < BUCKETS % shards else 0)
+        for shard in range(shards)
+    ]
+    plan: list[int | None] = []
+    for shard in bucket_shards:
+        if shard < shards and capacity[shard]:
+            capacity[shard] -= 1
+            plan.append(shard)
+        else:
+            plan.append(None)
+    free = (shard for shard in range(shards) for _ in range(capacity[shard]))
+    return [next(free) if shard is None else shard for shard in plan]
+
+
+def _bucket_rows(table, buckets: list[int]):
+    if table is TodoSequenceModel.__table__:
+        return table.c.bucket.in_(buckets)
+    return (table.c.user_id % BUCKETS).in_(buckets)
+
+
+def _move_buckets(source: Engine, target: Engine, buckets: list[int]) -> None:
+    with source.connect() as reader, target.begin() as writer:
+        for table in (*_USER_TABLES, TodoSequenceModel.__table__):
+            result = reader.execution_options(stream_results=True).execute(
+                select(table).where(_bucket_rows(table, buckets))
+            )
+            for rows in result.partitions(TRANSFER_CHUNK):
+                writer.execute(insert(table), [row._asdict() for row in rows])
+
+
+def _drop_buckets(engine: Engine, buckets: list[int]) -> None:
+    with engine.begin() as connection:
+        for table in (*_USER_TABLES, TodoSequenceModel.__table__):
+            connection.execute(delete(table).where(_bucket_rows(table, buckets)))
+
+
+def rebalance(
+    data_dir: str, shards: int, profile: SQLiteEngineProfile | None = None
+) -> list[tuple[int, int, int]]:
+    """Spread the buckets evenly over `shards` shards and return the moves,
+    as (bucket, from shard, to shard).
+
+    No process may use the storage meanwhile. Each group of buckets is copied,
+    then reassigned in the directory, then dropped from its old shard; rows
+    left behind by an interrupted run are dropped when it is run again.
+    """
+    if not 1 <= shards <= BUCKETS:
+        raise ValueError(f"The number of shards must be between 1 and {BUCKETS}")
+    directory, bucket_shards = _open_directory(data_dir, profile)
+    if bucket_shards is None:
+        directory.dispose()
+        raise ValueError(f"No sharded storage in {data_dir}")
+    engines = [
+        _open_shard(data_dir, shard, profile)
+        for shard in range(max(max(bucket_shards) + 1, shards))
+    ]
+    try:
+        for shard, engine in enumerate(engines):
+            strays = [b for b in range(BUCKETS) if bucket_shards[b] != shard]
+            _drop_buckets(engine, strays)
+        plan = plan_rebalance(bucket_shards, shards)
+        moves = [
+            (bucket, bucket_shards[bucket], plan[bucket])
+            for bucket in range(BUCKETS)
+            if plan[bucket] != bucket_shards[bucket]
+        ]
+        by_route = sorted(moves, key=lambda move: move[1:])
+        for (source, target), group in groupby(by_route, key=lambda m: m[1:]):
+            buckets = [bucket for bucket, _, _ in group]
+            _move_buckets(engines[source], engines[target], buckets)
+            with directory.begin() as connection:
+                connection.execute(
+                    update(BucketModel)
+                    .where(BucketModel.bucket.in_(buckets))
+                    .values(shard=target)
+                )
+            _drop_buckets(engines[source], buckets)
+        return moves
+    finally:
+        directory.dispose()
+        for engine in engines:
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebalance the sharded SQLite storage; stop the app first"
+    )
+    parser.add_argument("--data-dir", default=".")
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    moves = rebalance(args.data_dir, args.shards)
+    for bucket, source, target in moves:
+        print(f"bucket {bucket}: shard {source} -> shard {target}")
+    print(f"Moved {len(moves)} of {BUCKETS} buckets onto {args.shards} shard(s)")
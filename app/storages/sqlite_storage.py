@@ -1,8 +1,47 @@
-from sqlalchemy import Boolean, Column, Integer, String, create_engine
+import time
+from dataclasses import asdict, dataclass
+from itertools import batched
+from typing import Iterable, Iterator
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    String,
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    insert,
+    inspect,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 
+from app.metrics import observe_stage
 from app.models import Todo, User
-from app.storages.base import NewTodo, NewUser, TodoStorage, UserStorage
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    NewUser,
+    TodoChanges,
+    TodoDeletion,
+    TodoOperation,
+    TodoStorage,
+    TodoToggle,
+    TodoUpdate,
+    UserStorage,
+)
+from app.storages.search import TITLE_WEIGHT, tokenize
+from app.storages.versions import CHANGE_HISTORY, can_answer
 
 Base = declarative_base()
 
@@ -19,18 +58,248 @@ class UserModel(Base):
 
 class TodoModel(Base):
     __tablename__ = "todos"
+    __table_args__ = (
+        Index("ix_todos_user_id", "user_id"),
+        Index("ix_todos_user_id_is_done_id", "user_id", "is_done", "id"),
+        Index("ix_todos_user_id_version", "user_id", "version"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
     title = Column(String, nullable=False)
     description = Column(String, nullable=True)
     is_done = Column(Boolean, default=False)
+    # the owner's version when the todo last changed
+    version = Column(Integer, nullable=False, default=0)
+
+
+class TodoVersionModel(Base):
+    __tablename__ = "todo_versions"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False)
+
+
+class TodoTombstoneModel(Base):
+    """A deleted todo, kept for `CHANGE_HISTORY` versions of its owner."""
+
+    __tablename__ = "todo_tombstones"
+    __table_args__ = (
+        Index("ix_todo_tombstones_user_id_version", "user_id", "version"),
+    )
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    todo_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False)
+
+
+# An FTS5 index over the todos' text. It is an external content table, so the
+# text is stored once in `todos`, and triggers keep it in step with every
+# insert, update and delete. metadata.create_all does not know virtual tables.
+SEARCH_SCHEMA: list[str] = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5("
+    "title, description, content='todos', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_insert AFTER INSERT ON todos BEGIN "
+    "INSERT INTO todos_fts (rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_delete AFTER DELETE ON todos BEGIN "
+    "INSERT INTO todos_fts (todos_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_update "
+    "AFTER UPDATE OF title, description ON todos BEGIN "
+    "INSERT INTO todos_fts (todos_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO todos_fts (rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+]
+
+SEARCH_QUERY = text(
+    "SELECT todos.id, todos.user_id, todos.title, todos.description, "
+    "todos.is_done FROM todos_fts JOIN todos ON todos.id = todos_fts.rowid "
+    "WHERE todos_fts MATCH :match AND todos.user_id = :user_id "
+    f"ORDER BY bm25(todos_fts, {TITLE_WEIGHT}, 1.0), todos.id DESC LIMIT :limit"
+).columns(
+    # typed, so that is_done comes back as a bool rather than SQLite's integer
+    TodoModel.id,
+    TodoModel.user_id,
+    TodoModel.title,
+    TodoModel.description,
+    TodoModel.is_done,
+)
+
+
+def search_params(user_id: int, query: str, limit: int | None) -> dict | None:
+    """Bind parameters of SEARCH_QUERY, or None for a query without words."""
+    words = tokenize(query)
+    if not words:
+        return None
+    return {
+        # every word as a quoted prefix, which FTS5 requires all of
+        "match": " ".join(f'"{word}"*' for word in words),
+        "user_id": user_id,
+        # a negative limit means none in SQLite
+        "limit": -1 if limit is None else limit,
+    }
+
+
+# Schema changes for databases created by an older version of the app, applied
+# in order. `PRAGMA user_version` records how many of them a database has seen;
+# fresh databases get the same schema from `Base.metadata.create_all`.
+MIGRATIONS: list[list[str]] = [
+    [
+        "CREATE INDEX IF NOT EXISTS ix_todos_user_id ON todos (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_todos_user_id_is_done_id "
+        "ON todos (user_id, is_done, id)",
+    ],
+    [
+        # existing todos count as version 0, like users without a counter
+        "ALTER TABLE todos ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS ix_todos_user_id_version "
+        "ON todos (user_id, version)",
+    ],
+    [
+        *SEARCH_SCHEMA,
+        # index the todos that are already there
+        "INSERT INTO todos_fts (todos_fts) VALUES ('rebuild')",
+    ],
+]
+
+
+def migrate(connection: Connection) -> None:
+    version = connection.execute(text("PRAGMA user_version")).scalar()
+    for statements in MIGRATIONS[version:]:
+        for statement in statements:
+            connection.execute(text(statement))
+    if version < len(MIGRATIONS):
+        connection.execute(text(f"PRAGMA user_version = {len(MIGRATIONS)}"))
+
+
+def prepare_schema(engine: Engine) -> None:
+    with engine.begin() as connection:
+        fresh = not inspect(connection).has_table(TodoModel.__tablename__)
+        Base.metadata.create_all(connection)
+        if fresh:
+            # create_all has already built the latest tables
+            for statement in SEARCH_SCHEMA:
+                connection.execute(text(statement))
+            connection.execute(text(f"PRAGMA user_version = {len(MIGRATIONS)}"))
+        else:
+            migrate(connection)
+
+
+def bump_version(user_id: int):
+    """Statement that increments a user's version and returns the new one."""
+    return (
+        sqlite_insert(TodoVersionModel)
+        .values(user_id=user_id, version=1)
+        .on_conflict_do_update(
+            index_elements=[TodoVersionModel.user_id],
+            set_={"version": TodoVersionModel.version + 1},
+        )
+        .returning(TodoVersionModel.version)
+    )
+
+
+# Run with a list of parameters, one set per todo, so that a batch of
+# deletions costs one executemany of each statement.
+DELETE_OWNED_TODO = delete(TodoModel.__table__).where(
+    TodoModel.__table__.c.id == bindparam("todo_id"),
+    TodoModel.__table__.c.user_id == bindparam("owner_id"),
+)
+_tombstone = sqlite_insert(TodoTombstoneModel.__table__)
+RECORD_TOMBSTONE = _tombstone.on_conflict_do_update(
+    index_elements=[TodoTombstoneModel.user_id, TodoTombstoneModel.todo_id],
+    set_={"version": _tombstone.excluded.version},
+)
+
+
+def delete_owned_params(user_id: int, todo_ids: list[int]) -> list[dict]:
+    return [{"todo_id": todo_id, "owner_id": user_id} for todo_id in todo_ids]
+
+
+def record_deletions(user_id: int, todo_ids: list[int], version: int) -> list:
+    """Statements, with their parameters, that leave a tombstone for each todo
+    and forget the outdated ones."""
+    return [
+        (
+            RECORD_TOMBSTONE,
+            [
+                {"user_id": user_id, "todo_id": todo_id, "version": version}
+                for todo_id in todo_ids
+            ],
+        ),
+        (
+            delete(TodoTombstoneModel).where(
+                TodoTombstoneModel.user_id == user_id,
+                TodoTombstoneModel.version <= version - CHANGE_HISTORY,
+            ),
+            None,
+        ),
+    ]
+
+
+def export_users_query(after_id: int | None):
+    """The chunk of users that follows `after_id`, in id order."""
+    query = (
+        select(
+            UserModel.id,
+            UserModel.username,
+            UserModel.email,
+            UserModel.hashed_password,
+            UserModel.disabled,
+        )
+        .order_by(UserModel.id)
+        .limit(TRANSFER_CHUNK)
+    )
+    if after_id is not None:
+        query = query.where(UserModel.id > after_id)
+    return query
+
+
+def export_todos_query(user_id: int | None, after: tuple[int, int] | None):
+    """The chunk of todos that follows `after`, a (user_id, id) position."""
+    query = (
+        select(
+            TodoModel.id,
+            TodoModel.user_id,
+            TodoModel.title,
+            TodoModel.description,
+            TodoModel.is_done,
+        )
+        .order_by(TodoModel.user_id, TodoModel.id)
+        .limit(TRANSFER_CHUNK)
+    )
+    if user_id is not None:
+        query = query.where(TodoModel.user_id == user_id)
+    if after is not None:
+        query = query.where(tuple_(TodoModel.user_id, TodoModel.id) > after)
+    return query
+
+
+def version_query(user_id: int):
+    return select(TodoVersionModel.version).where(TodoVersionModel.user_id == user_id)
+
+
+def deleted_since_query(user_id: int, since: int):
+    return (
+        select(TodoTombstoneModel.todo_id)
+        .where(
+            TodoTombstoneModel.user_id == user_id,
+            TodoTombstoneModel.version > since,
+        )
+        .order_by(TodoTombstoneModel.version)
+    )
 
 
 class SQLiteUserStorage(UserStorage):
     def __init__(self, session_local):
         self.SessionLocal = session_local
 
+    def close(self) -> None:
+        # both storages share the engine and disposing it twice is harmless
+        self.SessionLocal.kw["bind"].dispose()
+
     def add_user(self, new_user: NewUser) -> User:
         session = self.SessionLocal()
         user_model = UserModel(
@@ -128,18 +397,62 @@ class SQLiteUserStorage(UserStorage):
         session.close()
         return None
 
+    def export_users(self) -> Iterator[User]:
+        after_id = None
+        while True:
+            session = self.SessionLocal()
+            users = session.execute(export_users_query(after_id)).all()
+            session.close()
+            if not users:
+                return
+            for user in users:
+                yield User(
+                    id=user.id,
+                    username=user.username,
+                    email=user.email,
+                    hashed_password=user.hashed_password,
+                    disabled=user.disabled,
+                )
+            after_id = users[-1].id
+
+    def import_users(self, users: Iterable[User]) -> int:
+        count = 0
+        for chunk in batched(users, TRANSFER_CHUNK):
+            session = self.SessionLocal()
+            try:
+                session.execute(insert(UserModel), [asdict(user) for user in chunk])
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                raise ValueError("Users conflict with existing users")
+            finally:
+                session.close()
+            count += len(chunk)
+        return count
+
 
 class SQLiteTodoStorage(TodoStorage):
     def __init__(self, session_local):
         self.SessionLocal = session_local
 
+    def close(self) -> None:
+        # both storages share the engine and disposing it twice is harmless
+        self.SessionLocal.kw["bind"].dispose()
+
+    def _allocate_ids(self, session, user_id: int, count: int) -> list[int | None]:
+        """Ids for `count` new todos of `user_id`; None lets SQLite pick one."""
+        return [None] * count
+
     def add(self, new_todo: NewTodo) -> Todo:
         session = self.SessionLocal()
+        (todo_id,) = self._allocate_ids(session, new_todo.user_id, 1)
         todo_model = TodoModel(
+            id=todo_id,
             user_id=new_todo.user_id,
             title=new_todo.title,
             description=new_todo.description,
             is_done=new_todo.is_done,
+            version=session.execute(bump_version(new_todo.user_id)).scalar_one(),
         )
         session.add(todo_model)
         session.commit()
@@ -153,10 +466,30 @@ class SQLiteTodoStorage(TodoStorage):
             is_done=todo_model.is_done,
         )
 
+    @staticmethod
+    def _delete_owned(session, user_id: int, todo_id: int) -> bool:
+        version = session.execute(bump_version(user_id)).scalar_one()
+        result = session.execute(
+            delete(TodoModel).where(
+                TodoModel.id == todo_id, TodoModel.user_id == user_id
+            )
+        )
+        if not result.rowcount:
+            # nothing changed, so neither does the version
+            session.rollback()
+            return False
+        for statement, params in record_deletions(user_id, [todo_id], version):
+            session.execute(statement, params)
+        session.commit()
+        return True
+
     def delete(self, todo_id: int):
         session = self.SessionLocal()
-        session.query(TodoModel).filter(TodoModel.id == todo_id).delete()
-        session.commit()
+        user_id = session.execute(
+            select(TodoModel.user_id).where(TodoModel.id == todo_id)
+        ).scalar()
+        if user_id is not None:
+            self._delete_owned(session, user_id, todo_id)
         session.close()
 
     def get_tasks_by_user_id(self, user_id: int) -> list[Todo]:
@@ -174,6 +507,39 @@ class SQLiteTodoStorage(TodoStorage):
             for todo in todos
         ]
 
+    def get_tasks_page(
+        self,
+        user_id: int,
+        after_id: int | None = None,
+        limit: int | None = None,
+        is_done: bool | None = None,
+        descending: bool = False,
+    ) -> list[Todo]:
+        session = self.SessionLocal()
+        query = session.query(TodoModel).filter(TodoModel.user_id == user_id)
+        if is_done is not None:
+            query = query.filter(TodoModel.is_done == is_done)
+        if descending:
+            if after_id is not None:
+                query = query.filter(TodoModel.id < after_id)
+            query = query.order_by(TodoModel.id.desc())
+        else:
+            if after_id is not None:
+                query = query.filter(TodoModel.id > after_id)
+            query = query.order_by(TodoModel.id)
+        todos = query.limit(limit).all()
+        session.close()
+        return [
+            Todo(
+                id=todo.id,
+                user_id=todo.user_id,
+                title=todo.title,
+                description=todo.description,
+                is_done=todo.is_done,
+            )
+            for todo in todos
+        ]
+
     def get_task_by_id(self, todo_id: int) -> Todo | None:
         session = self.SessionLocal()
         todo = session.query(TodoModel).filter(TodoModel.id == todo_id).first()
@@ -193,6 +559,7 @@ class SQLiteTodoStorage(TodoStorage):
         todo = session.query(TodoModel).filter(TodoModel.id == todo_id).first()
         if todo:
             todo.is_done = is_done
+            todo.version = session.execute(bump_version(todo.user_id)).scalar_one()
             session.commit()
             session.refresh(todo)
             session.close()
@@ -213,6 +580,9 @@ class SQLiteTodoStorage(TodoStorage):
             todo_model.title = todo.title
             todo_model.description = todo.description
             todo_model.is_done = todo.is_done
+            todo_model.version = session.execute(
+                bump_version(todo_model.user_id)
+            ).scalar_one()
             session.commit()
             session.refresh(todo_model)
             session.close()
@@ -220,11 +590,331 @@ class SQLiteTodoStorage(TodoStorage):
         session.close()
         return None
 
+    def update_for_user(
+        self,
+        user_id: int,
+        todo_id: int,
+        title: str | None = None,
+        description: str | None = None,
+        is_done: bool | None = None,
+    ) -> Todo | None:
+        values = {
+            name: value
+            for name, value in (
+                ("title", title),
+                ("description", description),
+                ("is_done", is_done),
+            )
+            if value is not None
+        }
+        owned = (TodoModel.id == todo_id) & (TodoModel.user_id == user_id)
+        columns = (
+            TodoModel.id,
+            TodoModel.user_id,
+            TodoModel.title,
+            TodoModel.description,
+            TodoModel.is_done,
+        )
+        session = self.SessionLocal()
+        if values:
+            values["version"] = session.execute(bump_version(user_id)).scalar_one()
+            statement = (
+                update(TodoModel).where(owned).values(values).returning(*columns)
+            )
+        else:
+            statement = select(*columns).where(owned)
+        row = session.execute(statement).first()
+        if row is None:
+            session.rollback()
+        else:
+            session.commit()
+        session.close()
+        if row is None:
+            return None
+        return Todo(
+            id=row.id,
+            user_id=row.user_id,
+            title=row.title,
+            description=row.description,
+            is_done=row.is_done,
+        )
+
+    def delete_for_user(self, user_id: int, todo_id: int) -> bool:
+        session = self.SessionLocal()
+        deleted = self._delete_owned(session, user_id, todo_id)
+        session.close()
+        return deleted
+
+    def apply_batch(
+        self, user_id: int, operations: list[TodoOperation]
+    ) -> list[Todo | None]:
+        if not operations:
+            return []
+        session = self.SessionLocal()
+        try:
+            version = session.execute(bump_version(user_id)).scalar_one()
+            new_ids = iter(
+                self._allocate_ids(
+                    session,
+                    user_id,
+                    sum(isinstance(operation, NewTodo) for operation in operations),
+                )
+            )
+            results = []
+            # deleted together once every operation has been checked
+            deleted: dict[int, None] = {}
+            for operation in operations:
+                if isinstance(operation, NewTodo):
+                    if operation.user_id != user_id:
+                        raise ValueError("Task not found")
+                    todo_model = TodoModel(
+                        id=next(new_ids),
+                        user_id=operation.user_id,
+                        title=operation.title,
+                        description=operation.description,
+                        is_done=operation.is_done,
+                        version=version,
+                    )
+                    session.add(todo_model)
+                elif operation.todo_id in deleted:
+                    raise ValueError("Task not found")
+                elif isinstance(operation, TodoDeletion):
+                    deleted[operation.todo_id] = None
+                    results.append(None)
+                    continue
+                else:
+                    todo_model = (
+                        session.query(TodoModel)
+                        .filter(
+                            TodoModel.id == operation.todo_id,
+                            TodoModel.user_id == user_id,
+                        )
+                        .first()
+                    )
+                    if todo_model is None:
+                        raise ValueError("Task not found")
+                    todo_model.version = version
+                    if isinstance(operation, TodoToggle):
+                        todo_model.is_done = not todo_model.is_done
+                    elif isinstance(operation, TodoUpdate):
+                        if operation.title is not None:
+                            todo_model.title = operation.title
+                        if operation.description is not None:
+                            todo_model.description = operation.description
+                        if operation.is_done is not None:
+                            todo_model.is_done = operation.is_done
+                if todo_model.id is None:
+                    # SQLite picks the id
+                    session.flush()
+                results.append(
+                    Todo(
+                        id=todo_model.id,
+                        user_id=todo_model.user_id,
+                        title=todo_model.title,
+                        description=todo_model.description,
+                        is_done=todo_model.is_done,
+                    )
+                )
+            if deleted:
+                session.flush()
+                result = session.execute(
+                    DELETE_OWNED_TODO, delete_owned_params(user_id, list(deleted))
+                )
+                if result.rowcount != len(deleted):
+                    raise ValueError("Task not found")
+                for statement, params in record_deletions(
+                    user_id, list(deleted), version
+                ):
+                    session.execute(statement, params)
+            session.commit()
+            return results
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def search(self, user_id: int, query: str, limit: int | None = None) -> list[Todo]:
+        params = search_params(user_id, query, limit)
+        if params is None:
+            return []
+        session = self.SessionLocal()
+        rows = session.execute(SEARCH_QUERY, params).all()
+        session.close()
+        return [
+            Todo(
+                id=row.id,
+                user_id=row.user_id,
+                title=row.title,
+                description=row.description,
+                is_done=row.is_done,
+            )
+            for row in rows
+        ]
+
+    def get_version(self, user_id: int) -> int:
+        session = self.SessionLocal()
+        version = session.execute(version_query(user_id)).scalar()
+        session.close()
+        return version or 0
+
+    def get_changes(self, user_id: int, since: int) -> TodoChanges | None:
+        session = self.SessionLocal()
+        version = session.execute(version_query(user_id)).scalar() or 0
+        if not can_answer(version, since):
+            session.close()
+            return None
+        if since == version:
+            session.close()
+            return TodoChanges(version=version, todos=[], deleted_ids=[])
+        todos = (
+            session.query(TodoModel)
+            .filter(TodoModel.user_id == user_id, TodoModel.version > since)
+            .order_by(TodoModel.version)
+            .all()
+        )
+        deleted_ids = session.execute(deleted_since_query(user_id, since)).scalars()
+        changes = TodoChanges(
+            version=version,
+            todos=[
+                Todo(
+                    id=todo.id,
+                    user_id=todo.user_id,
+                    title=todo.title,
+                    description=todo.description,
+                    is_done=todo.is_done,
+                )
+                for todo in todos
+            ],
+            deleted_ids=list(deleted_ids),
+        )
+        session.close()
+        return changes
+
+    def export_todos(self, user_id: int | None = None) -> Iterator[Todo]:
+        after = None
+        while True:
+            # a session per chunk, so that no read transaction stays open
+            # while the caller consumes the todos
+            session = self.SessionLocal()
+            todos = session.execute(export_todos_query(user_id, after)).all()
+            session.close()
+            if not todos:
+                return
+            for todo in todos:
+                yield Todo(
+                    id=todo.id,
+                    user_id=todo.user_id,
+                    title=todo.title,
+                    description=todo.description,
+                    is_done=todo.is_done,
+                )
+            after = (todos[-1].user_id, todos[-1].id)
+
+    def import_todos(self, todos: Iterable[Todo]) -> int:
+        count = 0
+        for chunk in batched(todos, TRANSFER_CHUNK):
+            session = self.SessionLocal()
+            try:
+                # one version per user and chunk, as for any other write
+                versions = {
+                    user_id: session.execute(bump_version(user_id)).scalar_one()
+                    for user_id in dict.fromkeys(todo.user_id for todo in chunk)
+                }
+                session.execute(
+                    insert(TodoModel),
+                    [
+                        {**asdict(todo), "version": versions[todo.user_id]}
+                        for todo in chunk
+                    ],
+                )
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                raise ValueError("Todo ids are already taken")
+            finally:
+                session.close()
+            count += len(chunk)
+        return count
+
+
+@dataclass
+class SQLiteEngineProfile:
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    # bytes of the database file mapped into memory
+    mmap_size: int = 256 * 1024 * 1024
+    # negative values are KiB, positive values are pages
+    cache_size: int = -64 * 1024
+    busy_timeout_ms: int = 5000
+    pool_size: int = 8
+    max_overflow: int = 8
+    pool_timeout: float = 30.0
+
+
+def create_sqlite_engine(
+    db_url: str, profile: SQLiteEngineProfile | None = None
+) -> Engine:
+    """Create a pooled engine whose connections share one set of pragmas.
+
+    In WAL mode readers no longer wait behind a writer, and
+    `synchronous=NORMAL` only syncs the WAL at checkpoints.
+    """
+    profile = profile or SQLiteEngineProfile()
+    database = make_url(db_url).database
+    # pooled connections are handed to FastAPI's worker threads
+    connect_args = {
+        "check_same_thread": False,
+        "timeout": profile.busy_timeout_ms / 1000,
+    }
+    if database in (None, "", ":memory:"):
+        # every connection to :memory: would be a separate database
+        engine = create_engine(db_url, connect_args=connect_args, poolclass=StaticPool)
+    else:
+        engine = create_engine(
+            db_url,
+            connect_args=connect_args,
+            poolclass=QueuePool,
+            pool_size=profile.pool_size,
+            max_overflow=profile.max_overflow,
+            pool_timeout=profile.pool_timeout,
+        )
+    install_pragmas(engine, profile)
+    time_queries(engine)
+    return engine
+
+
+def install_pragmas(engine: Engine, profile: SQLiteEngineProfile) -> None:
+    """Apply the profile's pragmas to every connection the engine opens."""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={profile.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={profile.synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={int(profile.mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(profile.cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(profile.busy_timeout_ms)}")
+        cursor.close()
+
+
+def time_queries(engine: Engine) -> None:
+    """Time every statement the engine runs as the "sqlite_query" stage."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(connection, cursor, statement, parameters, context, many):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(connection, cursor, statement, parameters, context, many):
+        observe_stage("sqlite_query", time.perf_counter() - context.query_started)
+
 
 def get_sqlite_storage(
     db_url: str = "sqlite:///app.db",
+    profile: SQLiteEngineProfile | None = None,
 ) -> tuple[SQLiteUserStorage, SQLiteTodoStorage]:
-    engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
+    engine = create_sqlite_engine(db_url, profile)
+    prepare_schema(engine)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     return SQLiteUserStorage(SessionLocal), SQLiteTodoStorage(SessionLocal)
@@ -0,0 +1,129 @@
+# NDJSON import and export, one JSON document per line.
+#
+# A user's todos are exported as the todo objects the API returns, and imported
+# from objects with a `title`, a `description` and an optional `is_done`; the
+# todos get new ids. A dump of whole storages (`dump_storage`) has a
+# `{"user": ...}` line per user followed by a `{"todo": ...}` line per todo and
+# is loaded as it is, ids included, which is how data moves between backends.
+
+from itertools import chain
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+import orjson
+
+from app.models import Todo, User
+from app.storages.base import NewTodo, TodoStorage, UserStorage
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode(record) -> bytes:
+    # orjson serializes Todo and User dataclasses directly
+    return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _parse(number: int, line: bytes | str) -> dict | None:
+    if not line.strip():
+        return None
+    try:
+        record = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        raise ValueError(f"Line {number}: not valid JSON")
+    if not isinstance(record, dict):
+        raise ValueError(f"Line {number}: expected a JSON object")
+    return record
+
+
+def _records(lines: Iterable[bytes | str]) -> Iterator[tuple[int, dict]]:
+    for number, line in enumerate(lines, 1):
+        record = _parse(number, line)
+        if record is not None:
+            yield number, record
+
+
+def decode_new_todo(number: int, record: dict, user_id: int) -> NewTodo:
+    title = record.get("title")
+    description = record.get("description")
+    is_done = record.get("is_done", False)
+    if not isinstance(title, str) or not isinstance(description, str):
+        raise ValueError(f"Line {number}: title and description must be strings")
+    if not isinstance(is_done, bool):
+        raise ValueError(f"Line {number}: is_done must be a boolean")
+    return NewTodo(
+        user_id=user_id, title=title, description=description, is_done=is_done
+    )
+
+
+def read_new_todos(lines: Iterable[bytes | str], user_id: int) -> Iterator[NewTodo]:
+    """Decode a user's todos from NDJSON lines, raising ValueError on bad ones."""
+    for number, record in _records(lines):
+        yield decode_new_todo(number, record, user_id)
+
+
+async def aread_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream of byte chunks, such as a request body, into lines."""
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def aread_new_todos(
+    lines: AsyncIterable[bytes], user_id: int
+) -> AsyncIterator[NewTodo]:
+    number = 0
+    async for line in lines:
+        number += 1
+        record = _parse(number, line)
+        if record is not None:
+            yield decode_new_todo(number, record, user_id)
+
+
+def dump_storage(
+    user_storage: UserStorage, todo_storage: TodoStorage
+) -> Iterator[bytes]:
+    """NDJSON lines of every user, then of every todo."""
+    for user in user_storage.export_users():
+        yield encode({"user": user})
+    for todo in todo_storage.export_todos():
+        yield encode({"todo": todo})
+
+
+def load_storage(
+    user_storage: UserStorage,
+    todo_storage: TodoStorage,
+    lines: Iterable[bytes | str],
+) -> tuple[int, int]:
+    """Import a `dump_storage` stream and return how many users and todos.
+
+    Both the users and the todos are streamed into their storage as they are
+    read; neither is held in memory whole.
+    """
+    records = _records(lines)
+    first_todo = []
+
+    def users() -> Iterator[User]:
+        for number, record in records:
+            if "todo" in record:
+                # the users end where the todos begin
+                first_todo.append((number, record))
+                return
+            yield _decode(number, record, "user", User)
+
+    user_count = user_storage.import_users(users())
+    todos = (
+        _decode(number, record, "todo", Todo)
+        for number, record in chain(first_todo, records)
+    )
+    return user_count, todo_storage.import_todos(todos)
+
+
+def _decode(number: int, record: dict, kind: str, model: type):
+    try:
+        return model(**record[kind])
+    except (KeyError, TypeError):
+        raise ValueError(f"Line {number}: expected a {kind} record")
@@ -0,0 +1,87 @@
+# Deletions are remembered for this many versions of a user's todos; clients
+# that are further behind have to reload their list.
+CHANGE_HISTORY = 1000
+
+
+def can_answer(version: int, since: int) -> bool:
+    """Whether the changes after `since` are still known at `version`."""
+    return version - CHANGE_HISTORY <= since <= version
+
+
+class TodoVersions:
+    """Per-user version counters and the version each todo last changed at.
+
+    A storage bumps a user's version once per mutating call and records every
+    todo the call changed or deleted with the new version. A user's changes
+    are kept in version order, so `changes_since` only walks the ones a client
+    has not seen yet.
+    """
+
+    def __init__(self):
+        self._versions: dict[int, int] = {}
+        self._changed: dict[int, dict[int, int]] = {}
+        self._deleted: dict[int, dict[int, int]] = {}
+
+    def version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def versions(self) -> list[tuple[int, int]]:
+        return list(self._versions.items())
+
+    def tombstones(self) -> list[tuple[int, int, int]]:
+        """(version, user_id, todo_id) of each remembered deletion."""
+        return [
+            (version, user_id, todo_id)
+            for user_id, deleted in self._deleted.items()
+            for todo_id, version in deleted.items()
+        ]
+
+    def restore(self, user_id: int, version: int) -> None:
+        if version > self._versions.get(user_id, 0):
+            self._versions[user_id] = version
+
+    def changed(self, user_id: int, todo_id: int, version: int) -> None:
+        self.restore(user_id, version)
+        changed = self._changed.setdefault(user_id, {})
+        # re-inserting moves the todo to the end, keeping version order
+        changed.pop(todo_id, None)
+        changed[todo_id] = version
+        deleted = self._deleted.get(user_id)
+        if deleted:
+            deleted.pop(todo_id, None)
+
+    def deleted(self, user_id: int, todo_id: int, version: int) -> None:
+        self.restore(user_id, version)
+        changed = self._changed.get(user_id)
+        if changed:
+            changed.pop(todo_id, None)
+        deleted = self._deleted.setdefault(user_id, {})
+        deleted.pop(todo_id, None)
+        deleted[todo_id] = version
+        horizon = self._versions[user_id] - CHANGE_HISTORY
+        while deleted:
+            oldest = next(iter(deleted))
+            if deleted[oldest] > horizon:
+                break
+            del deleted[oldest]
+
+    def changes_since(
+        self, user_id: int, since: int
+    ) -> tuple[list[int], list[int]] | None:
+        """Ids of the todos changed and deleted after `since`, oldest first."""
+        if not can_answer(self.version(user_id), since):
+            return None
+        return (
+            self._newer(self._changed.get(user_id, {}), since),
+            self._newer(self._deleted.get(user_id, {}), since),
+        )
+
+    @staticmethod
+    def _newer(changes: dict[int, int], since: int) -> list[int]:
+        ids = []
+        for todo_id in reversed(changes):
+            if changes[todo_id] <= since:
+                break
+            ids.append(todo_id)
+        ids.reverse()
+        return ids
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """When a write-behind storage persists its buffered mutations.
+
+    Buffered mutations are flushed every `interval` seconds, and right away once
+    `max_pending` of them have accumulated.
+    """
+
+    interval: float = 1.0
+    max_pending: int = 1000
+
+
+class WriteBehind:
+    """Counts a storage's buffered mutations and triggers its flushes.
+
+    `flush` must persist everything buffered and reset `pending`; it is called
+    from a background thread every `policy.interval` seconds and inline from
+    `record` when the batch is full.
+    """
+
+    def __init__(self, flush: Callable[[], None], policy: FlushPolicy):
+        self.policy = policy
+        self.pending = 0
+        self._flush = flush
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind-flush", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.policy.interval):
+            try:
+                self._flush()
+            except OSError:
+                # keep the mutations buffered; the next flush retries and an
+                # explicit flush() reports the error to its caller
+                continue
+
+    def record(self, count: int = 1) -> None:
+        self.pending += count
+        if self.pending >= self.policy.max_pending:
+            self._flush()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+def write_atomically(path: str, data: bytes) -> None:
+    """Replace the file at `path` so that readers see either version whole."""
+    directory = os.path.dirname(os.path.abspath(path))
+    # a name of its own, so that concurrent writers do not share a file
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with open(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    # persist the rename itself
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
@@ -1,9 +1,99 @@
 import shlex
+import sys
+import time
+from typing import Iterable
 
 from app.manager import TaskManager, UserManager
 from app.models import Todo, User
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    TodoDeletion,
+    TodoOperation,
+    TodoToggle,
+    TodoUpdate,
+)
+from app.storages.transfer import encode, read_new_todos
 from app.ui.base import TodoInterface
 
+# commands that change todos, which a script applies in storage batches
+MUTATIONS = ("add", "update", "toggle", "delete")
+# the other commands a script may use
+BATCH_COMMANDS = (
+    "list",
+    "search",
+    "purge",
+    "export",
+    "import",
+    "user_info",
+    "update_user",
+)
+
+
+def render(task: Todo) -> str:
+    return (
+        f"[{task.id}] [{'x' if task.is_done else ' '}] {task.title}: {task.description}"
+    )
+
+
+def _options(command: str, args: list[str]) -> dict[str, str]:
+    if len(args) % 2 or not all(arg.startswith("--") for arg in args[::2]):
+        raise ValueError(f"'{command}' expects --option value pairs.")
+    return dict(zip(args[::2], args[1::2]))
+
+
+def _status(value: str | None) -> bool | None:
+    return None if value is None else value.lower() == "yes"
+
+
+def _todo_id(command: str, arg: str) -> int:
+    try:
+        return int(arg)
+    except ValueError:
+        raise ValueError(f"'{command}' command requires numeric IDs.")
+
+
+def parse_operations(
+    command: str, args: list[str], user_id: int
+) -> list[TodoOperation]:
+    """The operations of an add, update, toggle or delete command."""
+    if command == "add":
+        options = _options(command, args)
+        if "--title" not in options:
+            raise ValueError("'add' command requires a title.")
+        return [
+            NewTodo(
+                user_id=user_id,
+                title=options["--title"],
+                description=options.get("--description", ""),
+                is_done=_status(options.get("--status")) or False,
+            )
+        ]
+    if len(args) < 1:
+        raise ValueError(f"'{command}' command requires an ID.")
+    if command == "delete":
+        return [TodoDeletion(_todo_id(command, arg)) for arg in args]
+    todo_id = _todo_id(command, args[0])
+    if command == "update":
+        options = _options(command, args[1:])
+        return [
+            TodoUpdate(
+                todo_id,
+                title=options.get("--title"),
+                description=options.get("--description"),
+                is_done=_status(options.get("--status")),
+            )
+        ]
+    return [TodoToggle(todo_id)]
+
+
+def describe(operation: TodoOperation, result: Todo | None) -> str:
+    if isinstance(operation, NewTodo):
+        return "Added Todo: " + render(result)
+    if isinstance(operation, TodoDeletion):
+        return f"Todo with ID {operation.todo_id} deleted."
+    return render(result)
+
 
 class TodoCLIUI(TodoInterface):
     def __init__(self, user_manager: UserManager, task_manager: TaskManager):
@@ -21,13 +111,169 @@ class TodoCLIUI(TodoInterface):
     def get_user(self) -> User:
         return self.user_manager.get_user_by_token(self.token)
 
-    def run(self):
-        def render(task: Todo) -> str:
-            return (
-                f"[{task.id}] [{'x' if task.is_done else ' '}] "
-                f"{task.title}: {task.description}"
+    def execute(self, command: str, args: list[str]) -> None:
+        """Run a command other than the account ones, raising ValueError."""
+        if command in MUTATIONS:
+            user_id = self.get_user().id
+            operations = parse_operations(command, args, user_id)
+            for operation, result in zip(operations, self.apply(user_id, operations)):
+                print(describe(operation, result))
+
+        elif command == "purge":
+            count = self.task_manager.purge_completed(self.get_user().id)
+            print(f"Deleted {count} done Todo(s).")
+
+        elif command == "list":
+            tasks = self.task_manager.get_tasks_by_user_id(self.get_user().id)
+            print("\nTodo List:")
+            for task in tasks:
+                print(render(task))
+
+        elif command == "search":
+            if len(args) < 1:
+                raise ValueError("'search' command requires a query.")
+            tasks = self.task_manager.search(self.get_user().id, " ".join(args))
+            print(f"\nFound {len(tasks)} Todo(s):")
+            for task in tasks:
+                print(render(task))
+
+        elif command == "export":
+            if len(args) < 1:
+                raise ValueError("'export' command requires a file.")
+            count = 0
+            with open(args[0], "wb") as file:
+                for task in self.task_manager.export_tasks(self.get_user().id):
+                    file.write(encode(task))
+                    count += 1
+            print(f"Exported {count} Todo(s) to {args[0]}.")
+
+        elif command == "import":
+            if len(args) < 1:
+                raise ValueError("'import' command requires a file.")
+            user_id = self.get_user().id
+            try:
+                with open(args[0], "rb") as file:
+                    count = self.task_manager.import_tasks(
+                        user_id, read_new_todos(file, user_id)
+                    )
+            except OSError as e:
+                raise ValueError(str(e))
+            print(f"Imported {count} Todo(s) from {args[0]}.")
+
+        elif command == "user_info":
+            user = self.get_user()
+            print(f"User Information:\nUsername: {user.username}\nEmail: {user.email}")
+
+        elif command == "update_user":
+            options = _options(command, args)
+            new_username = options.get("--username")
+            new_email = options.get("--email")
+            if new_username is None and new_email is None:
+                raise ValueError(
+                    "'update_user' command requires at least a new username or email."
+                )
+            updated_user = self.user_manager.update_user(
+                self.get_user().id, new_username, new_email
             )
+            print(f"User updated successfully: {updated_user.username}")
+
+        else:
+            raise ValueError(f"Unknown command '{command}'.")
+
+    def apply(self, user_id: int, operations: list[TodoOperation]) -> list[Todo | None]:
+        """Apply the operations as one batch, naming the todo one is missing."""
+        try:
+            return self.task_manager.apply_batch(user_id, operations)
+        except ValueError:
+            if len(operations) == 1 and not isinstance(operations[0], NewTodo):
+                raise ValueError(f"Todo with ID {operations[0].todo_id} not found.")
+            raise
+
+    def run_batch(self, lines: Iterable[str]) -> int:
+        """Run a script of commands, one per line, and return how many failed.
+
+        Consecutive add, update, toggle and delete commands are applied
+        `TRANSFER_CHUNK` at a time, each chunk as one storage batch. When a
+        batch is rejected its commands are retried one by one, so that only
+        the failing ones are skipped. Blank lines and lines starting with `#`
+        are ignored; `exit` ends the script. A summary with timings is
+        printed to stderr.
+        """
+        user_id = self.get_user().id
+        timings: dict[str, list] = {}
+        pending: list[tuple[int, TodoOperation]] = []
+        failed = 0
+        batches = 0
+        started = time.perf_counter()
+
+        def timed(name: str, began: float, count: int = 1) -> None:
+            timing = timings.setdefault(name, [0, 0.0])
+            timing[0] += count
+            timing[1] += time.perf_counter() - began
+
+        def flush() -> None:
+            nonlocal failed, batches
+            if not pending:
+                return
+            began = time.perf_counter()
+            operations = [operation for _, operation in pending]
+            try:
+                results = self.task_manager.apply_batch(user_id, operations)
+                applied = list(zip(operations, results))
+                batches += 1
+            except ValueError:
+                applied = []
+                for number, operation in pending:
+                    try:
+                        (result,) = self.apply(user_id, [operation])
+                        applied.append((operation, result))
+                        batches += 1
+                    except ValueError as e:
+                        print(f"Line {number}: Error: {e}", file=sys.stderr)
+                        failed += 1
+            for operation, result in applied:
+                print(describe(operation, result))
+            timed("mutations", began, len(applied))
+            pending.clear()
+
+        for number, line in enumerate(lines, 1):
+            try:
+                command, *args = shlex.split(line, comments=True) or [None]
+                if command is None:
+                    continue
+                if command == "exit":
+                    break
+                if command in MUTATIONS:
+                    pending.extend(
+                        (number, operation)
+                        for operation in parse_operations(command, args, user_id)
+                    )
+                    if len(pending) >= TRANSFER_CHUNK:
+                        flush()
+                    continue
+                flush()
+                began = time.perf_counter()
+                if command not in BATCH_COMMANDS:
+                    raise ValueError(f"'{command}' cannot be used in a script.")
+                self.execute(command, args)
+                timed(command, began)
+            except ValueError as e:
+                print(f"Line {number}: Error: {e}", file=sys.stderr)
+                failed += 1
+        flush()
+
+        elapsed = time.perf_counter() - started
+        commands = sum(count for count, _ in timings.values()) + failed
+        print(
+            f"Ran {commands} command(s) in {elapsed:.3f}s, "
+            f"{batches} storage batch(es), {failed} failed",
+            file=sys.stderr,
+        )
+        for name, (count, seconds) in sorted(timings.items()):
+            print(f"  {name:<12} {count:>8}  {seconds:.3f}s", file=sys.stderr)
+        return failed
 
+    def run(self):
         def print_help():
             print("\nCommands:")
             print(
@@ -37,6 +283,7 @@ class TodoCLIUI(TodoInterface):
                 )
             )
             print("list - List all Todos")
+            print("search <words> - Find Todos by words or their beginnings")
             print(
                 (
                     "update <id> [--title <new_title>] "
@@ -45,7 +292,10 @@ class TodoCLIUI(TodoInterface):
                 )
             )
             print("toggle <id> - Toggle the done status of a Todo")
-            print("delete <id> - Delete a Todo")
+            print("delete <id> [<id> ...] - Delete Todos")
+            print("purge - Delete all done Todos")
+            print("export <file> - Write all Todos to a file as NDJSON")
+            print("import <file> - Add the Todos of an NDJSON file")
             print("user_info - Display the current logged-in user information")
             print(
                 (
@@ -90,125 +340,12 @@ class TodoCLIUI(TodoInterface):
         while True:
             command_input = input("\nEnter a command: ").strip()
             command_parts = shlex.split(command_input)
+            if not command_parts:
+                continue
             command = command_parts[0]
             args = command_parts[1:]
 
-            if command == "add":
-                title = None
-                description = ""
-                is_done = False
-                for i in range(0, len(args), 2):
-                    if args[i] == "--title":
-                        title = args[i + 1]
-                    elif args[i] == "--description":
-                        description = args[i + 1]
-                    elif args[i] == "--status":
-                        is_done = args[i + 1].lower() == "yes"
-                if title is None:
-                    print("Error: 'add' command requires a title.")
-                    continue
-                new_todo = self.task_manager.create_task(
-                    self.get_user().id, title, description, is_done
-                )
-                print("Added Todo: " + render(new_todo))
-
-            elif command == "list":
-                tasks = self.task_manager.get_tasks_by_user_id(self.get_user().id)
-                print("\nTodo List:")
-                for task in tasks:
-                    print(render(task))
-
-            elif command == "update":
-                if len(args) < 1:
-                    print("Error: 'update' command requires at least an ID.")
-                    continue
-                task_id = int(args[0])
-                new_title = None
-                new_description = None
-                new_status = None
-                for i in range(1, len(args), 2):
-                    if args[i] == "--title":
-                        new_title = args[i + 1]
-                    elif args[i] == "--description":
-                        new_description = args[i + 1]
-                    elif args[i] == "--status":
-                        new_status = args[i + 1].lower() == "yes"
-                updated_todo = self.task_manager.update_task(
-                    self.get_user().id, task_id, new_title, new_description
-                )
-                if new_status is not None:
-                    self.task_manager.set_task_status(
-                        self.get_user().id, task_id, new_status
-                    )
-                    updated_todo = self.task_manager.update_task(
-                        self.get_user().id, task_id
-                    )
-                print(render(updated_todo))
-
-            elif command == "toggle":
-                if len(args) < 1:
-                    print("Error: 'toggle' command requires an ID.")
-                    continue
-                task_id = int(args[0])
-                try:
-                    task = self.task_manager.get_task_by_id(self.get_user().id, task_id)
-                except ValueError:
-                    print(f"Todo with ID {task_id} not found.")
-                    continue
-                task = self.task_manager.set_task_status(
-                    self.get_user().id, task_id, not task.is_done
-                )
-                print(render(task))
-
-            elif command == "delete":
-                if len(args) < 1:
-                    print("Error: 'delete' command requires an ID.")
-                    continue
-                task_id = int(args[0])
-                tasks = self.task_manager.get_all_tasks()
-                if any(task.id == task_id for task in tasks):
-                    self.task_manager.delete_task(self.get_user().id, task_id)
-                    print(f"Todo with ID {task_id} deleted.")
-                else:
-                    print(f"Todo with ID {task_id} not found.")
-
-            elif command == "user_info":
-                try:
-                    user = self.get_user()
-                    print(
-                        (
-                            f"User Information:\nUsername: {user.username}\nEmail: "
-                            f"{user.email}"
-                        )
-                    )
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "update_user":
-                new_username = None
-                new_email = None
-                for i in range(0, len(args), 2):
-                    if args[i] == "--username":
-                        new_username = args[i + 1]
-                    elif args[i] == "--email":
-                        new_email = args[i + 1]
-                if new_username is None and new_email is None:
-                    print(
-                        (
-                            "Error: 'update_user' command requires at least a new "
-                            "username or email."
-                        )
-                    )
-                    continue
-                try:
-                    updated_user = self.user_manager.update_user(
-                        self.get_user().id, new_username, new_email
-                    )
-                    print(f"User updated successfully: {updated_user.username}")
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "delete_user":
+            if command == "delete_user":
                 confirmation = (
                     input("Are you sure you want to delete your account? (yes/no): ")
                     .strip()
@@ -231,5 +368,11 @@ class TodoCLIUI(TodoInterface):
                 print("Exiting... Goodbye!")
                 break
 
+            elif command in MUTATIONS or command in BATCH_COMMANDS:
+                try:
+                    self.execute(command, args)
+                except ValueError as e:
+                    print(f"Error: {e}")
+
             else:
                 print("Invalid command. Please try again.")
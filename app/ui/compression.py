@@ -0,0 +1,86 @@
+# Content-Encoding negotiation, and compression of response bodies that are
+# large enough to be worth it.
+
+import asyncio
+import gzip
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip without it
+    brotli = None
+
+# smaller bodies fit in a few TCP segments either way, so compressing them
+# costs CPU without saving a round trip
+MIN_COMPRESS_BYTES = 1024
+# above this, bodies are compressed at the fastest level, off the event loop:
+# the ratio barely improves with the level, the compression time does not
+FAST_COMPRESS_BYTES = 256 * 1024
+
+# preferred first, when the client weighs them equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def accepted_encodings(accept_encoding: str | None) -> dict[str, float]:
+    """The content codings of an Accept-Encoding header, with their weights."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = item.strip().split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            accepted[coding.lower()] = weight
+    return accepted
+
+
+def negotiate(accept_encoding: str | None, available=ENCODINGS) -> str | None:
+    """The best of the `available` encodings the client accepts, if any."""
+    accepted = accepted_encodings(accept_encoding)
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = accepted.get(encoding, accepted.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str, fast: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=1 if fast else 5)
+    if encoding == "gzip":
+        # mtime=0 keeps the output, and so its ETag, stable
+        return gzip.compress(body, compresslevel=1 if fast else 6, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+async def compress_response(
+    response: Response, accept_encoding: str | None
+) -> Response:
+    """Compress the body of a rendered `response` in place, if the client
+    accepts an encoding and the body is at least `MIN_COMPRESS_BYTES`."""
+    headers = response.headers
+    headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Accept-Encoding"]))
+    body = response.body
+    encoding = negotiate(accept_encoding)
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return response
+    if len(body) >= FAST_COMPRESS_BYTES:
+        # zlib and brotli release the GIL while they work
+        body = await asyncio.to_thread(compress, body, encoding, True)
+    else:
+        body = compress(body, encoding)
+    response.body = body
+    headers["Content-Length"] = str(len(body))
+    headers["Content-Encoding"] = encoding
+    etag = headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        # the compressed bytes differ from the ones a strong tag names
+        headers["ETag"] = f"W/{etag}"
+    return response
@@ -0,0 +1,110 @@
+# Server-rendered pages of the web UI, from the Jinja templates next to this
+# module.
+
+import pathlib
+from typing import AsyncIterable, AsyncIterator
+
+from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup
+
+from app.cache import LRUCache
+from app.models import Todo, User
+
+TEMPLATES_DIR = pathlib.Path(__file__).resolve().parent / "templates"
+# rendered HTML gathered into each body chunk after the first
+PAGE_CHUNK_BYTES = 16 * 1024
+
+
+class TodoListPage:
+    """Renders `index.html`, a user's todo list, as a stream of chunks.
+
+    The template is compiled once, when the page is created. The head of the
+    page is sent as soon as it is rendered, before any todo is read, and the
+    list follows `PAGE_CHUNK_BYTES` at a time while the todos are read.
+
+    Rendered todos are cached by value, so only the todos a mutation changed
+    are rendered again. Whole pages of up to `max_cached_todos` todos are
+    cached per user along with the user's todo version, which every mutation
+    bumps, in this process or any other.
+    """
+
+    def __init__(
+        self,
+        item_cache_size: int = 50_000,
+        page_cache_size: int = 1024,
+        max_cached_todos: int = 1000,
+    ):
+        self.environment = Environment(
+            loader=FileSystemLoader(TEMPLATES_DIR),
+            autoescape=True,
+            enable_async=True,
+            # the templates ship with the code, so they are never reloaded
+            auto_reload=False,
+            trim_blocks=True,
+        )
+        self.template = self.environment.get_template("index.html")
+        self.max_cached_todos = max_cached_todos
+        self.items: LRUCache[Todo, Markup] = LRUCache(item_cache_size)
+        # user id -> (todo version, username, chunks)
+        self.pages: LRUCache[int, tuple[int, str, list[bytes]]] = LRUCache(
+            page_cache_size
+        )
+        self._macros = None
+
+    def cached(self, user: User, version: int) -> list[bytes] | None:
+        """The chunks of the user's page at `version`, if they are cached."""
+        entry = self.pages.get(user.id)
+        if entry is None or entry[:2] != (version, user.username):
+            return None
+        return entry[2]
+
+    async def _render_item(self, todo: Todo) -> Markup:
+        item = self.items.get(todo)
+        if item is None:
+            if self._macros is None:
+                self._macros = await self.template.make_module_async()
+            item = Markup(await self._macros.todo_item(todo))
+            self.items.set(todo, item)
+        return item
+
+    async def render(
+        self,
+        user: User | None,
+        version: int | None = None,
+        todos: AsyncIterable[Todo] | None = None,
+        error: str | None = None,
+    ) -> AsyncIterator[bytes]:
+        """Chunks of the page of `user` and their `todos` at `version`, or of
+        the login form without a user."""
+        counted = _Counted(todos) if todos is not None else None
+        chunks = []
+        pending: list[str] = []
+        size = 0
+        async for text in self.template.generate_async(
+            user=user, todos=counted, error=error, render_item=self._render_item
+        ):
+            pending.append(text)
+            size += len(text)
+            if size >= PAGE_CHUNK_BYTES or not chunks:
+                chunks.append("".join(pending).encode())
+                yield chunks[-1]
+                pending = []
+                size = 0
+        if pending:
+            chunks.append("".join(pending).encode())
+            yield chunks[-1]
+        if counted is not None and counted.count <= self.max_cached_todos:
+            self.pages.set(user.id, (version, user.username, chunks))
+
+
+class _Counted:
+    """Passes the todos through, counting them."""
+
+    def __init__(self, todos: AsyncIterable[Todo]):
+        self.todos = todos
+        self.count = 0
+
+    async def __aiter__(self) -> AsyncIterator[Todo]:
+        async for todo in self.todos:
+            self.count += 1
+            yield todo
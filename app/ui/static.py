@@ -0,0 +1,151 @@
+# Serving of the exported Next.js bundle, with the gzip and brotli variants
+# written next to its files at build time.
+
+import argparse
+import gzip
+import os
+import pathlib
+import stat
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.ui.compression import MIN_COMPRESS_BYTES, brotli, negotiate
+
+# file suffix of each precompressed variant, preferred first
+VARIANTS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_SUFFIXES = {
+    ".css",
+    ".html",
+    ".js",
+    ".json",
+    ".map",
+    ".mjs",
+    ".svg",
+    ".txt",
+    ".xml",
+}
+# Next.js puts a content hash in the name of everything under _next/static, so
+# a changed file is a new URL and the old one can be cached for good
+HASHED_PREFIX = "_next/static/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves `<file>.br` or `<file>.gz` in place of a file,
+    when one exists and the client accepts its encoding.
+
+    Hashed assets are cached by clients for a year without revalidation; the
+    rest, such as the HTML that names them, are revalidated on every use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # file path -> (its mtime and size, {encoding: (variant path, stat)})
+        self._variants: dict[
+            str, tuple[tuple[float, int], dict[str, tuple[str, os.stat_result]]]
+        ] = {}
+
+    def variants(
+        self, full_path: str, stat_result: os.stat_result
+    ) -> dict[str, tuple[str, os.stat_result]]:
+        """The precompressed variants of a file that are no older than it."""
+        key = (stat_result.st_mtime, stat_result.st_size)
+        cached = self._variants.get(full_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        variants = {}
+        for encoding, suffix in VARIANTS.items():
+            try:
+                variant_stat = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            if variant_stat.st_mtime >= stat_result.st_mtime:
+                variants[encoding] = (full_path + suffix, variant_stat)
+        self._variants[full_path] = (key, variants)
+        return variants
+
+    def file_response(
+        self,
+        full_path: os.PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        relative = os.path.relpath(full_path, os.path.realpath(self.directory)).replace(
+            os.sep, "/"
+        )
+        headers = {
+            "Cache-Control": IMMUTABLE
+            if relative.startswith(HASHED_PREFIX)
+            else REVALIDATE
+        }
+        variants = self.variants(full_path, stat_result)
+        encoding = negotiate(request_headers.get("accept-encoding"), list(variants))
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+        media_type = guess_type(full_path)[0] or "text/plain"
+        if encoding is not None:
+            # the variant's own mtime and size give it an ETag of its own
+            full_path, stat_result = variants[encoding]
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress(directory: str | os.PathLike) -> dict[str, int]:
+    """Write the gzip (and, if available, brotli) variant of every compressible
+    file under `directory` whose variant is missing or out of date. Variants
+    that come out no smaller than the file are not kept."""
+    encoders = {"gzip": lambda data: gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        encoders["br"] = lambda data: brotli.compress(data, quality=11)
+    written = dict.fromkeys(encoders, 0)
+    for path in pathlib.Path(directory).rglob("*"):
+        if path.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        stat_result = path.stat()
+        if not stat.S_ISREG(stat_result.st_mode):
+            continue
+        if stat_result.st_size < MIN_COMPRESS_BYTES:
+            continue
+        data = None
+        for encoding, encode in encoders.items():
+            variant = path.with_name(path.name + VARIANTS[encoding])
+            if variant.exists() and variant.stat().st_mtime >= stat_result.st_mtime:
+                continue
+            if data is None:
+                data = path.read_bytes()
+            compressed = encode(data)
+            if len(compressed) < len(data):
+                variant.write_bytes(compressed)
+                written[encoding] += 1
+            else:
+                variant.unlink(missing_ok=True)
+    return written
+
+
+if __name__ == "__main__":
+    from app.ui.web_ui import FRONTEND_DIR
+
+    parser = argparse.ArgumentParser(
+        description="Precompress the exported frontend for serving"
+    )
+    parser.add_argument("directory", nargs="?", default=FRONTEND_DIR)
+    args = parser.parse_args()
+    for encoding, count in precompress(args.directory).items():
+        print(f"{encoding}: {count} files written")
@@ -1,12 +1,67 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+import pathlib
+import time
+import zlib
+from typing import Annotated, AsyncIterator, Literal
+
+import orjson
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, status
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.manager import TaskManager, UserManager
+from app.events import ChangeFeed, PolledFeed, TodoEvent
+from app.manager import AsyncTaskManager, AsyncUserManager, TaskManager, UserManager
+from app.metrics import (
+    HTTP_REQUESTS,
+    REGISTRY,
+    collect_stages,
+    instrument_manager,
+    instrument_storage,
+    server_timing,
+)
 from app.models import User
+from app.password_executor import PasswordExecutorBusy, PasswordHashingExecutor
+from app.profiling import SamplingProfiler
+from app.storages.base import (
+    TRANSFER_CHUNK,
+    NewTodo,
+    TodoDeletion,
+    TodoOperation,
+    TodoToggle,
+    TodoUpdate,
+)
+from app.storages.transfer import (
+    NDJSON_MEDIA_TYPE,
+    aread_lines,
+    aread_new_todos,
+    encode,
+)
+from app.ui.compression import compress_response
+from app.ui.pages import TodoListPage
+from app.ui.static import PrecompressedStaticFiles
+
+# the API also accepts the session cookie of the server-rendered page
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+SESSION_COOKIE = "todo_session"
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+FRONTEND_DIR = pathlib.Path(__file__).resolve().parents[1] / "frontend" / "out"
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+HOST = "0.0.0.0"
+PORT = 8000
+# seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = 15.0
+# seconds between checks for changes on a stream fed by polling the storage
+EVENT_POLL_INTERVAL = 1.0
 
 
 class TodoModel(BaseModel):
@@ -21,36 +76,342 @@ class TodoUpdateModel(BaseModel):
     is_done: bool | None = None
 
 
+class CreateOperationModel(BaseModel):
+    op: Literal["create"]
+    title: str
+    description: str = ""
+    is_done: bool = False
+
+
+class UpdateOperationModel(BaseModel):
+    op: Literal["update"]
+    id: int
+    title: str | None = None
+    description: str | None = None
+    is_done: bool | None = None
+
+
+class ToggleOperationModel(BaseModel):
+    op: Literal["toggle"]
+    id: int
+
+
+class DeleteOperationModel(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+
+class TodoBatchModel(BaseModel):
+    operations: list[
+        Annotated[
+            CreateOperationModel
+            | UpdateOperationModel
+            | ToggleOperationModel
+            | DeleteOperationModel,
+            Field(discriminator="op"),
+        ]
+    ] = Field(max_length=1000)
+
+    def to_operations(self, user_id: int) -> list[TodoOperation]:
+        operations = []
+        for item in self.operations:
+            if isinstance(item, CreateOperationModel):
+                operations.append(
+                    NewTodo(user_id, item.title, item.description, item.is_done)
+                )
+            elif isinstance(item, UpdateOperationModel):
+                operations.append(
+                    TodoUpdate(item.id, item.title, item.description, item.is_done)
+                )
+            elif isinstance(item, ToggleOperationModel):
+                operations.append(TodoToggle(item.id))
+            else:
+                operations.append(TodoDeletion(item.id))
+        return operations
+
+
 class UserModel(BaseModel):
     username: str
     email: str
     password: str
 
 
+class InstrumentationMiddleware:
+    """Times every HTTP request and reports where the time went.
+
+    The time until the response headers are sent is observed per route, and
+    the stages timed meanwhile (manager and storage calls, JWT decoding,
+    bcrypt, SQL) are summed into a Server-Timing header. With a `profiler`,
+    the requests it wants are also sampled into a profile of their own.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: SamplingProfiler | None = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        profile = None
+        if self.profiler is not None and self.profiler.wants(scope["path"]):
+            profile = self.profiler.start(f"{scope['method']} {scope['path']}")
+
+        async def send_timed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                # the router has matched by now; label by its path template to
+                # keep one series per route rather than per todo id
+                route = scope.get("route")
+                HTTP_REQUESTS.observe(
+                    elapsed,
+                    scope["method"],
+                    route.path if route is not None else "unmatched",
+                    str(message["status"]),
+                )
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(stages, elapsed))
+            await send(message)
+
+        with collect_stages() as stages:
+            try:
+                await self.app(scope, receive, send_timed)
+            finally:
+                if profile is not None:
+                    profile.finish()
+
+
 class TodoWebUI:
-    def __init__(self, user_manager: UserManager, task_manager: TaskManager):
-        self.user_manager = user_manager
-        self.task_manager = task_manager
-        self.app = FastAPI()
+    """FastAPI front end that awaits the managers end to end.
+
+    Synchronous managers are accepted as well; their storages are then called
+    from worker threads. With `shared`, other processes serve the same storage,
+    so event streams follow the storage's versions rather than this process's
+    change feed.
+    """
+
+    def __init__(
+        self,
+        user_manager: AsyncUserManager | UserManager,
+        task_manager: AsyncTaskManager | TaskManager,
+        password_executor: PasswordHashingExecutor | None = None,
+        profiler: SamplingProfiler | None = None,
+        shared: bool = False,
+    ):
+        if isinstance(user_manager, UserManager):
+            user_manager = AsyncUserManager.from_sync(user_manager)
+        if isinstance(task_manager, TaskManager):
+            task_manager = AsyncTaskManager.from_sync(task_manager)
+        if password_executor is not None:
+            user_manager.password_executor = password_executor
+        elif user_manager.password_executor is None:
+            user_manager.password_executor = PasswordHashingExecutor()
+        if task_manager.feed is None:
+            task_manager.feed = ChangeFeed()
+        user_manager.storage = instrument_storage(user_manager.storage)
+        task_manager.storage = instrument_storage(task_manager.storage)
+        self.user_manager = instrument_manager(user_manager)
+        self.task_manager = instrument_manager(task_manager)
+        self.feed = task_manager.feed
+        self.shared = shared
+        self.polled_feed = (
+            PolledFeed(self.task_manager.storage, EVENT_POLL_INTERVAL)
+            if shared
+            else None
+        )
+        self.password_executor = user_manager.password_executor
+        self.page = TodoListPage()
+        self.app = FastAPI(default_response_class=ORJSONResponse)
+        self.app.add_middleware(InstrumentationMiddleware, profiler=profiler)
+        self.app.add_event_handler("shutdown", self.shutdown)
+        self.app.add_exception_handler(
+            PasswordExecutorBusy, self._password_executor_busy
+        )
         self._setup_routes()
 
-    def _get_current_user(self, token: str = Depends(oauth2_scheme)) -> User:
+    async def shutdown(self) -> None:
+        self.password_executor.shutdown()
+        await self.user_manager.storage.flush()
+        await self.task_manager.storage.flush()
+        await self.user_manager.storage.close()
+        await self.task_manager.storage.close()
+
+    async def _get_current_user(
+        self, request: Request, token: str | None = Depends(oauth2_scheme)
+    ) -> User:
+        token = token or request.cookies.get(SESSION_COOKIE)
+        if token is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         try:
-            return self.user_manager.get_user_by_token(token)
+            return await self.user_manager.get_user_by_token(token)
         except ValueError as e:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
-    def _setup_routes(self):
-        self.app.mount(
-            "/static",
-            StaticFiles(directory="app/frontend/out", html=True),
-            name="static",
+    async def _get_session_user(self, request: Request) -> User | None:
+        token = request.cookies.get(SESSION_COOKIE)
+        if token is None:
+            return None
+        try:
+            return await self.user_manager.get_user_by_token(token)
+        except ValueError:
+            return None
+
+    @staticmethod
+    async def _password_executor_busy(
+        request: Request, exc: PasswordExecutorBusy
+    ) -> JSONResponse:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": str(exc)},
+            headers={"Retry-After": "1"},
+        )
+
+    @staticmethod
+    def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+        if if_none_match is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+
+    @staticmethod
+    def _encode_event(event: TodoEvent) -> bytes:
+        data = orjson.dumps(
+            {
+                "seq": event.seq,
+                "type": event.type,
+                "id": event.todo_id,
+                "todo": event.todo,
+            }
+        )
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+            event.seq,
+            event.type.encode(),
+            data,
         )
 
+    async def _export_lines(self, user_id: int) -> AsyncIterator[bytes]:
+        lines = []
+        async for todo in self.task_manager.export_tasks(user_id):
+            lines.append(encode(todo))
+            if len(lines) == TRANSFER_CHUNK:
+                # one body chunk per storage chunk rather than per todo
+                yield b"".join(lines)
+                lines = []
+        if lines:
+            yield b"".join(lines)
+
+    async def _latest_seq(self, user_id: int) -> int:
+        if self.shared:
+            return await self.task_manager.get_version(user_id)
+        return self.feed.latest_seq(user_id)
+
+    async def _stream_events(self, user_id: int, since: int) -> AsyncIterator[bytes]:
+        feed = self.polled_feed if self.shared else self.feed
+        subscription = feed.subscribe(user_id, since)
+        try:
+            while True:
+                events = await subscription.next(EVENT_STREAM_HEARTBEAT)
+                if events is None:
+                    # events were missed: the client reloads its list and
+                    # follows on from the current sequence number
+                    yield b"id: %d\nevent: reset\ndata: %s\n\n" % (
+                        subscription.seq,
+                        orjson.dumps({"seq": subscription.seq}),
+                    )
+                elif not events:
+                    yield b": keep-alive\n\n"
+                else:
+                    yield b"".join(self._encode_event(event) for event in events)
+        finally:
+            subscription.close()
+
+    def _setup_routes(self):
+        # the exported Next.js bundle is only present after `npm run build`;
+        # `python -m app.ui.static` then writes its precompressed variants
+        if FRONTEND_DIR.is_dir():
+            self.app.mount(
+                "/static",
+                PrecompressedStaticFiles(directory=FRONTEND_DIR, html=True),
+                name="static",
+            )
+
+        @self.app.get("/")
+        async def todo_page(
+            request: Request, if_none_match: str | None = Header(default=None)
+        ):
+            """The user's todo list rendered as HTML, or a login form."""
+            user = await self._get_session_user(request)
+            if user is None:
+                return StreamingResponse(
+                    self.page.render(None), media_type=HTML_MEDIA_TYPE
+                )
+            version = await self.task_manager.get_version(user.id)
+            # the page shows the username too, which has no version
+            tag = zlib.crc32(user.username.encode())
+            headers = {
+                "ETag": f'"page-{user.id}-{version}-{tag:x}"',
+                "Cache-Control": "private, no-cache",
+                "Vary": "Cookie",
+            }
+            if self._etag_matches(if_none_match, headers["ETag"]):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+                )
+            chunks = self.page.cached(user, version)
+            if chunks is not None:
+                return Response(
+                    b"".join(chunks), media_type=HTML_MEDIA_TYPE, headers=headers
+                )
+            return StreamingResponse(
+                self.page.render(
+                    user, version, self.task_manager.export_tasks(user.id)
+                ),
+                media_type=HTML_MEDIA_TYPE,
+                headers=headers,
+            )
+
+        @self.app.post("/login")
+        async def login_page(
+            request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+        ):
+            """Sign in from the page's form and go back to the list."""
+            try:
+                token = await self.user_manager.login(
+                    form_data.username, form_data.password
+                )
+            except ValueError:
+                return StreamingResponse(
+                    self.page.render(None, error="Invalid username or password"),
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    media_type=HTML_MEDIA_TYPE,
+                )
+            response = RedirectResponse("/", status_code=status.HTTP_303_SEE_OTHER)
+            response.set_cookie(
+                SESSION_COOKIE,
+                token,
+                httponly=True,
+                samesite="strict",
+                secure=request.url.scheme == "https",
+            )
+            return response
+
+        @self.app.post("/logout")
+        async def logout_page():
+            response = RedirectResponse("/", status_code=status.HTTP_303_SEE_OTHER)
+            response.delete_cookie(SESSION_COOKIE)
+            return response
+
         @self.app.post("/token")
         async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             try:
-                token = self.user_manager.login(form_data.username, form_data.password)
+                token = await self.user_manager.login(
+                    form_data.username, form_data.password
+                )
                 return {"access_token": token, "token_type": "bearer"}
             except ValueError:
                 raise HTTPException(
@@ -58,13 +419,36 @@ class TodoWebUI:
                     detail="Invalid username or password",
                 )
 
+        @self.app.get("/metrics")
+        async def metrics():
+            return PlainTextResponse(
+                REGISTRY.render(), media_type="text/plain; version=0.0.4"
+            )
+
+        @self.app.get("/metrics/password-hashing")
+        async def password_hashing_metrics():
+            return self.password_executor.stats()
+
+        @self.app.get("/metrics/cache")
+        async def cache_metrics():
+            # hit and miss counters of storages behind `--cache`
+            stats = {}
+            for name, manager in (
+                ("users", self.user_manager),
+                ("todos", self.task_manager),
+            ):
+                storage_stats = getattr(manager.storage, "stats", None)
+                if storage_stats is not None:
+                    stats[name] = storage_stats()
+            return stats
+
         @self.app.post("/user", status_code=201)
         async def add_user(user: UserModel):
             try:
-                new_user = self.user_manager.create_user(
+                new_user = await self.user_manager.create_user(
                     user.username, user.email, user.password
                 )
-                token = self.user_manager.login(user.username, user.password)
+                token = await self.user_manager.login(user.username, user.password)
                 return {
                     "message": "User created successfully",
                     "username": new_user.username,
@@ -82,13 +466,12 @@ class TodoWebUI:
             current_user: User = Depends(self._get_current_user),
         ):
             try:
-                updated_user = self.user_manager.update_user(
+                updated_user = await self.user_manager.update_user(
                     current_user.id, user.username, user.email, user.password
                 )
-                return {
-                    "message": "User updated successfully",
-                    "user": updated_user.__dict__,
-                }
+                return ORJSONResponse(
+                    {"message": "User updated successfully", "user": updated_user}
+                )
             except ValueError as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
@@ -97,53 +480,225 @@ class TodoWebUI:
         @self.app.delete("/user", status_code=204)
         async def delete_user(current_user: User = Depends(self._get_current_user)):
             try:
-                self.user_manager.delete_user(current_user.id)
+                await self.user_manager.delete_user(current_user.id)
             except ValueError as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
                 )
 
         @self.app.get("/todos")
-        def list_todos(user: User = Depends(self._get_current_user)):
-            todos = self.task_manager.get_tasks_by_user_id(user.id)
-            return [todo.__dict__ for todo in todos]
+        async def list_todos(
+            after_id: int | None = None,
+            limit: int | None = Query(default=None, ge=1, le=1000),
+            is_done: bool | None = None,
+            order: Literal["asc", "desc"] = "asc",
+            if_none_match: str | None = Header(default=None),
+            accept_encoding: str | None = Header(default=None),
+            user: User = Depends(self._get_current_user),
+        ):
+            # read before the rows, so that replaying the feed from here can
+            # only repeat changes the list already contains
+            seq = await self._latest_seq(user.id)
+            # likewise the version: a change racing with the read only makes
+            # the next request miss the ETag
+            version = await self.task_manager.get_version(user.id)
+            headers = {
+                "ETag": f'"{user.id}-{version}"',
+                "Cache-Control": "private, no-cache",
+                "Vary": "Authorization",
+                "X-Change-Seq": str(seq),
+                "X-Todos-Version": str(version),
+            }
+            if self._etag_matches(if_none_match, headers["ETag"]):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+                )
+            todos = await self.task_manager.get_tasks_page(
+                user.id,
+                after_id=after_id,
+                limit=limit,
+                is_done=is_done,
+                descending=order == "desc",
+            )
+            if limit is not None and len(todos) == limit:
+                # pass this back as `after_id` to fetch the following page
+                headers["X-Next-After-Id"] = str(todos[-1].id)
+            # orjson encodes the Todo dataclasses straight to bytes, skipping
+            # FastAPI's jsonable_encoder pass over every todo
+            return await compress_response(
+                ORJSONResponse(todos, headers=headers), accept_encoding
+            )
+
+        @self.app.get("/todos/search")
+        async def search_todos(
+            q: str = Query(min_length=1, max_length=200),
+            limit: int = Query(default=20, ge=1, le=100),
+            accept_encoding: str | None = Header(default=None),
+            user: User = Depends(self._get_current_user),
+        ):
+            """The user's todos containing every word of `q` as a prefix,
+            best match first."""
+            todos = await self.task_manager.search(user.id, q, limit)
+            return await compress_response(ORJSONResponse(todos), accept_encoding)
+
+        @self.app.get("/todos/changes")
+        async def todo_changes(
+            since: int = Query(ge=0),
+            user: User = Depends(self._get_current_user),
+        ):
+            """Todos changed and ids deleted after version `since`.
+
+            `since` is the X-Todos-Version of a list or the `version` of an
+            earlier answer. Clients apply `todos` before `deleted`; a 410 means
+            they have to reload the list instead.
+            """
+            changes = await self.task_manager.get_changes(user.id, since)
+            if changes is None:
+                raise HTTPException(
+                    status_code=status.HTTP_410_GONE,
+                    detail="Changes are no longer available, reload the list",
+                )
+            return ORJSONResponse(
+                {
+                    "version": changes.version,
+                    "todos": changes.todos,
+                    "deleted": changes.deleted_ids,
+                },
+                headers={"Cache-Control": "no-store"},
+            )
+
+        @self.app.get("/todos/export")
+        async def export_todos(user: User = Depends(self._get_current_user)):
+            """All the user's todos as NDJSON, streamed as they are read."""
+            return StreamingResponse(
+                self._export_lines(user.id),
+                media_type=NDJSON_MEDIA_TYPE,
+                headers={"Content-Disposition": 'attachment; filename="todos.ndjson"'},
+            )
+
+        @self.app.post("/todos/import")
+        async def import_todos(
+            request: Request, user: User = Depends(self._get_current_user)
+        ):
+            """Create a todo for every NDJSON line of the body, as it arrives.
+
+            Each line has a `title`, a `description` and an optional `is_done`.
+            """
+            todos = aread_new_todos(aread_lines(request.stream()), user.id)
+            try:
+                count = await self.task_manager.import_tasks(user.id, todos)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+                )
+            return {"imported": count}
+
+        @self.app.get("/todos/events")
+        async def todo_events(
+            since: int | None = Query(default=None, ge=0),
+            last_event_id: int | None = Header(default=None),
+            user: User = Depends(self._get_current_user),
+        ):
+            """Server-sent events for every change to the user's todos.
+
+            Resumes after `since` (or the Last-Event-ID of a reconnecting
+            EventSource); without either only new changes are sent.
+            """
+            if since is None:
+                since = last_event_id
+            if since is None:
+                since = await self._latest_seq(user.id)
+            return StreamingResponse(
+                self._stream_events(user.id, since),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
 
         @self.app.post("/todo", status_code=201)
-        def add_todo(item: TodoModel, user: User = Depends(self._get_current_user)):
-            new_todo = self.task_manager.create_task(
+        async def add_todo(
+            item: TodoModel, user: User = Depends(self._get_current_user)
+        ):
+            new_todo = await self.task_manager.create_task(
                 user.id, item.title, item.description, item.is_done
             )
-            return {"message": "Todo added successfully", "todo": new_todo.__dict__}
+            return ORJSONResponse(
+                {"message": "Todo added successfully", "todo": new_todo},
+                status_code=201,
+            )
+
+        @self.app.post("/todos/batch")
+        async def apply_todo_batch(
+            batch: TodoBatchModel, user: User = Depends(self._get_current_user)
+        ):
+            try:
+                results = await self.task_manager.apply_batch(
+                    user.id, batch.to_operations(user.id)
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            return ORJSONResponse(
+                {"message": "Batch applied successfully", "results": results}
+            )
+
+        @self.app.delete("/todos")
+        async def delete_todos(
+            ids: list[int] = Query(min_length=1, max_length=TRANSFER_CHUNK),
+            user: User = Depends(self._get_current_user),
+        ):
+            """Delete the todos of every `ids` parameter, all or none."""
+            try:
+                count = await self.task_manager.delete_tasks(user.id, ids)
+            except ValueError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            return {"deleted": count}
+
+        @self.app.delete("/todos/completed")
+        async def purge_completed_todos(user: User = Depends(self._get_current_user)):
+            """Delete every done todo of the user."""
+            return {"deleted": await self.task_manager.purge_completed(user.id)}
 
         @self.app.put("/todo/{todo_id}")
-        def update_todo(
+        async def update_todo(
             todo_id: int,
             item: TodoUpdateModel,
             user: User = Depends(self._get_current_user),
         ):
             try:
-                updated_task = self.task_manager.update_task(
-                    user.id, todo_id, item.title, item.description
+                updated_task = await self.task_manager.update_task(
+                    user.id, todo_id, item.title, item.description, item.is_done
+                )
+                return ORJSONResponse(
+                    {"message": "Todo updated successfully", "todo": updated_task}
                 )
-                if item.is_done is not None:
-                    updated_task = self.task_manager.set_task_status(
-                        user.id, todo_id, item.is_done
-                    )
-                return {
-                    "message": "Todo updated successfully",
-                    "todo": updated_task.__dict__,
-                }
             except Exception as e:
                 raise HTTPException(status_code=404, detail=str(e))
 
         @self.app.delete("/todo/{todo_id}", status_code=204)
-        def delete_todo(todo_id: int, user: User = Depends(self._get_current_user)):
+        async def delete_todo(
+            todo_id: int, user: User = Depends(self._get_current_user)
+        ):
             try:
-                self.task_manager.delete_task(user.id, todo_id)
+                await self.task_manager.delete_task(user.id, todo_id)
             except Exception as e:
                 raise HTTPException(status_code=404, detail=str(e))
 
     def run(self):
         import uvicorn
 
-        uvicorn.run(self.app, host="0.0.0.0", port=8000)
+        uvicorn.run(self.app, host=HOST, port=PORT, timeout_graceful_shutdown=5)
+
+    @staticmethod
+    def run_workers(app_factory: str, workers: int):
+        """Serve the app built by `app_factory` ("module:function") from
+        `workers` processes sharing the port."""
+        import uvicorn
+
+        uvicorn.run(
+            app_factory,
+            factory=True,
+            workers=workers,
+            host=HOST,
+            port=PORT,
+            # event streams never end on their own
+            timeout_graceful_shutdown=5,
+        )
@@ -0,0 +1,148 @@
+"""Bytes on the wire and latency of `GET /todos`, with and without compression.
+
+Seeds one user per list size through the in-process app of TodoWebUI, then
+fetches their whole list `--requests` times for each Accept-Encoding. For each
+case the report gives:
+
+- the response size, before and after compression;
+- the server latency percentiles;
+- the time the body would take to cross a link of `--mbps`, which is where
+  compression pays off.
+
+    uv run python -m benchmarks.compression --todos 10 100 1000 10000 \\
+        --output compression.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import time
+
+import httpx
+
+from app.manager import AsyncTaskManager, AsyncUserManager
+from app.storages.base import NewTodo, NewUser
+from app.ui import TodoWebUI
+from app.ui.compression import ENCODINGS
+from benchmarks.web_api import SEED_CHUNK, git_revision, summarize
+from main import get_async_storage
+
+
+async def seed(
+    user_manager: AsyncUserManager, task_manager: AsyncTaskManager, todos: int
+) -> dict[str, str]:
+    """A user with `todos` todos, and the headers that authenticate as them."""
+    user = await user_manager.storage.add_user(
+        NewUser(f"bench-{todos}", f"bench-{todos}@example.com", "x")
+    )
+    for start in range(0, todos, SEED_CHUNK):
+        await task_manager.apply_batch(
+            user.id,
+            [
+                NewTodo(
+                    user.id,
+                    f"todo {n}",
+                    f"seeded todo number {n} of the compression benchmark",
+                    n % 3 == 0,
+                )
+                for n in range(start, min(todos, start + SEED_CHUNK))
+            ],
+        )
+    token = user_manager.create_access_token(user.id, datetime.timedelta(hours=1))
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def measure(
+    client: httpx.AsyncClient,
+    headers: dict[str, str],
+    encoding: str,
+    requests: int,
+    mbps: float,
+) -> dict:
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(
+            "/todos", headers={**headers, "Accept-Encoding": encoding}
+        )
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    # httpx decodes the body; this counts the bytes as they were sent
+    wire_bytes = response.num_bytes_downloaded
+    latency = summarize(samples)
+    transfer_ms = wire_bytes * 8 / (mbps * 1e6) * 1000
+    return {
+        "encoding": response.headers.get("Content-Encoding", "identity"),
+        "body_bytes": len(response.content),
+        "wire_bytes": wire_bytes,
+        "ratio": round(len(response.content) / wire_bytes, 2),
+        **latency,
+        "transfer_ms": round(transfer_ms, 3),
+        "total_p50_ms": round(latency["p50_ms"] + transfer_ms, 3),
+    }
+
+
+async def main(args) -> dict:
+    user_storage, todo_storage = get_async_storage("memory")
+    user_manager = AsyncUserManager(storage=user_storage, secret_key="benchmark")
+    task_manager = AsyncTaskManager(storage=todo_storage)
+    ui = TodoWebUI(user_manager=user_manager, task_manager=task_manager)
+    results = []
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=ui.app), base_url="http://benchmark"
+    ) as client:
+        for todos in args.todos:
+            headers = await seed(user_manager, task_manager, todos)
+            for encoding in ["identity", *args.encodings]:
+                print(f"{todos} todos, {encoding}", file=sys.stderr)
+                result = await measure(
+                    client, headers, encoding, args.requests, args.mbps
+                )
+                results.append({"todos": todos, "accept_encoding": encoding, **result})
+    await ui.shutdown()
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "mbps": args.mbps,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Response compression benchmark")
+    parser.add_argument(
+        "--todos",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="List sizes to fetch",
+    )
+    parser.add_argument(
+        "--encodings",
+        nargs="+",
+        choices=ENCODINGS,
+        default=list(ENCODINGS),
+        help="Accept-Encoding values compared with identity",
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument(
+        "--mbps", type=float, default=20, help="Link speed for the transfer time"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
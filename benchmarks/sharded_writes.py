@@ -0,0 +1,99 @@
+"""Write throughput of the sharded SQLite storage by shard count.
+
+Each of `--processes` processes opens the storage and adds todos for its own
+users, one transaction per todo, as workers of `main.py --workers N` would.
+With one shard they all queue on a single SQLite write lock; with more, users
+in different shards write in parallel. Reports todos written per second as
+JSON:
+
+    uv run python -m benchmarks.sharded_writes --shards 1 2 4 8 --processes 8
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+
+from app.storages import get_sharded_sqlite_storage
+from app.storages.base import NewTodo, NewUser
+from benchmarks.web_api import git_revision
+
+
+def write(data_dir: str, user_ids: list[int], todos: int, start) -> float:
+    _, todo_storage = get_sharded_sqlite_storage(data_dir)
+    start.wait()
+    began = time.perf_counter()
+    for n in range(todos):
+        user_id = user_ids[n % len(user_ids)]
+        todo_storage.add(NewTodo(user_id, f"todo {n}", "written by the benchmark"))
+    elapsed = time.perf_counter() - began
+    todo_storage.close()
+    return elapsed
+
+
+def run(shards: int, processes: int, users: int, todos: int) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        user_storage, todo_storage = get_sharded_sqlite_storage(data_dir, shards)
+        user_ids = [
+            user_storage.add_user(NewUser(f"user{n}", f"user{n}@example.com", "x")).id
+            for n in range(users)
+        ]
+        user_storage.close()
+        todo_storage.close()
+        with multiprocessing.Manager() as manager:
+            start = manager.Barrier(processes + 1)
+            with multiprocessing.Pool(processes) as pool:
+                pending = pool.starmap_async(
+                    write,
+                    [
+                        (data_dir, user_ids[n::processes], todos, start)
+                        for n in range(processes)
+                    ],
+                )
+                start.wait()
+                began = time.perf_counter()
+                pending.get()
+                elapsed = time.perf_counter() - began
+    return {
+        "shards": shards,
+        "processes": processes,
+        "todos": processes * todos,
+        "seconds": round(elapsed, 3),
+        "todos_per_second": round(processes * todos / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded SQLite write benchmark")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--users", type=int, default=256)
+    parser.add_argument(
+        "--todos", type=int, default=500, help="Todos written by each process"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = []
+    for shards in args.shards:
+        print(f"{shards} shard(s)", file=sys.stderr)
+        results.append(run(shards, args.processes, args.users, args.todos))
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,403 @@
+"""Load test for the web API.
+
+Drives the FastAPI app of TodoWebUI with a mix of login, list, create, toggle
+and delete requests and reports latency percentiles and throughput as JSON.
+
+In-process, against every storage backend of `main.get_async_storage`:
+
+    uv run python -m benchmarks.web_api --storage memory file sqlite \\
+        --scale 10x100 --scale 100x1000 --output bench.json
+
+Against a server that is already running (`python main.py --ui web`):
+
+    uv run python -m benchmarks.web_api --url http://localhost:8000 --label sqlite
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+import httpx
+
+from app.manager import AsyncTaskManager, AsyncUserManager
+from app.password_executor import PasswordHashingExecutor
+from app.storages.base import NewTodo, NewUser
+from app.storages.write_behind import FlushPolicy
+from app.ui import TodoWebUI
+from main import get_async_storage
+
+PASSWORD = "benchmark-password"
+SEED_CHUNK = 1000
+
+# relative frequency of each operation in the request mix
+DEFAULT_MIX = {
+    "login": 1,
+    "list": 45,
+    "list_all": 4,
+    "create": 20,
+    "toggle": 20,
+    "delete": 10,
+}
+
+
+@dataclass
+class Session:
+    username: str
+    token: str
+    todo_ids: list[int] = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class Scale:
+    users: int
+    todos_per_user: int
+
+    @classmethod
+    def parse(cls, value: str) -> "Scale":
+        users, todos = value.lower().split("x")
+        return cls(int(users), int(todos))
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    position = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[position]
+
+
+def summarize(samples: list[float]) -> dict[str, float | int]:
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p90_ms": round(percentile(samples, 90) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+async def seed_in_process(
+    user_manager: AsyncUserManager, task_manager: AsyncTaskManager, scale: Scale
+) -> list[Session]:
+    """Create users and todos directly through the managers' storages."""
+    # bcrypt is deliberately slow; every seeded user shares one hash
+    hashed_password = user_manager.hash_password(PASSWORD)
+    sessions = []
+    for n in range(scale.users):
+        user = await user_manager.storage.add_user(
+            NewUser(
+                username=f"bench-{n}",
+                email=f"bench-{n}@example.com",
+                hashed_password=hashed_password,
+            )
+        )
+        token = user_manager.create_access_token(user.id, datetime.timedelta(hours=1))
+        session = Session(user.username, token)
+        for start in range(0, scale.todos_per_user, SEED_CHUNK):
+            count = min(SEED_CHUNK, scale.todos_per_user - start)
+            todos = await task_manager.apply_batch(
+                user.id,
+                [
+                    NewTodo(
+                        user.id, f"todo {start + i}", "seeded", (start + i) % 3 == 0
+                    )
+                    for i in range(count)
+                ],
+            )
+            session.todo_ids.extend(todo.id for todo in todos)
+        sessions.append(session)
+    return sessions
+
+
+async def seed_over_http(client: httpx.AsyncClient, scale: Scale) -> list[Session]:
+    """Create users and todos through the public API of a running server."""
+    run_id = f"{time.time_ns():x}"
+    sessions = []
+    for n in range(scale.users):
+        username = f"bench-{run_id}-{n}"
+        response = await client.post(
+            "/user",
+            json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": PASSWORD,
+            },
+        )
+        response.raise_for_status()
+        session = Session(username, response.json()["token"])
+        for start in range(0, scale.todos_per_user, SEED_CHUNK):
+            count = min(SEED_CHUNK, scale.todos_per_user - start)
+            response = await client.post(
+                "/todos/batch",
+                headers=session.headers,
+                json={
+                    "operations": [
+                        {
+                            "op": "create",
+                            "title": f"todo {start + i}",
+                            "description": "seeded",
+                            "is_done": (start + i) % 3 == 0,
+                        }
+                        for i in range(count)
+                    ]
+                },
+            )
+            response.raise_for_status()
+            session.todo_ids.extend(todo["id"] for todo in response.json()["results"])
+        sessions.append(session)
+    return sessions
+
+
+async def perform(
+    client: httpx.AsyncClient, operation: str, session: Session, rng: random.Random
+) -> httpx.Response:
+    if operation in ("toggle", "delete") and not session.todo_ids:
+        operation = "create"
+    if operation == "login":
+        response = await client.post(
+            "/token", data={"username": session.username, "password": PASSWORD}
+        )
+        if response.status_code == 200:
+            session.token = response.json()["access_token"]
+        return response
+    if operation == "list":
+        return await client.get(
+            "/todos", params={"order": "desc", "limit": 100}, headers=session.headers
+        )
+    if operation == "list_all":
+        return await client.get("/todos", headers=session.headers)
+    if operation == "create":
+        response = await client.post(
+            "/todo",
+            json={"title": "bench", "description": "created during the run"},
+            headers=session.headers,
+        )
+        if response.status_code == 201:
+            session.todo_ids.append(response.json()["todo"]["id"])
+        return response
+    if operation == "toggle":
+        todo_id = rng.choice(session.todo_ids)
+        return await client.put(
+            f"/todo/{todo_id}",
+            json={"is_done": rng.random() < 0.5},
+            headers=session.headers,
+        )
+    if operation == "delete":
+        todo_id = session.todo_ids.pop(rng.randrange(len(session.todo_ids)))
+        return await client.delete(f"/todo/{todo_id}", headers=session.headers)
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    sessions: list[Session],
+    mix: dict[str, int],
+    requests: int,
+    concurrency: int,
+    seed: int,
+) -> dict:
+    samples: dict[str, list[float]] = {operation: [] for operation in mix}
+    errors: dict[str, int] = {}
+    remaining = requests
+    operations, weights = list(mix), list(mix.values())
+
+    async def worker(index: int) -> None:
+        nonlocal remaining
+        rng = random.Random(seed + index)
+        # with enough users each worker owns a disjoint slice of them, so
+        # two workers never race to delete the same todo
+        own = sessions[index::concurrency] or sessions
+        while remaining > 0:
+            remaining -= 1
+            operation = rng.choices(operations, weights)[0]
+            session = rng.choice(own)
+            started = time.perf_counter()
+            response = await perform(client, operation, session, rng)
+            samples[operation].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                key = f"{operation}:{response.status_code}"
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    everything = [sample for values in samples.values() for sample in values]
+    return {
+        "requests": len(everything),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(everything) / elapsed, 1),
+        "errors": errors,
+        "overall": summarize(everything),
+        "operations": {name: summarize(values) for name, values in samples.items()},
+    }
+
+
+async def run_in_process(args, storage_type: str, scale: Scale) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        user_storage, todo_storage = get_async_storage(
+            storage_type,
+            data_dir=data_dir,
+            flush_policy=FlushPolicy() if args.write_behind else None,
+        )
+        password_executor = PasswordHashingExecutor(max_queue=None)
+        user_manager = AsyncUserManager(
+            storage=user_storage,
+            secret_key="benchmark",
+            password_executor=password_executor,
+        )
+        task_manager = AsyncTaskManager(storage=todo_storage)
+        ui = TodoWebUI(
+            user_manager=user_manager,
+            task_manager=task_manager,
+            password_executor=password_executor,
+        )
+        seeding_started = time.perf_counter()
+        sessions = await seed_in_process(user_manager, task_manager, scale)
+        seeding = time.perf_counter() - seeding_started
+        transport = httpx.ASGITransport(app=ui.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark"
+        ) as client:
+            result = await drive(
+                client, sessions, args.mix, args.requests, args.concurrency, args.seed
+            )
+        await ui.shutdown()
+    return {"seed_s": round(seeding, 3), **result}
+
+
+async def run_over_http(args, scale: Scale) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=60
+    ) as client:
+        seeding_started = time.perf_counter()
+        sessions = await seed_over_http(client, scale)
+        seeding = time.perf_counter() - seeding_started
+        result = await drive(
+            client, sessions, args.mix, args.requests, args.concurrency, args.seed
+        )
+    return {"seed_s": round(seeding, 3), **result}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+async def main(args) -> dict:
+    results = []
+    for scale in args.scale:
+        if args.url:
+            targets = [args.label]
+        else:
+            targets = args.storage
+        for target in targets:
+            print(
+                f"{target}: {scale.users} users x {scale.todos_per_user} todos",
+                file=sys.stderr,
+            )
+            if args.url:
+                result = await run_over_http(args, scale)
+            else:
+                result = await run_in_process(args, target, scale)
+            results.append(
+                {
+                    "backend": target,
+                    "mode": "http" if args.url else "in-process",
+                    "users": scale.users,
+                    "todos_per_user": scale.todos_per_user,
+                    "concurrency": args.concurrency,
+                    **result,
+                }
+            )
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "write_behind": args.write_behind,
+            "mix": args.mix,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Web API load test")
+    parser.add_argument(
+        "--storage",
+        nargs="+",
+        choices=["file", "memory", "sqlite", "sharded"],
+        default=["memory", "file", "sqlite"],
+        help="Backends to benchmark in-process",
+    )
+    parser.add_argument(
+        "--write-behind",
+        action="store_true",
+        help="Run the file backend with its default write-behind flush policy",
+    )
+    parser.add_argument(
+        "--url", help="Benchmark a running server instead of an in-process app"
+    )
+    parser.add_argument(
+        "--label", default="remote", help="Backend name reported for --url runs"
+    )
+    parser.add_argument(
+        "--scale",
+        type=Scale.parse,
+        action="append",
+        help="USERSxTODOS_PER_USER, may be repeated (default: 10x100 and 100x1000)",
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="Operation weights, e.g. list=50,create=25,toggle=25",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    args.scale = args.scale or [Scale(10, 100), Scale(100, 1000)]
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
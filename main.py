@@ -1,31 +1,112 @@
 import argparse
+import contextlib
+import getpass
+import json
 import os
+import sys
 
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.manager import TaskManager, UserManager
-from app.storages import get_file_storage, get_in_memory_storage, get_sqlite_storage
-from app.storages.base import TodoStorage, UserStorage
+from app.manager import AsyncTaskManager, AsyncUserManager, TaskManager, UserManager
+from app.password_executor import PasswordHashingExecutor
+from app.profiling import SamplingProfiler
+from app.storages import (
+    get_file_storage,
+    get_in_memory_storage,
+    get_sharded_sqlite_storage,
+    get_sqlite_storage,
+)
+from app.storages.async_adapter import to_async_storage
+from app.storages.async_sqlite_storage import get_async_sqlite_storage
+from app.storages.base import (
+    AsyncTodoStorage,
+    AsyncUserStorage,
+    TodoStorage,
+    UserStorage,
+)
+from app.storages.cached import CachePolicy, cache_async_storage, cache_storage
+from app.storages.transfer import dump_storage, load_storage
+from app.storages.write_behind import FlushPolicy
 from app.ui import TodoCLIUI, TodoWebUI
 
 load_dotenv()
 
+# storages that several worker processes can open at once
+SHAREABLE_STORAGES = ("file", "sqlite", "sharded")
+# how the parent process hands its arguments to `create_web_app` in the workers
+WORKER_ARGS_ENV = "TODO_APP_WORKER_ARGS"
 
-def get_storage(storage_type: str) -> tuple[UserStorage, TodoStorage]:
+
+def get_storage(
+    storage_type: str,
+    data_dir: str = ".",
+    flush_policy: FlushPolicy | None = None,
+    shared: bool = False,
+    cache_policy: CachePolicy | None = None,
+    shards: int | None = None,
+) -> tuple[UserStorage, TodoStorage]:
     if storage_type == "file":
-        return get_file_storage("data")
+        storages = get_file_storage(
+            os.path.join(data_dir, "data"), flush_policy, shared
+        )
     elif storage_type == "memory":
-        return get_in_memory_storage()
+        storages = get_in_memory_storage()
     elif storage_type == "sqlite":
-        return get_sqlite_storage("sqlite:///todos.db")
+        storages = get_sqlite_storage(f"sqlite:///{os.path.join(data_dir, 'todos.db')}")
+    elif storage_type == "sharded":
+        storages = get_sharded_sqlite_storage(data_dir, shards)
+    else:
+        raise ValueError(
+            "Invalid storage type. Use 'file', 'memory', 'sqlite' or 'sharded'."
+        )
+    if cache_policy is not None:
+        return cache_storage(*storages, cache_policy)
+    return storages
+
+
+def get_async_storage(
+    storage_type: str,
+    data_dir: str = ".",
+    flush_policy: FlushPolicy | None = None,
+    shared: bool = False,
+    cache_policy: CachePolicy | None = None,
+    shards: int | None = None,
+) -> tuple[AsyncUserStorage, AsyncTodoStorage]:
+    if storage_type == "sqlite":
+        storages = get_async_sqlite_storage(
+            f"sqlite+aiosqlite:///{os.path.join(data_dir, 'todos.db')}"
+        )
     else:
-        raise ValueError("Invalid storage type. Use 'file', 'memory', or 'sqlite'.")
+        user_storage, todo_storage = get_storage(
+            storage_type, data_dir, flush_policy, shared, shards=shards
+        )
+        # the memory backend never blocks, so it is called on the event loop
+        storages = to_async_storage(
+            user_storage, todo_storage, offload=storage_type != "memory"
+        )
+    if cache_policy is not None:
+        # cached on the event loop, so that hits skip any hop to a thread
+        return cache_async_storage(*storages, cache_policy)
+    return storages
 
 
-def get_ui(ui_type: str, user_manager: UserManager, task_manager: TaskManager):
+def get_ui(
+    ui_type: str,
+    user_manager: UserManager | AsyncUserManager,
+    task_manager: TaskManager | AsyncTaskManager,
+    password_executor: PasswordHashingExecutor | None = None,
+    profiler: SamplingProfiler | None = None,
+    shared: bool = False,
+):
     if ui_type == "web":
-        ui = TodoWebUI(user_manager=user_manager, task_manager=task_manager)
+        ui = TodoWebUI(
+            user_manager=user_manager,
+            task_manager=task_manager,
+            password_executor=password_executor,
+            profiler=profiler,
+            shared=shared,
+        )
 
         if os.getenv("IS_DEV_ENV") == "True":
             ui.app.add_middleware(
@@ -34,6 +115,12 @@ def get_ui(ui_type: str, user_manager: UserManager, task_manager: TaskManager):
                 allow_credentials=True,
                 allow_methods=["*"],
                 allow_headers=["*"],
+                expose_headers=[
+                    "ETag",
+                    "X-Next-After-Id",
+                    "X-Change-Seq",
+                    "X-Todos-Version",
+                ],
             )
 
         return ui
@@ -43,22 +130,255 @@ def get_ui(ui_type: str, user_manager: UserManager, task_manager: TaskManager):
         raise ValueError("Invalid UI type. Use 'cli' or 'web'.")
 
 
+def get_flush_policy(args: argparse.Namespace) -> FlushPolicy | None:
+    if not args.write_behind:
+        return None
+    return FlushPolicy(interval=args.flush_interval, max_pending=args.flush_batch)
+
+
+def get_cache_policy(args: argparse.Namespace) -> CachePolicy | None:
+    # kept as a string in `args`, which the workers receive as JSON
+    return CachePolicy.parse(args.cache) if args.cache else None
+
+
+def get_web_ui(args: argparse.Namespace) -> TodoWebUI:
+    shared = args.workers > 1
+    password_executor = PasswordHashingExecutor(
+        max_workers=args.password_workers, max_queue=args.password_queue
+    )
+    user_storage, todo_storage = get_async_storage(
+        args.storage,
+        flush_policy=get_flush_policy(args),
+        shared=shared,
+        cache_policy=get_cache_policy(args),
+        shards=args.shards,
+    )
+    # a worker only forgets the tokens of the users it changed itself, so with
+    # a cache the others would keep accepting the tokens of deleted users
+    token_cache = {"token_cache_size": 0} if shared else {}
+    user_manager = AsyncUserManager(
+        storage=user_storage,
+        secret_key=os.getenv("SECRET_KEY"),
+        password_executor=password_executor,
+        **token_cache,
+    )
+    task_manager = AsyncTaskManager(storage=todo_storage)
+    profiler = None
+    if args.profile_dir:
+        profiler = SamplingProfiler(args.profile_dir, every=args.profile_every)
+    return get_ui(
+        "web",
+        user_manager=user_manager,
+        task_manager=task_manager,
+        password_executor=password_executor,
+        profiler=profiler,
+        shared=shared,
+    )
+
+
+def open_path(path: str, mode: str):
+    """Open `path`, or stdin or stdout for '-'."""
+    if path == "-":
+        stream = sys.stdout if "w" in mode else sys.stdin
+        if "b" in mode:
+            stream = stream.buffer
+        return contextlib.nullcontext(stream)
+    return open(path, mode)
+
+
+def transfer(args: argparse.Namespace) -> None:
+    """Dump the storage to `--export` or load `--import` into it."""
+    user_storage, todo_storage = get_storage(
+        args.storage, flush_policy=get_flush_policy(args), shards=args.shards
+    )
+    try:
+        if args.export:
+            with open_path(args.export, "wb") as file:
+                file.writelines(dump_storage(user_storage, todo_storage))
+        else:
+            with open_path(args.import_, "rb") as file:
+                users, todos = load_storage(user_storage, todo_storage, file)
+            # stdout may be carrying a dump
+            print(f"Imported {users} user(s) and {todos} todo(s)", file=sys.stderr)
+    finally:
+        for storage in (user_storage, todo_storage):
+            storage.flush()
+            storage.close()
+
+
+def run_script(args: argparse.Namespace, service: TodoCLIUI) -> int:
+    """Log in as `--user` and run the `--script`; return how many commands failed."""
+    password = os.getenv("TODO_PASSWORD") or getpass.getpass()
+    try:
+        service.login(args.user, password)
+    except ValueError:
+        sys.exit("Error: Invalid username or password")
+    with open_path(args.script, "r") as file:
+        return service.run_batch(file)
+
+
+def create_web_app():
+    """App factory run by every worker process of `--workers`."""
+    args = argparse.Namespace(**json.loads(os.environ[WORKER_ARGS_ENV]))
+    return get_web_ui(args).app
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Todo Application")
     parser.add_argument(
         "--storage",
-        choices=["file", "memory", "sqlite"],
+        choices=["file", "memory", "sqlite", "sharded"],
         default="file",
         help="Type of storage to use",
     )
     parser.add_argument(
         "--ui", choices=["cli", "web"], default="cli", help="Type of UI to use"
     )
+    parser.add_argument(
+        "--password-workers",
+        type=int,
+        default=4,
+        help="Threads used for password hashing in the web UI",
+    )
+    parser.add_argument(
+        "--password-queue",
+        type=int,
+        default=64,
+        help="Pending password operations allowed before the web UI answers 503",
+    )
+    parser.add_argument(
+        "--write-behind",
+        action="store_true",
+        help="Buffer file storage writes in memory and flush them in batches",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between write-behind flushes",
+    )
+    parser.add_argument(
+        "--flush-batch",
+        type=int,
+        default=1000,
+        help="Buffered mutations that trigger an immediate write-behind flush",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes serving the web UI (0 for one per CPU core)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="Sample web requests and write their profiles to this directory",
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Profile one web request in N",
+    )
+    transfer_group = parser.add_mutually_exclusive_group()
+    transfer_group.add_argument(
+        "--export",
+        metavar="PATH",
+        help="Write every user and todo of the storage as NDJSON ('-' for stdout) "
+        "and exit",
+    )
+    transfer_group.add_argument(
+        "--import",
+        dest="import_",
+        metavar="PATH",
+        help="Load an --export dump ('-' for stdin) into the storage and exit",
+    )
+    parser.add_argument(
+        "--script",
+        metavar="PATH",
+        help="Run the CLI commands of a file ('-' for stdin) as --user and exit",
+    )
+    parser.add_argument(
+        "--user",
+        help="Username the --script runs as; the password is read from "
+        "TODO_PASSWORD or prompted for",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="SQLite files the sharded storage spreads users over when it is "
+        "created (4 by default); rebalance with "
+        "`python -m app.storages.sharded_sqlite_storage` to change it later",
+    )
+    parser.add_argument(
+        "--cache",
+        help="Cache reads in front of the storage, e.g. lru:10000 for LRU caches "
+        "of up to 10000 entries",
+    )
     args = parser.parse_args()
+    if args.cache:
+        try:
+            get_cache_policy(args)
+        except ValueError as e:
+            parser.error(f"--cache: {e}")
+    if args.shards is not None and args.storage != "sharded":
+        parser.error("--shards only applies to the sharded storage")
+    if args.script and (args.ui != "cli" or not args.user):
+        parser.error("--script needs --user and the CLI UI")
+    if args.profile_dir and args.ui != "web":
+        parser.error("--profile-dir only applies to the web UI")
+    if args.profile_every < 1:
+        parser.error("--profile-every must be at least 1")
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if args.workers > 1:
+        if args.ui != "web":
+            parser.error("--workers only applies to the web UI")
+        if args.storage not in SHAREABLE_STORAGES:
+            parser.error(
+                f"the {args.storage} storage cannot be shared by worker processes; "
+                f"use one of: {', '.join(SHAREABLE_STORAGES)}"
+            )
+        if args.write_behind:
+            parser.error("--write-behind buffers cannot be shared by workers")
+        if args.cache:
+            parser.error("--cache would serve stale reads to the other workers")
 
     # Setup
-    user_storage, todo_storage = get_storage(args.storage)
-    user_manager = UserManager(storage=user_storage, secret_key=os.getenv("SECRET_KEY"))
-    task_manager = TaskManager(storage=todo_storage)
-    service = get_ui(args.ui, user_manager=user_manager, task_manager=task_manager)
-    service.run()
+    if args.export or args.import_:
+        try:
+            transfer(args)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+    elif args.ui == "web" and args.workers > 1:
+        # create, import and migrate the storage once, before the workers open it
+        for storage in get_storage(args.storage, shared=True, shards=args.shards):
+            storage.close()
+        os.environ[WORKER_ARGS_ENV] = json.dumps(vars(args))
+        TodoWebUI.run_workers("main:create_web_app", args.workers)
+    elif args.ui == "web":
+        # the web UI flushes its storages from its shutdown handler
+        get_web_ui(args).run()
+    else:
+        user_storage, todo_storage = get_storage(
+            args.storage,
+            flush_policy=get_flush_policy(args),
+            cache_policy=get_cache_policy(args),
+            shards=args.shards,
+        )
+        user_manager = UserManager(
+            storage=user_storage, secret_key=os.getenv("SECRET_KEY")
+        )
+        task_manager = TaskManager(storage=todo_storage)
+        service = get_ui("cli", user_manager=user_manager, task_manager=task_manager)
+        try:
+            if args.script:
+                failed = run_script(args, service)
+            else:
+                service.run()
+        finally:
+            # closing stops the write-behind flushers after their last flush
+            for storage in (user_storage, todo_storage):
+                storage.close()
+        if args.script and failed:
+            sys.exit(1)
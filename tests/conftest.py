@@ -0,0 +1,53 @@
+import datetime
+
+import httpx
+import pytest
+
+from app.manager import AsyncTaskManager, AsyncUserManager
+from app.storages import (
+    get_file_storage,
+    get_in_memory_storage,
+    get_sharded_sqlite_storage,
+    get_sqlite_storage,
+)
+from app.storages.base import NewUser
+from app.ui import TodoWebUI
+from main import get_async_storage
+
+
+@pytest.fixture(params=["memory", "file", "sqlite", "sharded"])
+def storages(request, tmp_path):
+    """A user storage and a todo storage of each backend."""
+    if request.param == "memory":
+        storages = get_in_memory_storage()
+    elif request.param == "file":
+        storages = get_file_storage(str(tmp_path))
+    elif request.param == "sqlite":
+        storages = get_sqlite_storage(f"sqlite:///{tmp_path / 'todos.db'}")
+    else:
+        storages = get_sharded_sqlite_storage(str(tmp_path), 2)
+    yield storages
+    for storage in storages:
+        storage.close()
+
+
+@pytest.fixture
+def web():
+    """The web UI over memory storages, and a client signed in to it."""
+    user_storage, todo_storage = get_async_storage("memory")
+    user_manager = AsyncUserManager(storage=user_storage, secret_key="test")
+    ui = TodoWebUI(user_manager, AsyncTaskManager(storage=todo_storage))
+
+    async def client(username: str = "alice") -> httpx.AsyncClient:
+        user = await user_storage.add_user(
+            NewUser(username, f"{username}@example.com", "x")
+        )
+        token = user_manager.create_access_token(user.id, datetime.timedelta(hours=1))
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=ui.app),
+            base_url="http://test",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    yield client
+    ui.password_executor.shutdown()
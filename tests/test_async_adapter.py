@@ -0,0 +1,23 @@
+import asyncio
+
+from app.storages import get_file_storage
+from app.storages.async_adapter import to_async_storage
+from app.storages.base import NewTodo, NewUser
+from app.storages.write_behind import FlushPolicy
+
+
+def test_close_stops_the_write_behind_storages(tmp_path):
+    storages = get_file_storage(str(tmp_path), FlushPolicy(interval=60))
+    user_storage, todo_storage = to_async_storage(*storages)
+
+    async def run():
+        await user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+        await todo_storage.add(NewTodo(1, "buffered", ""))
+        await todo_storage.close()
+        await user_storage.close()
+
+    asyncio.run(run())
+    for storage in storages:
+        assert not storage._write_behind._thread.is_alive()
+    assert "buffered" in (tmp_path / "todo_log.jsonl").read_text()
+    assert "alice" in (tmp_path / "user_data.json").read_text()
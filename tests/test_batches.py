@@ -0,0 +1,61 @@
+import pytest
+
+from app.storages.base import NewTodo, NewUser, TodoDeletion, TodoToggle, TodoUpdate
+
+
+@pytest.fixture
+def todos(storages):
+    user_storage, todo_storage = storages
+    alice = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    bob = user_storage.add_user(NewUser("bob", "bob@example.com", "x"))
+    return (
+        todo_storage,
+        todo_storage.add(NewTodo(alice.id, "alice's", "")),
+        todo_storage.add(NewTodo(bob.id, "bob's", "")),
+    )
+
+
+def test_a_batch_applies_every_operation_in_order(todos):
+    todo_storage, todo, _ = todos
+    version = todo_storage.get_version(todo.user_id)
+
+    created, updated, toggled, deleted = todo_storage.apply_batch(
+        todo.user_id,
+        [
+            NewTodo(todo.user_id, "new", ""),
+            TodoUpdate(todo.id, title="renamed"),
+            TodoToggle(todo.id),
+            TodoDeletion(todo.id),
+        ],
+    )
+
+    assert created.title == "new" and created.user_id == todo.user_id
+    assert updated.title == "renamed" and not updated.is_done
+    assert toggled.is_done
+    assert deleted is None
+    assert todo_storage.get_tasks_by_user_id(todo.user_id) == [created]
+    assert todo_storage.get_version(todo.user_id) == version + 1
+
+
+@pytest.mark.parametrize(
+    "operation", [TodoUpdate(0, title="stolen"), TodoToggle(0), TodoDeletion(0)]
+)
+def test_a_batch_touching_another_users_todo_changes_nothing(todos, operation):
+    todo_storage, todo, other = todos
+    operation.todo_id = other.id
+    version = todo_storage.get_version(todo.user_id)
+
+    with pytest.raises(ValueError, match="Task not found"):
+        todo_storage.apply_batch(
+            todo.user_id,
+            [
+                NewTodo(todo.user_id, "new", ""),
+                TodoUpdate(todo.id, title="renamed"),
+                TodoDeletion(todo.id),
+                operation,
+            ],
+        )
+
+    assert todo_storage.get_tasks_by_user_id(todo.user_id) == [todo]
+    assert todo_storage.get_tasks_by_user_id(other.user_id) == [other]
+    assert todo_storage.get_version(todo.user_id) == version
@@ -0,0 +1,39 @@
+from app.storages import get_file_storage, get_in_memory_storage
+from app.storages.base import NewTodo
+from app.storages.cached import QUERIES_PER_USER, CachePolicy, cache_storage
+from app.storages.write_behind import FlushPolicy
+
+
+def test_flush_reaches_the_write_behind_storage(tmp_path):
+    user_storage, todo_storage = cache_storage(
+        *get_file_storage(str(tmp_path), FlushPolicy(interval=60)), CachePolicy(100)
+    )
+    todo_storage.add(NewTodo(1, "buffered", ""))
+    log = tmp_path / "todo_log.jsonl"
+    assert not log.exists() or log.stat().st_size == 0
+
+    todo_storage.flush()
+    assert "buffered" in log.read_text()
+
+    todo_storage.close()
+    user_storage.close()
+
+
+def test_list_results_are_bounded_per_user_and_in_all():
+    user_storage, todo_storage = cache_storage(
+        *get_in_memory_storage(), CachePolicy(100)
+    )
+    for user_id in range(1, 11):
+        todo_storage.add(NewTodo(user_id, f"todo of {user_id}", ""))
+
+    # a client paging through arbitrary cursors
+    for after_id in range(1000):
+        todo_storage.get_tasks_page(1, after_id=after_id, limit=5)
+    assert len(todo_storage.cache.lists) == QUERIES_PER_USER
+    assert todo_storage.get_tasks_page(1, limit=5)[0].title == "todo of 1"
+
+    for user_id in range(2, 11):
+        for limit in range(1, 40):
+            todo_storage.get_tasks_page(user_id, limit=limit)
+    assert len(todo_storage.cache.lists) <= 100
+    assert todo_storage.stats()["list_entries"] == len(todo_storage.cache.lists)
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from app.manager import TaskManager, UserManager
+from app.storages import get_in_memory_storage
+from app.storages.base import TRANSFER_CHUNK, NewUser
+from app.ui.cli_ui import TodoCLIUI
+
+
+@pytest.fixture
+def cli():
+    """A CLI signed in as a user, and the operation lists of its batches."""
+    user_storage, todo_storage = get_in_memory_storage()
+    user_manager = UserManager(storage=user_storage, secret_key="test")
+    task_manager = TaskManager(storage=todo_storage)
+    batches = []
+    apply_batch = todo_storage.apply_batch
+
+    def recorded_apply_batch(user_id, operations):
+        batches.append(list(operations))
+        return apply_batch(user_id, operations)
+
+    todo_storage.apply_batch = recorded_apply_batch
+    user = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    ui = TodoCLIUI(user_manager, task_manager)
+    ui.token = user_manager.create_access_token(user.id, datetime.timedelta(hours=1))
+    return ui, batches
+
+
+def test_consecutive_mutations_share_a_batch(cli, capsys):
+    ui, batches = cli
+    script = [
+        "# nightly maintenance",
+        "add --title one",
+        "add --title two --status yes",
+        "",
+        "toggle 1",
+        "list",
+        "delete 1 2",
+    ]
+    assert ui.run_batch(script) == 0
+    # the two deletions of one command go in the same batch
+    assert [len(batch) for batch in batches] == [3, 2]
+    out, err = capsys.readouterr()
+    assert "[1] [x] one: " in out
+    assert "Todo with ID 2 deleted." in out
+    assert "Ran 6 command(s)" in err
+    assert "2 storage batch(es), 0 failed" in err
+    assert ui.task_manager.get_tasks_by_user_id(ui.get_user().id) == []
+
+
+def test_mutations_are_applied_a_chunk_at_a_time(cli):
+    ui, batches = cli
+    script = [f"add --title 'todo {n}'" for n in range(TRANSFER_CHUNK + 1)]
+    assert ui.run_batch(script) == 0
+    assert [len(batch) for batch in batches] == [TRANSFER_CHUNK, 1]
+
+
+def test_a_rejected_batch_is_retried_one_command_at_a_time(cli, capsys):
+    ui, batches = cli
+    script = ["add --title one", "toggle 99", "add --title two", "delete 1"]
+    assert ui.run_batch(script) == 1
+    # the whole batch, then each command on its own
+    assert [len(batch) for batch in batches] == [4, 1, 1, 1, 1]
+    out, err = capsys.readouterr()
+    assert "Line 2: Error: Todo with ID 99 not found." in err
+    assert "Added Todo: [2] [ ] two: " in out
+    assert "3 storage batch(es), 1 failed" in err
+    titles = [
+        todo.title for todo in ui.task_manager.get_tasks_by_user_id(ui.get_user().id)
+    ]
+    assert titles == ["two"]
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from app.manager import TaskManager
+from app.storages.indexes import SortedSet
+
+
+def test_removed_items_are_compacted_away():
+    items = SortedSet()
+    for item in range(100):
+        items.add(item)
+    for item in range(0, 100, 2):
+        items.remove(item)
+    # half of them are tombstones, which is not yet worth a compaction
+    assert len(items._items) == 100
+    items.remove(1)
+    assert items._items == list(range(3, 100, 2))
+    assert len(items) == 49 and 1 not in items and 3 in items
+
+    items.remove(5)
+    items.add(5)
+    items.add(4)
+    assert items.to_list()[:3] == [3, 4, 5]
+
+
+def test_iteration_carries_on_across_a_compaction():
+    items = SortedSet()
+    for item in range(10):
+        items.add(item)
+    seen = []
+    for item in items.iter_from(2):
+        seen.append(item)
+        if item == 3:
+            for removed in range(4, 9):
+                items.remove(removed)
+    assert seen == [3, 9]
+    assert list(items.iter_from(9, descending=True)) == [3, 2, 1, 0]
+
+
+def test_bulk_deletes_are_checked_for_ownership(storages):
+    _, todo_storage = storages
+    manager = TaskManager(storage=todo_storage)
+    mine = [manager.create_task(1, f"mine {n}", "") for n in range(3)]
+    theirs = manager.create_task(2, "theirs", "")
+
+    with pytest.raises(ValueError):
+        manager.delete_tasks(1, [mine[0].id, theirs.id])
+    # all or nothing
+    assert manager.get_tasks_by_user_id(1) == mine
+    assert manager.get_tasks_by_user_id(2) == [theirs]
+
+    assert manager.delete_tasks(1, [mine[0].id, mine[1].id, mine[0].id]) == 2
+    assert manager.get_tasks_by_user_id(1) == [mine[2]]
+    assert manager.delete_tasks(1, []) == 0
+
+
+def test_completed_todos_are_purged(storages):
+    _, todo_storage = storages
+    manager = TaskManager(storage=todo_storage)
+    todos = [manager.create_task(1, f"todo {n}", "", n % 2 == 0) for n in range(9)]
+    theirs = manager.create_task(2, "theirs", "", is_done=True)
+
+    assert manager.purge_completed(1) == 5
+    assert manager.get_tasks_by_user_id(1) == [
+        todo for todo in todos if not todo.is_done
+    ]
+    assert manager.get_tasks_by_user_id(2) == [theirs]
+    assert manager.purge_completed(1) == 0
+
+
+def test_the_delete_route_never_touches_other_users_todos(web):
+    async def run():
+        async with await web("alice") as alice, await web("bob") as bob:
+            mine = [
+                (
+                    await alice.post("/todo", json={"title": t, "description": ""})
+                ).json()["todo"]
+                for t in ("a", "b", "c")
+            ]
+            theirs = (
+                await bob.post("/todo", json={"title": "b's", "description": ""})
+            ).json()["todo"]
+
+            response = await alice.delete(
+                "/todos", params={"ids": [mine[0]["id"], theirs["id"]]}
+            )
+            assert response.status_code == 404
+            assert len((await alice.get("/todos")).json()) == 3
+            assert len((await bob.get("/todos")).json()) == 1
+
+            response = await alice.delete(
+                "/todos", params={"ids": [mine[0]["id"], mine[1]["id"]]}
+            )
+            assert response.json() == {"deleted": 2}
+            await alice.put(f"/todo/{mine[2]['id']}", json={"is_done": True})
+            assert (await alice.delete("/todos/completed")).json() == {"deleted": 1}
+            assert (await alice.get("/todos")).json() == []
+            assert len((await bob.get("/todos")).json()) == 1
+
+    asyncio.run(run())
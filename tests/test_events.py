@@ -0,0 +1,122 @@
+import asyncio
+
+from app.events import ChangeFeed, PolledFeed
+from app.storages import get_file_storage
+from app.storages.async_adapter import to_async_storage
+from app.storages.base import NewTodo, TodoDeletion
+
+
+def test_polled_subscription_sees_changes_made_by_another_process(tmp_path):
+    # two storages sharing a directory stand in for two worker processes
+    _, this_worker = get_file_storage(str(tmp_path), shared=True)
+    _, other_worker = get_file_storage(str(tmp_path), shared=True)
+    _, storage = to_async_storage(None, this_worker)
+
+    async def run():
+        feed = PolledFeed(storage, interval=0.01)
+        subscription = feed.subscribe(1, 0)
+        assert await subscription.next(timeout=0.05) == []
+
+        todo = other_worker.add(NewTodo(1, "elsewhere", ""))
+        other_worker.add(NewTodo(2, "someone else's", ""))
+        events = await subscription.next(timeout=1)
+        assert [(e.type, e.todo_id, e.todo) for e in events] == [
+            ("update", todo.id, todo)
+        ]
+        assert events[0].seq == subscription.seq == 1
+
+        other_worker.apply_batch(1, [TodoDeletion(todo.id)])
+        events = await subscription.next(timeout=1)
+        assert [(e.seq, e.type, e.todo_id) for e in events] == [(2, "delete", todo.id)]
+
+        # a sequence number the storage never issued makes the client reload
+        lost = feed.subscribe(1, 99)
+        assert await lost.next(timeout=1) is None
+        assert lost.seq == 2
+        subscription.close()
+        lost.close()
+
+    asyncio.run(run())
+    this_worker.close()
+    other_worker.close()
+
+
+def test_streams_of_a_user_share_one_poller(tmp_path):
+    _, todo_storage = get_file_storage(str(tmp_path))
+    _, storage = to_async_storage(None, todo_storage)
+    polls = []
+    get_version = storage.get_version
+
+    async def counted_get_version(user_id):
+        polls.append(user_id)
+        return await get_version(user_id)
+
+    storage.get_version = counted_get_version
+
+    async def run():
+        feed = PolledFeed(storage, interval=0.01)
+        streams = [feed.subscribe(1, 0) for _ in range(10)]
+        other = feed.subscribe(2, 0)
+        await asyncio.sleep(0.1)
+        # about ten polls per user, rather than ten per stream
+        assert polls.count(1) < 20
+        assert polls.count(2) < 20
+
+        todo_storage.add(NewTodo(1, "new", ""))
+        for stream in streams:
+            assert [e.todo_id for e in await stream.next(timeout=1)] == [1]
+
+        for stream in [*streams, other]:
+            stream.close()
+        assert feed._pollers == {}
+        polls.clear()
+        await asyncio.sleep(0.05)
+        assert polls == []
+
+    asyncio.run(run())
+    todo_storage.close()
+
+
+def test_a_user_log_is_dropped_with_its_last_subscription():
+    feed = ChangeFeed()
+
+    async def run():
+        first = feed.subscribe(1, 0)
+        second = feed.subscribe(1, 0)
+        feed.publish(1, "create", 10)
+        assert [e.seq for e in await first.next(timeout=1)] == [1]
+        first.close()
+        assert 1 in feed._users
+        second.close()
+        assert feed._users == {}
+
+        # nobody follows the user now: their events are numbered, not kept
+        feed.publish(1, "update", 10)
+        assert feed.latest_seq(1) == 2
+        assert feed._users == {}
+
+        # a client that saw everything carries on; one that missed the
+        # unkept event reloads its list
+        assert await feed.subscribe(1, 2).next(timeout=0.01) == []
+        behind = feed.subscribe(1, 1)
+        assert await behind.next(timeout=0.01) is None
+        assert behind.seq == 2
+        feed.publish(1, "delete", 10)
+        assert [e.seq for e in await behind.next(timeout=1)] == [3]
+
+    asyncio.run(run())
+
+
+def test_events_beyond_the_history_are_missed():
+    feed = ChangeFeed(history=2)
+
+    async def run():
+        subscription = feed.subscribe(1, 0)
+        for todo_id in (10, 11, 12):
+            feed.publish(1, "create", todo_id)
+        assert feed.events_since(1, 0) is None
+        assert [e.todo_id for e in feed.events_since(1, 1)] == [11, 12]
+        assert await subscription.next(timeout=1) is None
+        assert subscription.seq == 3
+
+    asyncio.run(run())
@@ -0,0 +1,119 @@
+import json
+import threading
+
+from app.models import Todo
+from app.storages import get_file_storage
+from app.storages.base import NewTodo, TodoDeletion, TodoUpdate
+from app.storages.file_storage import FileTodoStorage
+
+
+def open_log(tmp_path, **kwargs) -> FileTodoStorage:
+    return FileTodoStorage(tmp_path / "todo_log.jsonl", **kwargs)
+
+
+def test_the_log_is_replayed_on_reopening(tmp_path):
+    storage = open_log(tmp_path)
+    kept = storage.add(NewTodo(1, "kept", "first"))
+    changed = storage.add(NewTodo(1, "changed", ""))
+    gone = storage.add(NewTodo(2, "gone", ""))
+    storage.apply_batch(1, [TodoUpdate(changed.id, title="renamed", is_done=True)])
+    storage.apply_batch(2, [TodoDeletion(gone.id)])
+    storage.close()
+
+    storage = open_log(tmp_path)
+    assert storage.get_tasks_by_user_id(1) == [
+        kept,
+        Todo(changed.id, 1, "renamed", "", True),
+    ]
+    assert storage.get_task_by_id(gone.id) is None
+    assert storage.add(NewTodo(2, "next", "")).id == gone.id + 1
+    storage.close()
+
+
+def test_a_torn_last_record_is_dropped(tmp_path):
+    storage = open_log(tmp_path)
+    todo = storage.add(NewTodo(1, "whole", ""))
+    storage.close()
+    log = tmp_path / "todo_log.jsonl"
+    size = log.stat().st_size
+    with open(log, "ab") as file:
+        # a crash in the middle of appending the next record
+        file.write(b'{"op":"put","todo":{"id":2,"user_id":1,"tit')
+
+    storage = open_log(tmp_path)
+    assert log.stat().st_size == size
+    assert storage.get_tasks_by_user_id(1) == [todo]
+    added = storage.add(NewTodo(1, "after the crash", ""))
+    storage.close()
+
+    storage = open_log(tmp_path)
+    assert storage.get_tasks_by_user_id(1) == [todo, added]
+    storage.close()
+
+
+def test_compaction_keeps_the_records_appended_meanwhile(tmp_path):
+    storage = open_log(tmp_path, compact_min_bytes=0)
+    todos = [storage.add(NewTodo(1, f"todo {n}", "")) for n in range(200)]
+    stop = threading.Event()
+
+    def append():
+        while not stop.is_set():
+            todos.append(storage.add(NewTodo(1, f"todo {len(todos)}", "")))
+            storage.apply_batch(1, [TodoUpdate(todos[0].id, title=f"{len(todos)}")])
+
+    appender = threading.Thread(target=append)
+    appender.start()
+    try:
+        for _ in range(20):
+            storage.compact()
+    finally:
+        stop.set()
+        appender.join()
+    first = storage.get_task_by_id(todos[0].id)
+    expected = [first, *todos[1:]]
+    assert storage.get_tasks_by_user_id(1) == expected
+    storage.close()
+
+    storage = open_log(tmp_path)
+    assert storage.get_tasks_by_user_id(1) == expected
+    storage.close()
+
+
+def test_a_legacy_json_store_is_imported(tmp_path):
+    data = {
+        "next_id": 8,
+        "todos": [
+            {"id": 3, "user_id": 1, "title": "a", "description": "", "is_done": True},
+            {"id": 7, "user_id": 2, "title": "b", "description": "x", "is_done": False},
+        ],
+    }
+    (tmp_path / "todo_data.json").write_text(json.dumps(data))
+
+    user_storage, storage = get_file_storage(str(tmp_path))
+    assert storage.get_tasks_by_user_id(1) == [Todo(3, 1, "a", "", True)]
+    assert storage.get_task_by_id(7) == Todo(7, 2, "b", "x", False)
+    assert storage.add(NewTodo(1, "new", "")).id == 8
+    assert not list(tmp_path.glob("*.tmp"))
+    storage.close()
+    user_storage.close()
+
+
+def test_shared_logs_catch_up_on_each_others_appends(tmp_path):
+    first = open_log(tmp_path, shared=True)
+    second = open_log(tmp_path, shared=True)
+    ids = []
+    for n in range(10):
+        storage = first if n % 2 == 0 else second
+        ids.append(storage.add(NewTodo(1, f"todo {n}", "")).id)
+    assert ids == sorted(set(ids))
+
+    second.apply_batch(1, [TodoDeletion(ids[0])])
+    for storage in (first, second):
+        assert [todo.id for todo in storage.get_tasks_by_user_id(1)] == ids[1:]
+
+    first.compact()
+    added = second.add(NewTodo(1, "after the compaction", ""))
+    assert added.id == ids[-1] + 1
+    assert first.get_task_by_id(added.id) == added
+    first.close()
+    second.close()
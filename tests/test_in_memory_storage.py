@@ -0,0 +1,50 @@
+from dataclasses import replace
+
+from app.storages import get_in_memory_storage
+from app.storages.base import NewTodo, NewUser
+
+
+def test_users_are_found_by_id_username_and_email():
+    users, _ = get_in_memory_storage()
+    alice = users.add_user(NewUser("alice", "alice@example.com", "x"))
+    bob = users.add_user(NewUser("bob", "bob@example.com", "y"))
+    assert users.get_user_by_id(bob.id) == bob
+    assert users.get_user_by_username("alice") == alice
+    assert users.get_user_by_email("bob@example.com") == bob
+
+    renamed = replace(alice, username="alicia", email="alicia@example.com")
+    assert users.update_user(renamed) == renamed
+    assert users.get_user_by_username("alice") is None
+    assert users.get_user_by_email("alice@example.com") is None
+    assert users.get_user_by_username("alicia") == renamed
+
+    users.delete_user(bob.id)
+    assert users.get_user_by_id(bob.id) is None
+    assert users.get_user_by_username("bob") is None
+    assert users.get_user_by_email("bob@example.com") is None
+    assert users.get_all_users() == [renamed]
+    assert users.update_user(bob) is None
+
+
+def test_todos_are_indexed_by_id_and_owner():
+    _, todos = get_in_memory_storage()
+    first = todos.add(NewTodo(1, "first", ""))
+    other = todos.add(NewTodo(2, "other", ""))
+    last = todos.add(NewTodo(1, "last", ""))
+    assert todos.get_task_by_id(other.id) == other
+    assert todos.get_tasks_by_user_id(1) == [first, last]
+
+    done = todos.update_status(first.id, True)
+    assert done.is_done and todos.get_task_by_id(first.id) == done
+    assert todos.update_status(99, True) is None
+
+    # handing a todo to another user moves it to their list, in id order
+    moved = todos.update(replace(last, user_id=2))
+    assert todos.get_tasks_by_user_id(1) == [done]
+    assert todos.get_tasks_by_user_id(2) == [other, moved]
+
+    todos.delete(other.id)
+    todos.delete(other.id)
+    assert todos.get_task_by_id(other.id) is None
+    assert todos.get_tasks_by_user_id(2) == [moved]
+    assert todos.get_tasks_by_user_id(3) == []
@@ -0,0 +1,28 @@
+import asyncio
+
+from app.metrics import Histogram, Instrumented
+
+
+class SlowExport:
+    async def export_todos(self):
+        for n in range(3):
+            await asyncio.sleep(0.02)
+            yield n
+
+    async def get_version(self, user_id):
+        return 7
+
+
+def test_async_generators_are_timed_over_the_whole_iteration():
+    histogram = Histogram("calls", "Calls.", ("component", "method"))
+    storage = Instrumented(SlowExport(), histogram, "storage", "SlowExport")
+
+    async def run():
+        assert await storage.get_version(1) == 7
+        return [n async for n in storage.export_todos()]
+
+    assert asyncio.run(run()) == [0, 1, 2]
+    counts, total = histogram._series[("SlowExport", "export_todos")]
+    assert sum(counts) == 1
+    assert total[0] >= 0.06
+    assert sum(histogram._series[("SlowExport", "get_version")][0]) == 1
@@ -0,0 +1,47 @@
+import asyncio
+import dataclasses
+
+import fastapi.routing
+import orjson
+import pytest
+
+from app.models import Todo, User
+
+
+def test_models_are_slotted_and_frozen():
+    todo = Todo(1, 2, "title", "description", False)
+    user = User(2, "alice", "hash", "alice@example.com", False)
+    for model in (todo, user):
+        assert not hasattr(model, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            model.id = 3
+    assert dataclasses.replace(todo, is_done=True).is_done
+    assert orjson.loads(orjson.dumps(todo)) == {
+        "id": 1,
+        "user_id": 2,
+        "title": "title",
+        "description": "description",
+        "is_done": False,
+    }
+
+
+def test_todo_routes_skip_the_generic_encoder(web, monkeypatch):
+    def jsonable_encoder(*args, **kwargs):
+        raise AssertionError("todos went through jsonable_encoder")
+
+    monkeypatch.setattr(fastapi.routing, "jsonable_encoder", jsonable_encoder)
+
+    async def run():
+        async with await web() as client:
+            created = await client.post(
+                "/todo", json={"title": "new", "description": "one"}
+            )
+            assert created.status_code == 201
+            listed = await client.get("/todos")
+            assert listed.headers["Content-Type"] == "application/json"
+            todo = listed.json()[0]
+            assert (todo["title"], todo["description"]) == ("new", "one")
+            updated = await client.put(f"/todo/{todo['id']}", json={"is_done": True})
+            assert updated.json()["todo"] == {**todo, "is_done": True}
+
+    asyncio.run(run())
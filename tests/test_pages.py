@@ -0,0 +1,73 @@
+import asyncio
+
+from app.models import Todo, User
+from app.ui.pages import TodoListPage
+from app.ui.web_ui import SESSION_COOKIE
+
+
+async def render(page: TodoListPage, user: User, version: int, todos: list) -> bytes:
+    async def rows():
+        for todo in todos:
+            yield todo
+
+    return b"".join([chunk async for chunk in page.render(user, version, rows())])
+
+
+def test_pages_are_cached_per_user_and_version():
+    page = TodoListPage()
+    alice = User(1, "alice", "x", "alice@example.com", False)
+    todos = [Todo(n, 1, f"todo {n}", "", False) for n in range(1, 4)]
+
+    html = asyncio.run(render(page, alice, 3, todos)).decode()
+    assert all(f"todo {n}" in html for n in range(1, 4))
+    assert b"".join(page.cached(alice, 3)).decode() == html
+    # a mutation bumps the version, a rename changes the header
+    assert page.cached(alice, 4) is None
+    renamed = User(1, "alicia", "x", "alice@example.com", False)
+    assert page.cached(renamed, 3) is None
+
+
+def test_only_changed_todos_are_rendered_again():
+    page = TodoListPage()
+    alice = User(1, "alice", "x", "alice@example.com", False)
+    todos = [Todo(n, 1, f"todo {n}", "", False) for n in range(1, 4)]
+    asyncio.run(render(page, alice, 3, todos))
+    assert page.items.misses == 3
+
+    todos[1] = Todo(2, 1, "renamed", "", True)
+    html = asyncio.run(render(page, alice, 4, todos)).decode()
+    assert "renamed" in html and "todo 2" not in html
+    assert (page.items.hits, page.items.misses) == (2, 4)
+
+
+def test_the_page_follows_mutations_and_revalidates(web):
+    async def run():
+        async with await web() as client:
+            token = client.headers.pop("Authorization").removeprefix("Bearer ")
+            assert "/login" in (await client.get("/")).text
+
+            client.cookies.set(SESSION_COOKIE, token)
+            created = await client.post(
+                "/todo", json={"title": "first", "description": ""}
+            )
+            todo_id = created.json()["todo"]["id"]
+            page = await client.get("/")
+            assert page.headers["Content-Type"] == "text/html; charset=utf-8"
+            assert 'value="first"' in page.text
+            etag = page.headers["ETag"]
+            unchanged = await client.get("/", headers={"If-None-Match": etag})
+            assert unchanged.status_code == 304
+            assert "Content-Length" not in page.headers
+            # whole this time, from the cache, rather than streamed
+            cached = await client.get("/")
+            assert cached.text == page.text
+            assert cached.headers["Content-Length"] == str(len(page.content))
+
+            await client.put(f"/todo/{todo_id}", json={"title": "second"})
+            changed = await client.get("/", headers={"If-None-Match": etag})
+            assert changed.status_code == 200
+            assert changed.headers["ETag"] != etag
+            assert 'value="second"' in changed.text
+            assert 'value="first"' not in changed.text
+
+    asyncio.run(run())
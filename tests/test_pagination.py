@@ -0,0 +1,74 @@
+import asyncio
+
+from app.storages.base import NewTodo
+
+
+def seed(todo_storage) -> list:
+    """Seven todos of user 1, every third one done, between two of user 2."""
+    todo_storage.add(NewTodo(2, "before", ""))
+    todos = [
+        todo_storage.add(NewTodo(1, f"todo {n}", "", n % 3 == 0)) for n in range(7)
+    ]
+    todo_storage.add(NewTodo(2, "after", ""))
+    return todos
+
+
+def test_pages_follow_the_id_cursor(storages):
+    _, todo_storage = storages
+    todos = seed(todo_storage)
+
+    first = todo_storage.get_tasks_page(1, limit=3)
+    assert first == todos[:3]
+    second = todo_storage.get_tasks_page(1, after_id=first[-1].id, limit=3)
+    assert second == todos[3:6]
+    assert todo_storage.get_tasks_page(1, after_id=second[-1].id, limit=3) == todos[6:]
+    assert todo_storage.get_tasks_page(1) == todos
+
+
+def test_pages_are_filtered_and_ordered_by_the_storage(storages):
+    _, todo_storage = storages
+    todos = seed(todo_storage)
+    done = [todo for todo in todos if todo.is_done]
+    newest_first = todos[::-1]
+
+    assert todo_storage.get_tasks_page(1, is_done=True) == done
+    assert todo_storage.get_tasks_page(1, after_id=done[0].id, is_done=True) == done[1:]
+    assert (
+        todo_storage.get_tasks_page(1, is_done=False, limit=2)
+        == [todo for todo in todos if not todo.is_done][:2]
+    )
+    assert todo_storage.get_tasks_page(1, descending=True, limit=4) == newest_first[:4]
+    assert (
+        todo_storage.get_tasks_page(1, after_id=newest_first[3].id, descending=True)
+        == newest_first[4:]
+    )
+    assert todo_storage.get_tasks_page(3, limit=10) == []
+
+
+def test_the_list_route_pages_through_the_todos(web):
+    async def run():
+        async with await web() as client:
+            await client.post(
+                "/todos/batch",
+                json={
+                    "operations": [
+                        {"op": "create", "title": f"todo {n}", "is_done": n % 2 == 1}
+                        for n in range(5)
+                    ]
+                },
+            )
+            titles = []
+            params = {"limit": 2, "order": "desc"}
+            while True:
+                page = await client.get("/todos", params=params)
+                titles += [todo["title"] for todo in page.json()]
+                if "X-Next-After-Id" not in page.headers:
+                    break
+                params["after_id"] = page.headers["X-Next-After-Id"]
+            assert titles == [f"todo {n}" for n in reversed(range(5))]
+
+            done = await client.get("/todos", params={"is_done": "true"})
+            assert [todo["title"] for todo in done.json()] == ["todo 1", "todo 3"]
+            assert (await client.get("/todos", params={"limit": 0})).status_code == 422
+
+    asyncio.run(run())
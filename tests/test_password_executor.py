@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from app.manager import AsyncTaskManager, AsyncUserManager
+from app.password_executor import PasswordExecutorBusy, PasswordHashingExecutor
+from app.storages.base import NewUser
+from app.ui import TodoWebUI
+from main import get_async_storage
+
+
+def test_calls_beyond_the_queue_are_rejected():
+    executor = PasswordHashingExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking() -> str:
+        started.set()
+        release.wait()
+        return "hashed"
+
+    async def run():
+        running = asyncio.ensure_future(executor.run(blocking))
+        await asyncio.to_thread(started.wait)
+        queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordExecutorBusy):
+            await executor.run(lambda: "rejected")
+        assert executor.stats()["queued"] == 1
+        assert executor.stats()["running"] == 1
+        release.set()
+        return await running, await queued
+
+    assert asyncio.run(run()) == ("hashed", "queued")
+    stats = executor.stats()
+    assert (stats["completed"], stats["rejected"], stats["peak_queued"]) == (2, 1, 1)
+    executor.shutdown()
+
+
+def test_a_full_queue_answers_503_with_retry_after():
+    user_storage, todo_storage = get_async_storage("memory")
+    executor = PasswordHashingExecutor(max_workers=1, max_queue=0)
+    ui = TodoWebUI(
+        AsyncUserManager(storage=user_storage, secret_key="test"),
+        AsyncTaskManager(storage=todo_storage),
+        password_executor=executor,
+    )
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=ui.app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/user",
+                json={
+                    "username": "alice",
+                    "email": "alice@example.com",
+                    "password": "secret",
+                },
+            )
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+            await user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+            response = await client.post(
+                "/token", data={"username": "alice", "password": "secret"}
+            )
+            assert response.status_code == 503
+
+    asyncio.run(run())
+    assert executor.stats()["rejected"] == 2
+    executor.shutdown()
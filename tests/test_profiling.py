@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+
+from app.manager import AsyncTaskManager, AsyncUserManager
+from app.profiling import SamplingProfiler
+from app.ui import TodoWebUI
+from main import get_async_storage
+
+
+def test_metrics_and_event_streams_are_not_profiled(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path))
+    assert not profiler.wants("/metrics")
+    assert not profiler.wants("/todos/events")
+    assert profiler.wants("/todos")
+    assert profiler.wants("/metricsfoo")
+
+
+def test_one_request_in_every_is_profiled(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), every=3)
+    assert [profiler.wants("/todos") for _ in range(6)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+
+
+def test_the_web_ui_writes_profiles_of_wanted_requests_only(tmp_path):
+    user_storage, todo_storage = get_async_storage("memory")
+    ui = TodoWebUI(
+        AsyncUserManager(storage=user_storage, secret_key="test"),
+        AsyncTaskManager(storage=todo_storage),
+        profiler=SamplingProfiler(str(tmp_path)),
+    )
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=ui.app), base_url="http://test"
+        ) as client:
+            assert (await client.get("/metrics")).status_code == 200
+            assert list(tmp_path.iterdir()) == []
+            assert (await client.get("/todos")).status_code == 401
+            assert [path.suffix for path in tmp_path.iterdir()] == [".folded"]
+
+    asyncio.run(run())
+    ui.password_executor.shutdown()
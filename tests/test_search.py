@@ -0,0 +1,45 @@
+import pytest
+
+from app.storages import get_file_storage, get_in_memory_storage, get_sqlite_storage
+from app.storages.base import NewTodo
+from app.storages.search import tokenize
+
+TODOS = [
+    ("foo_bar", "snake_case title"),
+    ("Café crème", "with diacritics"),
+    ("foobar", ""),
+    ("unrelated", "nothing to see"),
+]
+QUERIES = ["foo", "bar", "foo_bar", "cafe", "creme", "case", "snake", "nothing"]
+
+
+@pytest.fixture(params=["memory", "file", "sqlite"])
+def todo_storage(request, tmp_path):
+    if request.param == "memory":
+        storages = get_in_memory_storage()
+    elif request.param == "file":
+        storages = get_file_storage(str(tmp_path))
+    else:
+        storages = get_sqlite_storage(f"sqlite:///{tmp_path / 'todos.db'}")
+    for title, description in TODOS:
+        storages[1].add(NewTodo(1, title, description))
+    yield storages[1]
+    for storage in storages:
+        storage.close()
+
+
+def test_tokenize_splits_like_unicode61():
+    assert tokenize("Foo_bar-Café 42") == ["foo", "bar", "cafe", "42"]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_backends_find_the_same_todos(todo_storage, query):
+    expected = {
+        title
+        for title, description in TODOS
+        if all(
+            any(word.startswith(term) for word in tokenize(f"{title} {description}"))
+            for term in tokenize(query)
+        )
+    }
+    assert {todo.title for todo in todo_storage.search(1, query)} == expected
@@ -0,0 +1,66 @@
+import pytest
+
+from app.storages import get_sharded_sqlite_storage
+from app.storages.base import NewTodo, NewUser
+from app.storages.sharded_sqlite_storage import BUCKETS, plan_rebalance, rebalance
+
+
+def fill(data_dir, shards: int) -> dict[int, list[str]]:
+    user_storage, todo_storage = get_sharded_sqlite_storage(data_dir, shards)
+    titles = {}
+    for n in range(12):
+        user = user_storage.add_user(NewUser(f"user{n}", f"user{n}@example.com", "x"))
+        for m in range(5):
+            todo = todo_storage.add(NewTodo(user.id, f"todo {m} of user{n}", ""))
+            # a todo lives in the bucket, and so the shard, of its owner
+            assert todo.id % BUCKETS == user.id % BUCKETS
+            titles.setdefault(user.id, []).append(todo.title)
+    todo_storage.close()
+    user_storage.close()
+    return titles
+
+
+def test_users_are_spread_over_the_shards(tmp_path):
+    fill(str(tmp_path), 3)
+    _, todo_storage = get_sharded_sqlite_storage(str(tmp_path))
+    assert len(todo_storage.shards) == 3
+    assert {
+        todo_storage.bucket_shards[user_id % BUCKETS] for user_id in range(1, 13)
+    } == {
+        0,
+        1,
+        2,
+    }
+    todo_storage.close()
+
+
+def test_the_shard_count_is_fixed_at_creation(tmp_path):
+    fill(str(tmp_path), 3)
+    with pytest.raises(ValueError):
+        get_sharded_sqlite_storage(str(tmp_path), 5)
+
+
+@pytest.mark.parametrize("shards", [1, 2, 5])
+def test_rebalancing_keeps_every_todo(tmp_path, shards):
+    titles = fill(str(tmp_path), 3)
+    rebalance(str(tmp_path), shards)
+
+    user_storage, todo_storage = get_sharded_sqlite_storage(str(tmp_path))
+    assert len(todo_storage.shards) == shards
+    counts = [todo_storage.bucket_shards.count(shard) for shard in range(shards)]
+    assert max(counts) - min(counts) <= 1
+    for user_id, expected in titles.items():
+        todos = todo_storage.get_tasks_by_user_id(user_id)
+        assert [todo.title for todo in todos] == expected
+    assert len(list(todo_storage.export_todos())) == 60
+    # ids allocated after the move stay unique
+    added = todo_storage.add(NewTodo(1, "after", ""))
+    assert todo_storage.get_task_by_id(added.id).title == "after"
+    assert len(todo_storage.get_tasks_by_user_id(1)) == 6
+    todo_storage.close()
+    user_storage.close()
+
+
+def test_rebalancing_to_the_same_layout_moves_nothing():
+    layout = [bucket % 4 for bucket in range(BUCKETS)]
+    assert plan_rebalance(layout, 4) == layout
@@ -0,0 +1,51 @@
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from app.storages import get_sqlite_storage
+from app.storages.base import NewTodo
+from app.storages.sqlite_storage import SQLiteEngineProfile, create_sqlite_engine
+
+
+def pragmas(connection) -> tuple:
+    return tuple(
+        connection.execute(text(f"PRAGMA {name}")).scalar()
+        for name in ("journal_mode", "synchronous", "cache_size", "busy_timeout")
+    )
+
+
+def test_every_pooled_connection_gets_the_profile(tmp_path):
+    engine = create_sqlite_engine(
+        f"sqlite:///{tmp_path / 'todos.db'}",
+        SQLiteEngineProfile(cache_size=-1024, busy_timeout_ms=250, pool_size=2),
+    )
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 2
+    # two connections at once, so the second one is opened afresh
+    with engine.connect() as first, engine.connect() as second:
+        # synchronous=NORMAL reads back as 1
+        assert pragmas(first) == pragmas(second) == ("wal", 1, -1024, 250)
+    engine.dispose()
+
+
+def test_readers_do_not_wait_behind_a_writer(tmp_path):
+    engine = create_sqlite_engine(
+        f"sqlite:///{tmp_path / 'todos.db'}",
+        SQLiteEngineProfile(busy_timeout_ms=0),
+    )
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("INSERT INTO items VALUES (1)"))
+    with engine.connect() as writer, engine.connect() as reader:
+        writer.execute(text("BEGIN EXCLUSIVE"))
+        writer.execute(text("INSERT INTO items VALUES (2)"))
+        # without WAL this read would fail at once with "database is locked"
+        assert reader.execute(text("SELECT count(*) FROM items")).scalar() == 1
+        writer.execute(text("COMMIT"))
+    engine.dispose()
+
+
+def test_in_memory_databases_share_one_connection():
+    user_storage, todo_storage = get_sqlite_storage("sqlite://")
+    assert isinstance(todo_storage.SessionLocal.kw["bind"].pool, StaticPool)
+    todo = todo_storage.add(NewTodo(1, "kept", ""))
+    assert todo_storage.get_task_by_id(todo.id) == todo
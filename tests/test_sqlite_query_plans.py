@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event, text
+
+from app.storages import get_sqlite_storage
+from app.storages.base import NewTodo
+
+# the tables as they were before the indexes and migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR NOT NULL UNIQUE,
+    email VARCHAR NOT NULL UNIQUE,
+    hashed_password VARCHAR NOT NULL,
+    disabled BOOLEAN
+);
+CREATE TABLE todos (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    title VARCHAR NOT NULL,
+    description VARCHAR,
+    is_done BOOLEAN
+);
+INSERT INTO todos (user_id, title, description, is_done) VALUES (1, 'old', '', 0);
+"""
+
+PAGE_QUERIES = [
+    {},
+    {"is_done": False},
+    {"after_id": 1, "limit": 10},
+    {"after_id": 5, "limit": 10, "is_done": True, "descending": True},
+]
+
+
+@pytest.fixture(params=["fresh", "migrated"])
+def todo_storage(request, tmp_path):
+    path = tmp_path / "todos.db"
+    if request.param == "migrated":
+        with sqlite3.connect(path) as connection:
+            connection.executescript(BASELINE_SCHEMA)
+    user_storage, todo_storage = get_sqlite_storage(f"sqlite:///{path}")
+    todo_storage.add(NewTodo(1, "new", ""))
+    yield todo_storage
+    todo_storage.close()
+    user_storage.close()
+
+
+def query_plans(todo_storage, call) -> list[str]:
+    """The query plan of every SELECT on todos that `call` runs."""
+    engine = todo_storage.SessionLocal.kw["bind"]
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, many):
+        if statement.startswith("SELECT") and "FROM todos" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        call()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert statements
+    plans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            rows = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            )
+            plans.append(" / ".join(row.detail for row in rows))
+    return plans
+
+
+def assert_uses_user_index(plans: list[str]) -> None:
+    for plan in plans:
+        assert "USING INDEX ix_todos_user_id" in plan, plan
+        assert "SCAN todos" not in plan, plan
+
+
+def test_migration_records_the_schema_version(todo_storage):
+    engine = todo_storage.SessionLocal.kw["bind"]
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA user_version")).scalar() > 0
+        indexes = connection.execute(text("PRAGMA index_list(todos)")).all()
+    assert {"ix_todos_user_id", "ix_todos_user_id_is_done_id"} <= {
+        index.name for index in indexes
+    }
+
+
+def test_listing_a_users_todos_searches_the_user_index(todo_storage):
+    assert_uses_user_index(
+        query_plans(todo_storage, lambda: todo_storage.get_tasks_by_user_id(1))
+    )
+
+
+@pytest.mark.parametrize("page", PAGE_QUERIES)
+def test_pages_search_the_user_index(todo_storage, page):
+    assert_uses_user_index(
+        query_plans(todo_storage, lambda: todo_storage.get_tasks_page(1, **page))
+    )
@@ -0,0 +1,63 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from app.ui.static import IMMUTABLE, REVALIDATE, PrecompressedStaticFiles, precompress
+
+SCRIPT = b"function f() { return 1; }\n" * 1000
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "_next/static/chunks").mkdir(parents=True)
+    (tmp_path / "_next/static/chunks/main-0123abcd.js").write_bytes(SCRIPT)
+    (tmp_path / "index.html").write_text("<html>" + "<p>todo</p>" * 200 + "</html>")
+    (tmp_path / "tiny.js").write_text("x = 1")
+    assert precompress(tmp_path)["gzip"] == 2
+    assert precompress(tmp_path)["gzip"] == 0
+    app = Starlette()
+    app.mount("/static", PrecompressedStaticFiles(directory=tmp_path, html=True))
+    return TestClient(app)
+
+
+def test_hashed_assets_are_served_precompressed_and_immutable(client):
+    url = "/static/_next/static/chunks/main-0123abcd.js"
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Cache-Control"] == IMMUTABLE
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert "javascript" in compressed.headers["Content-Type"]
+    assert compressed.content == SCRIPT
+    assert int(compressed.headers["Content-Length"]) == len(
+        gzip.compress(SCRIPT, 9, mtime=0)
+    )
+
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.content == SCRIPT
+    assert plain.headers["ETag"] != compressed.headers["ETag"]
+
+    revalidated = client.get(
+        url,
+        headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": compressed.headers["ETag"],
+        },
+    )
+    assert revalidated.status_code == 304
+
+
+def test_pages_are_revalidated(client):
+    page = client.get("/static/", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    assert page.headers["Cache-Control"] == REVALIDATE
+    assert page.headers["Content-Encoding"] == "gzip"
+    refused = client.get("/static/", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in refused.headers
+
+
+def test_small_files_are_not_compressed(client):
+    tiny = client.get("/static/tiny.js", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in tiny.headers
+    assert "Vary" not in tiny.headers
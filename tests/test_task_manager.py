@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from app.events import ChangeFeed
+from app.manager import AsyncTaskManager, TaskManager
+from app.storages import get_in_memory_storage
+from app.storages.async_adapter import to_async_storage
+from app.storages.base import NewTodo
+
+
+def test_an_update_of_no_fields_changes_nothing(storages):
+    _, todo_storage = storages
+    feed = ChangeFeed()
+    manager = TaskManager(storage=todo_storage, feed=feed)
+    todo = manager.create_task(1, "title", "description")
+    version = todo_storage.get_version(1)
+    seq = feed.latest_seq(1)
+
+    assert manager.update_task(1, todo.id) == todo
+    assert todo_storage.get_version(1) == version
+    assert feed.latest_seq(1) == seq
+    assert todo_storage.get_task_by_id(todo.id) == todo
+    with pytest.raises(ValueError, match="Task not found"):
+        manager.update_task(2, todo.id)
+
+
+def test_an_async_update_of_no_fields_changes_nothing():
+    user_storage, todo_storage = get_in_memory_storage()
+    todo = todo_storage.add(NewTodo(1, "title", "description"))
+    feed = ChangeFeed()
+    manager = AsyncTaskManager(
+        storage=to_async_storage(user_storage, todo_storage)[1], feed=feed
+    )
+    version = todo_storage.get_version(1)
+    seq = feed.latest_seq(1)
+
+    async def run():
+        assert await manager.update_task(1, todo.id) == todo
+        updated = await manager.update_task(1, todo.id, is_done=True)
+        assert updated.is_done
+
+    asyncio.run(run())
+    assert todo_storage.get_version(1) == version + 1
+    assert feed.latest_seq(1) == seq + 1
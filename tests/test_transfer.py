@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from app.models import Todo
+from app.storages import get_in_memory_storage, get_sharded_sqlite_storage
+from app.storages.base import TRANSFER_CHUNK, NewTodo, NewUser
+from app.storages.sharded_sqlite_storage import ShardedSQLiteTodoStorage
+from app.storages.transfer import (
+    aread_lines,
+    aread_new_todos,
+    dump_storage,
+    encode,
+    load_storage,
+    read_new_todos,
+)
+
+
+def seeded_storages(todos: int):
+    """Memory storages with two users, the first of which has `todos` todos."""
+    user_storage, todo_storage = get_in_memory_storage()
+    alice = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    bob = user_storage.add_user(NewUser("bob", "bob@example.com", "y"))
+    todo_storage.apply_batch(
+        alice.id,
+        [NewTodo(alice.id, f"todo {n}", "", n % 2 == 0) for n in range(todos)],
+    )
+    todo_storage.add(NewTodo(bob.id, "bob's", "only"))
+    return user_storage, todo_storage
+
+
+def contents(todos: list[Todo]) -> list[tuple]:
+    return [
+        (todo.user_id, todo.title, todo.description, todo.is_done) for todo in todos
+    ]
+
+
+def test_a_dump_loads_into_an_empty_backend(storages):
+    source_users, source_todos = seeded_storages(TRANSFER_CHUNK + 5)
+    dump = list(dump_storage(source_users, source_todos))
+    user_storage, todo_storage = storages
+
+    assert load_storage(user_storage, todo_storage, dump) == (2, TRANSFER_CHUNK + 6)
+    assert user_storage.get_all_users() == source_users.get_all_users()
+    for user in source_users.get_all_users():
+        expected = source_todos.get_tasks_by_user_id(user.id)
+        loaded = todo_storage.get_tasks_by_user_id(user.id)
+        if isinstance(todo_storage, ShardedSQLiteTodoStorage):
+            # each shard numbers its todos itself
+            assert contents(loaded) == contents(expected)
+        else:
+            assert loaded == expected
+
+
+def test_the_sharded_backend_gives_loaded_todos_new_ids(tmp_path):
+    source_users, source_todos = seeded_storages(3)
+    user_storage, todo_storage = get_sharded_sqlite_storage(str(tmp_path), 2)
+    load_storage(user_storage, todo_storage, dump_storage(source_users, source_todos))
+    alice = user_storage.get_user_by_username("alice")
+    loaded = todo_storage.get_tasks_by_user_id(alice.id)
+    source = source_todos.get_tasks_by_user_id(alice.id)
+    assert contents(loaded) == contents(source)
+    # the ids name the shard of their owner
+    assert {todo.id for todo in loaded}.isdisjoint(todo.id for todo in source)
+    for todo in loaded:
+        assert todo_storage.get_task_by_id(todo.id) == todo
+    for storage in (user_storage, todo_storage):
+        storage.close()
+
+
+def test_users_are_streamed_into_their_storage():
+    source_users, source_todos = seeded_storages(1)
+    user_storage, todo_storage = get_in_memory_storage()
+    read = []
+
+    def lines():
+        for line in dump_storage(source_users, source_todos):
+            read.append(line)
+            yield line
+
+    import_users = user_storage.import_users
+
+    def import_lazily(users):
+        users = iter(users)
+        first = next(users)
+        # the first user arrives before the second one is read
+        assert len(read) == 1
+        return import_users([first, *users])
+
+    user_storage.import_users = import_lazily
+    assert load_storage(user_storage, todo_storage, lines()) == (2, 2)
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        (b"{not json", "Line 2: not valid JSON"),
+        (b"[1, 2]", "Line 2: expected a JSON object"),
+        (b'{"todo": {"id": 1}}', "Line 2: expected a todo record"),
+    ],
+)
+def test_a_malformed_dump_is_rejected(line, error):
+    source_users, source_todos = seeded_storages(0)
+    user = encode({"user": source_users.get_user_by_id(1)})
+    user_storage, todo_storage = get_in_memory_storage()
+    with pytest.raises(ValueError, match=error):
+        load_storage(user_storage, todo_storage, [user, line])
+
+
+def test_new_todos_are_read_line_by_line():
+    lines = [
+        b'{"title": "a", "description": "first"}',
+        b"",
+        b'{"title": "b", "description": "", "is_done": true}',
+    ]
+    assert list(read_new_todos(lines, 7)) == [
+        NewTodo(7, "a", "first"),
+        NewTodo(7, "b", "", True),
+    ]
+    with pytest.raises(ValueError, match="Line 1: is_done must be a boolean"):
+        list(read_new_todos([b'{"title": "a", "description": "", "is_done": 1}'], 7))
+
+
+def test_lines_are_split_across_body_chunks():
+    async def chunks():
+        for chunk in [b'{"title": "a", "desc', b'ription": ""}\n{"title"', b': "b", ']:
+            yield chunk
+        yield b'"description": "x"}'
+
+    async def run():
+        return [todo async for todo in aread_new_todos(aread_lines(chunks()), 1)]
+
+    assert asyncio.run(run()) == [NewTodo(1, "a", ""), NewTodo(1, "b", "x")]
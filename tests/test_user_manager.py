@@ -0,0 +1,69 @@
+import asyncio
+
+from app.manager import AsyncUserManager, UserManager
+from app.storages import get_in_memory_storage
+from app.storages.async_adapter import AsyncUserStorageAdapter
+from app.storages.base import NewUser
+
+
+def test_update_and_delete_drop_cached_tokens():
+    user_storage, _ = get_in_memory_storage()
+    manager = UserManager(user_storage, "secret")
+    user = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    token = manager.create_access_token(user.id)
+    assert manager.get_user_by_token(token).username == "alice"
+
+    manager.update_user(user.id, username="alicia")
+    assert manager.get_user_by_token(token).username == "alicia"
+
+    manager.delete_user(user.id)
+    assert manager.get_user_by_token(token) is None
+
+
+def test_a_deletion_racing_with_a_lookup_is_not_undone_by_the_cache():
+    user_storage, _ = get_in_memory_storage()
+    manager = UserManager(user_storage, "secret")
+    user = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    token = manager.create_access_token(user.id)
+    read = user_storage.get_user_by_id
+
+    def read_then_delete(user_id):
+        # the user is read, then deleted before the lookup caches them
+        found = read(user_id)
+        manager.delete_user(user_id)
+        return found
+
+    user_storage.get_user_by_id = read_then_delete
+    assert manager.get_user_by_token(token) == user
+    user_storage.get_user_by_id = read
+    assert manager.get_user_by_token(token) is None
+
+
+def test_an_update_during_an_async_lookup_is_not_undone_by_the_cache():
+    user_storage, _ = get_in_memory_storage()
+    storage = AsyncUserStorageAdapter(user_storage, offload=False)
+    manager = AsyncUserManager(storage, "secret")
+    user = user_storage.add_user(NewUser("alice", "alice@example.com", "x"))
+    token = manager.create_access_token(user.id)
+    read = storage.get_user_by_id
+
+    async def run():
+        reading = asyncio.Event()
+        updated = asyncio.Event()
+
+        async def slow_read(user_id):
+            found = await read(user_id)
+            reading.set()
+            await updated.wait()
+            return found
+
+        storage.get_user_by_id = slow_read
+        lookup = asyncio.create_task(manager.get_user_by_token(token))
+        await reading.wait()
+        storage.get_user_by_id = read
+        await manager.update_user(user.id, username="alicia")
+        updated.set()
+        assert (await lookup).username == "alice"
+        assert (await manager.get_user_by_token(token)).username == "alicia"
+
+    asyncio.run(run())
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from app.storages.base import TRANSFER_CHUNK
+
+
+def test_lists_are_revalidated_by_etag(web):
+    async def run():
+        async with await web() as client:
+            listed = await client.get("/todos")
+            etag = listed.headers["ETag"]
+            unchanged = await client.get("/todos", headers={"If-None-Match": etag})
+            assert unchanged.status_code == 304
+            assert unchanged.headers["ETag"] == etag
+
+            await client.post("/todo", json={"title": "new", "description": ""})
+            changed = await client.get("/todos", headers={"If-None-Match": etag})
+            assert changed.status_code == 200
+            assert changed.headers["ETag"] != etag
+            assert [todo["title"] for todo in changed.json()] == ["new"]
+
+    asyncio.run(run())
+
+
+def test_compressed_lists_are_revalidated_by_their_weak_etag(web):
+    async def run():
+        async with await web() as client:
+            await client.post(
+                "/todos/batch",
+                json={
+                    "operations": [
+                        {"op": "create", "title": f"todo {n}"} for n in range(50)
+                    ]
+                },
+            )
+            listed = await client.get("/todos", headers={"Accept-Encoding": "gzip"})
+            assert listed.headers["Content-Encoding"] == "gzip"
+            assert listed.headers["ETag"].startswith("W/")
+            unchanged = await client.get(
+                "/todos",
+                headers={
+                    "Accept-Encoding": "gzip",
+                    "If-None-Match": listed.headers["ETag"],
+                },
+            )
+            assert unchanged.status_code == 304
+
+    asyncio.run(run())
+
+
+def test_changes_since_a_version(web):
+    async def run():
+        async with await web() as client:
+            kept = (
+                await client.post("/todo", json={"title": "kept", "description": ""})
+            ).json()["todo"]
+            gone = (
+                await client.post("/todo", json={"title": "gone", "description": ""})
+            ).json()["todo"]
+            since = int((await client.get("/todos")).headers["X-Todos-Version"])
+
+            await client.put(f"/todo/{kept['id']}", json={"is_done": True})
+            await client.delete(f"/todo/{gone['id']}")
+            changes = (
+                await client.get("/todos/changes", params={"since": since})
+            ).json()
+            assert changes["version"] == since + 2
+            assert [(todo["id"], todo["is_done"]) for todo in changes["todos"]] == [
+                (kept["id"], True)
+            ]
+            assert changes["deleted"] == [gone["id"]]
+
+            latest = await client.get("/todos/changes", params={"since": since + 2})
+            assert latest.json() == {"version": since + 2, "todos": [], "deleted": []}
+            unknown = await client.get("/todos/changes", params={"since": since + 3})
+            assert unknown.status_code == 410
+
+    asyncio.run(run())
+
+
+def test_exported_todos_import_into_another_account(web):
+    todos = TRANSFER_CHUNK + 1
+    body = b"".join(
+        b'{"title": "todo %d", "description": "", "is_done": %s}\n'
+        % (n, b"true" if n % 2 else b"false")
+        for n in range(todos)
+    )
+
+    async def run():
+        async with await web("alice") as alice, await web("bob") as bob:
+            imported = await alice.post("/todos/import", content=body)
+            assert imported.json() == {"imported": todos}
+            exported = await alice.get("/todos/export")
+            assert exported.headers["Content-Type"] == "application/x-ndjson"
+            assert len(exported.content.splitlines()) == todos
+
+            imported = await bob.post("/todos/import", content=exported.content)
+            assert imported.json() == {"imported": todos}
+            originals = (await alice.get("/todos")).json()
+            copies = (await bob.get("/todos")).json()
+            assert [(t["title"], t["is_done"]) for t in copies] == [
+                (t["title"], t["is_done"]) for t in originals
+            ]
+            assert {t["id"] for t in copies}.isdisjoint(t["id"] for t in originals)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"title": "a", "description": ""}\n{not json\n',
+        b"[1, 2]\n",
+        b'{"title": 1, "description": ""}\n',
+        b'{"title": "a", "description": "", "is_done": "yes"}\n',
+        b'{"title": "\xff", "description": ""}\n',
+    ],
+)
+def test_malformed_imports_are_rejected(web, body):
+    async def run():
+        async with await web() as client:
+            response = await client.post("/todos/import", content=body)
+            assert response.status_code == 400
+            assert "Line" in response.json()["detail"]
+            assert (await client.get("/todos")).json() == []
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+
+from app.storages.base import NewUser
+from main import get_web_ui
+
+
+def worker_args(**overrides) -> argparse.Namespace:
+    args = {
+        "storage": "file",
+        "workers": 2,
+        "password_workers": 1,
+        "password_queue": 8,
+        "write_behind": False,
+        "cache": None,
+        "shards": None,
+        "profile_dir": None,
+        "profile_every": 1,
+    }
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_a_user_deleted_by_one_worker_is_rejected_by_the_others(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SECRET_KEY", "secret")
+    this_worker, other_worker = get_web_ui(worker_args()), get_web_ui(worker_args())
+
+    async def run():
+        user = await this_worker.user_manager.storage.add_user(
+            NewUser("alice", "alice@example.com", "x")
+        )
+        token = this_worker.user_manager.create_access_token(user.id)
+        assert await other_worker.user_manager.get_user_by_token(token) == user
+
+        await this_worker.user_manager.delete_user(user.id)
+        assert await other_worker.user_manager.get_user_by_token(token) is None
+
+        await this_worker.shutdown()
+        await other_worker.shutdown()
+
+    asyncio.run(run())
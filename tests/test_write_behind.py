@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+import pytest
+
+from app.storages import file_storage
+from app.storages.base import NewTodo, NewUser
+from app.storages.file_storage import FileTodoStorage, FileUserStorage
+from app.storages.write_behind import FlushPolicy, write_atomically
+
+# long enough that the background flusher never runs during a test
+NEVER = 3600.0
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def new_user(n: int) -> NewUser:
+    return NewUser(f"user{n}", f"user{n}@example.com", "hash")
+
+
+def test_user_mutations_are_coalesced_into_one_write(tmp_path, monkeypatch):
+    writes = []
+
+    def counting_write(path, data):
+        writes.append(path)
+        write_atomically(path, data)
+
+    monkeypatch.setattr(file_storage, "write_atomically", counting_write)
+    path = tmp_path / "users.json"
+    storage = FileUserStorage(path, flush_policy=FlushPolicy(interval=NEVER))
+    writes.clear()
+    for n in range(20):
+        storage.add_user(new_user(n))
+    assert writes == []
+    assert storage._write_behind.pending == 20
+    assert json.loads(path.read_text())["users"] == []
+
+    storage.flush()
+    assert len(writes) == 1
+    assert len(json.loads(path.read_text())["users"]) == 20
+    # nothing is pending, so there is nothing to write
+    storage.flush()
+    assert len(writes) == 1
+    storage.close()
+
+
+def test_a_full_batch_is_flushed_right_away(tmp_path):
+    path = tmp_path / "todo_log.jsonl"
+    storage = FileTodoStorage(
+        path, flush_policy=FlushPolicy(interval=NEVER, max_pending=5)
+    )
+    for n in range(4):
+        storage.add(NewTodo(1, f"todo {n}", ""))
+    assert path.stat().st_size == 0
+    storage.add(NewTodo(1, "todo 4", ""))
+    assert len(path.read_bytes().splitlines()) == 5
+    assert storage._write_behind.pending == 0
+    storage.close()
+
+
+def test_buffered_mutations_are_flushed_every_interval(tmp_path):
+    users = FileUserStorage(
+        tmp_path / "users.json", flush_policy=FlushPolicy(interval=0.01)
+    )
+    todos = FileTodoStorage(
+        tmp_path / "todo_log.jsonl", flush_policy=FlushPolicy(interval=0.01)
+    )
+    user = users.add_user(new_user(1))
+    todos.add(NewTodo(user.id, "flushed", ""))
+    wait_for(lambda: (tmp_path / "todo_log.jsonl").stat().st_size > 0)
+    wait_for(lambda: json.loads((tmp_path / "users.json").read_text())["users"] != [])
+    users.close()
+    todos.close()
+
+
+def test_close_persists_every_buffered_mutation(tmp_path):
+    policy = FlushPolicy(interval=NEVER)
+    users = FileUserStorage(tmp_path / "users.json", flush_policy=policy)
+    todos = FileTodoStorage(tmp_path / "todo_log.jsonl", flush_policy=policy)
+    user = users.add_user(new_user(1))
+    added = [todos.add(NewTodo(user.id, f"todo {n}", "")) for n in range(10)]
+    users.close()
+    todos.close()
+    assert not users._write_behind._thread.is_alive()
+    assert not todos._write_behind._thread.is_alive()
+
+    users = FileUserStorage(tmp_path / "users.json")
+    todos = FileTodoStorage(tmp_path / "todo_log.jsonl")
+    assert users.get_user_by_id(user.id) == user
+    assert todos.get_tasks_by_user_id(user.id) == added
+    todos.close()
+
+
+def test_write_atomically_replaces_the_file_whole(tmp_path):
+    path = str(tmp_path / "data.json")
+    write_atomically(path, b'{"version": 1}')
+    write_atomically(path, b'{"version": 2}')
+    assert json.loads(open(path).read()) == {"version": 2}
+    assert os.listdir(tmp_path) == ["data.json"]
+
+
+def test_a_failed_write_keeps_the_previous_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "data.json")
+    write_atomically(path, b'{"version": 1}')
+
+    def failing_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        write_atomically(path, b'{"version": 2}')
+    assert json.loads(open(path).read()) == {"version": 1}
+    # the temporary file is not left behind
+    assert os.listdir(tmp_path) == ["data.json"]